@@ -0,0 +1,182 @@
+"""
+Кеш результатов проверки доступа (/api/check-access).
+
+Разрешенные и отклоненные пользователи хранятся раздельно, со своими TTL и
+лимитами числа записей (LRU). Первый уровень - память процесса (монотонные
+часы). Второй, необязательный - файл SQLite, общий для всех воркеров на
+машине: воркер, не видевший пользователя, берет готовый результат оттуда.
+В SQLite сроки хранятся в обычном времени (time.time), так как монотонные
+часы разных процессов несравнимы. Время использования записи (для LRU)
+обновляется не чаще раза в touch_interval секунд - иначе каждое чтение было
+бы записью в общий файл.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+from log import get_logger
+
+
+log = get_logger(__name__)
+
+
+class SQLiteAccessStore:
+    """Общий для процессов кеш доступа в файле SQLite"""
+
+    def __init__(self, path, positive_max, negative_max, touch_interval=60.0):
+        self.path = path
+        self.limits = {True: positive_max, False: negative_max}
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS access_cache (
+                    user_id TEXT PRIMARY KEY,
+                    access INTEGER NOT NULL,
+                    user TEXT,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS access_cache_lru ON access_cache (access, last_used)')
+
+    def _connect(self):
+        # Соединение на поток; после fork открываем заново
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, user_id):
+        """Возвращает (access, user, осталось секунд) или None"""
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT access, user, expires_at, last_used FROM access_cache WHERE user_id = ? AND expires_at > ?',
+            (str(user_id), now)
+        ).fetchone()
+        if row is None:
+            return None
+        access, user, expires_at, last_used = row
+        if now - last_used >= self.touch_interval:
+            conn.execute('UPDATE access_cache SET last_used = ? WHERE user_id = ?', (now, str(user_id)))
+        return bool(access), json.loads(user) if user else None, expires_at - now
+
+    def set(self, user_id, access, user, ttl):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO access_cache (user_id, access, user, expires_at, last_used) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (str(user_id), int(access), json.dumps(user, ensure_ascii=False) if user else None, now + ttl, now)
+        )
+        # Вытесняем давно не использованные записи сверх лимита
+        conn.execute(
+            'DELETE FROM access_cache WHERE access = ? AND user_id IN ('
+            '  SELECT user_id FROM access_cache WHERE access = ? ORDER BY last_used DESC LIMIT -1 OFFSET ?'
+            ')',
+            (int(access), int(access), self.limits[access])
+        )
+
+    def delete(self, user_id):
+        self._connect().execute('DELETE FROM access_cache WHERE user_id = ?', (str(user_id),))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM access_cache')
+
+    def size(self):
+        return self._connect().execute('SELECT COUNT(*) FROM access_cache').fetchone()[0]
+
+
+class AccessCache:
+    """Двухуровневый кеш доступа: память процесса + необязательный общий SQLite"""
+
+    def __init__(self, positive_ttl, positive_max, negative_ttl, negative_max, shared_path=None):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.positive = TTLCache(ttl=positive_ttl, max_entries=positive_max, sizeof=lambda value: 0)
+        self.negative = TTLCache(ttl=negative_ttl, max_entries=negative_max, sizeof=lambda value: 0)
+        self.shared = SQLiteAccessStore(shared_path, positive_max, negative_max) if shared_path else None
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def get(self, user_id):
+        """{'access': bool, 'user': dict | None} или None, если результата нет"""
+        for tier in (self.positive, self.negative):
+            entry = tier.get(user_id)
+            if entry is not None:
+                self._count('hits')
+                return entry
+
+        if self.shared is not None:
+            try:
+                found = self.shared.get(user_id)
+            except sqlite3.Error as e:
+                log.warning('access_cache.shared_error', 'Общий кеш доступа недоступен', error=str(e))
+                found = None
+            if found is not None:
+                access, user, remaining = found
+                entry = {'access': access, 'user': user}
+                (self.positive if access else self.negative).set(user_id, entry, ttl=remaining)
+                self._count('shared_hits')
+                return entry
+
+        self._count('misses')
+        return None
+
+    def set(self, user_id, access, user):
+        entry = {'access': access, 'user': user}
+        tier, other = (self.positive, self.negative) if access else (self.negative, self.positive)
+        other.pop(user_id)
+        tier.set(user_id, entry)
+        if self.shared is not None:
+            try:
+                self.shared.set(user_id, access, user, self.positive_ttl if access else self.negative_ttl)
+            except sqlite3.Error as e:
+                log.warning('access_cache.shared_error', 'Общий кеш доступа недоступен', error=str(e))
+
+    def invalidate(self, user_id):
+        self.positive.pop(user_id)
+        self.negative.pop(user_id)
+        if self.shared is not None:
+            try:
+                self.shared.delete(user_id)
+            except sqlite3.Error as e:
+                # Другие воркеры увидят изменение по истечении TTL записи
+                log.warning('access_cache.shared_error', 'Общий кеш доступа недоступен', error=str(e))
+
+    def clear(self):
+        self.positive.clear()
+        self.negative.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, shared_hits, misses = self.hits, self.shared_hits, self.misses
+        lookups = hits + shared_hits + misses
+        positive = self.positive.stats()
+        negative = self.negative.stats()
+        return {
+            'positive': {key: positive[key] for key in ('entries', 'max_entries', 'ttl', 'evictions')},
+            'negative': {key: negative[key] for key in ('entries', 'max_entries', 'ttl', 'evictions')},
+            'hits': hits,
+            'shared_hits': shared_hits,
+            'misses': misses,
+            'hit_ratio': round((hits + shared_hits) / lookups, 4) if lookups else 0.0,
+            'shared': {'path': self.shared.path, 'entries': self.shared.size()} if self.shared else None,
+        }
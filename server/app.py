@@ -1,22 +1,201 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, send_file
 from flask_cors import CORS
 import requests
 import os
-import json
-import hmac
 import hashlib
-from datetime import datetime, timedelta
+import re
+import sys
+import time
+from datetime import datetime
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from werkzeug.http import parse_etags
 
+from access_cache import AccessCache
+from breaker import CircuitOpenError
+from cache import TTLCache
+from compression import Compressor
+from deadline import Deadline, DeadlineExceeded, DeadlineObserver, deadline_var, narrowed_context
+from health import HealthProber
+from images import BASKET_BOUNDS, DiskLRUCache, ImageNotFound, ImageProxy, content_type
+from instrumentation import (
+    BREAKER_STATES, UpstreamMetrics, registry as metrics_registry, request_finished, request_started,
+    stats_collector
+)
+from json_provider import FastJSONProvider
+from log import (
+    dropped_records, get_logger, new_request_id, request_id_var, request_level, route_var, setup_logging,
+    shutdown_logging
+)
+from metrics import SharedMetrics
+from products import ProductService, WBApiError, wb_detail_url
+from ratelimit import RateLimited, RateLimiter, priority_var
+from singleflight import SingleFlight, SingleFlightOverflow
+from stocks import WarehouseIndex, aggregate_sizes
+from streams import ProductStreamHub, StreamLimitError
+from telegram_auth import InitDataError, InitDataVerifier
+from upstream import UpstreamClient
+from user_store import UserStore
+from watchlist import WatchlistScheduler, WatchlistStore
+
+
+# Логи - JSON lines через очередь, без блокирующих записей в stdout в обработчиках
+setup_logging()
+log = get_logger('app')
 
 app = Flask(__name__)
-CORS(app)
+# Быстрый JSON (orjson, если установлен; JSON_PROVIDER=json - стандартный) и сжатие ответов
+app.json = FastJSONProvider(app, backend=os.environ.get('JSON_PROVIDER', 'auto'))
+compressor = Compressor(
+    min_size=int(os.environ.get('COMPRESS_MIN_SIZE', 1024)),
+    gzip_level=int(os.environ.get('COMPRESS_GZIP_LEVEL', 6)),
+    brotli_level=int(os.environ.get('COMPRESS_BROTLI_LEVEL', 4))
+)
+compressor.init_app(app)
+# X-* - метаданные ответов, которые передаются заголовками (потоковый nmInfo)
+NM_INFO_METADATA_HEADERS = ['X-Source', 'X-Status', 'X-Local-Api-Url', 'X-Nm-Id-Requested']
+# Access-Control-Max-Age: браузер не повторяет preflight для X-Telegram-Init-Data
+# на каждый запрос (Chrome ограничивает срок двумя часами)
+CORS_MAX_AGE = int(os.environ.get('CORS_MAX_AGE', 7200))
+CORS(app, expose_headers=NM_INFO_METADATA_HEADERS + ['X-Request-ID', 'Server-Timing'], max_age=CORS_MAX_AGE)
+
+# Идентификатор запроса: из X-Request-ID клиента/балансировщика или новый
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def request_id_from(header):
+    return header if header and REQUEST_ID_PATTERN.match(header) else new_request_id()
+
+
+# Бюджет времени запроса (deadline.py): заголовок X-Request-Timeout (секунды,
+# не больше REQUEST_DEADLINE_MAX) или значение по умолчанию для маршрута
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 15))
+REQUEST_DEADLINE_MAX = float(os.environ.get('REQUEST_DEADLINE_MAX', 60))
+ROUTE_DEADLINES = {
+    '/api/product/<int:product_id>/full': float(os.environ.get('FULL_REQUEST_DEADLINE', 8)),
+    '/api/wb/products': float(os.environ.get('WB_BATCH_REQUEST_DEADLINE', 20)),
+    # Поток событий открыт долго, а WB опрашивают фоновые потоки - срока нет
+    '/api/wb/product/<int:product_id>/stream': None,
+}
+
+
+def request_deadline(rule, header):
+    """Deadline запроса по правилу маршрута и заголовку X-Request-Timeout; None - без срока"""
+    budget = ROUTE_DEADLINES.get(rule, REQUEST_DEADLINE)
+    if budget is None:
+        return None
+    if header:
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = None
+        if requested is not None and requested > 0:
+            budget = min(requested, REQUEST_DEADLINE_MAX)
+    return Deadline(budget)
 
+
+@app.before_request
+def start_request_context():
+    g.request_id = request_id_from(request.headers.get('X-Request-ID'))
+    g.request_started = time.monotonic()
+    g.metrics_pending = True
+    request_started()
+    request_id_var.set(g.request_id)
+    route_var.set(request.url_rule.rule if request.url_rule else request.path)
+    deadline_var.set(request_deadline(
+        request.url_rule.rule if request.url_rule else None, request.headers.get('X-Request-Timeout')
+    ))
+
+
+@app.after_request
+def finish_request_context(response):
+    duration = time.monotonic() - g.request_started
+    response.headers['X-Request-ID'] = g.request_id
+    deadline = deadline_var.get()
+    if deadline is not None:
+        response.headers['Server-Timing'] = deadline.server_timing(duration)
+    g.metrics_pending = False
+    request_finished(
+        request.url_rule.rule if request.url_rule else 'unmatched',
+        request.method,
+        response.status_code,
+        duration,
+        None if response.is_streamed else response.calculate_content_length()
+    )
+    log.log(
+        request_level(response.status_code), 'request', 'Запрос обработан',
+        method=request.method,
+        path=request.path,
+        status=response.status_code,
+        duration_ms=round(duration * 1000, 1)
+    )
+    return response
+
+
+@app.teardown_request
+def clear_request_context(error=None):
+    # after_request не вызывался (необработанное исключение) - запрос все равно учитываем
+    if g.pop('metrics_pending', False):
+        request_finished(
+            request.url_rule.rule if request.url_rule else 'unmatched',
+            request.method,
+            500,
+            time.monotonic() - g.request_started
+        )
+    request_id_var.set(None)
+    route_var.set(None)
+    priority_var.set(False)
+    deadline_var.set(None)
+
+# Начальный белый список - записывается в пустую базу пользователей
 ALLOWED_USERS = {
     5429222882: {"username": "Suslick", "name": "SuslickSLS", "role": "admin"},
     987654321: {"username": "manager", "name": "Менеджер", "role": "manager"},
 }
 
-access_cache = {}
+# Проверка initData: ключ HMAC вычисляется один раз, auth_date не старше
+# TELEGRAM_AUTH_MAX_AGE секунд (0 - без ограничения)
+init_data_verifier = InitDataVerifier(
+    os.environ.get('TELEGRAM_BOT_TOKEN'),
+    max_age=int(os.environ.get('TELEGRAM_AUTH_MAX_AGE', 86400)),
+    replay_protection=os.environ.get('TELEGRAM_REPLAY_PROTECTION', '0') == '1',
+    replay_cache_size=int(os.environ.get('TELEGRAM_REPLAY_CACHE_SIZE', 100000)),
+)
+
+# Результат проверки подписи X-Telegram-Init-Data по хешу initData: клиент
+# присылает одну и ту же initData с каждым запросом, HMAC считается раз в
+# INIT_DATA_CACHE_TTL секунд (None - подпись неверна)
+INIT_DATA_CACHE_TTL = float(os.environ.get('INIT_DATA_CACHE_TTL', 300))
+init_data_users = TTLCache(
+    ttl=INIT_DATA_CACHE_TTL,
+    max_entries=int(os.environ.get('INIT_DATA_CACHE_MAX', 10000)),
+    sizeof=lambda value: 0,
+)
+_UNVERIFIED = object()
+
+# Кеш проверки доступа: отдельные TTL/лимиты для разрешенных и отклоненных,
+# ACCESS_CACHE_DB - общий для воркеров файл SQLite (по умолчанию выключен)
+access_cache = AccessCache(
+    positive_ttl=float(os.environ.get('ACCESS_CACHE_TTL', 300)),
+    positive_max=int(os.environ.get('ACCESS_CACHE_MAX', 10000)),
+    negative_ttl=float(os.environ.get('ACCESS_CACHE_NEGATIVE_TTL', 60)),
+    negative_max=int(os.environ.get('ACCESS_CACHE_NEGATIVE_MAX', 5000)),
+    shared_path=os.environ.get('ACCESS_CACHE_DB') or None,
+)
+
+
+def _invalidate_access(user_ids):
+    for user_id in user_ids:
+        access_cache.invalidate(user_id)
+
+
+# Белый список в SQLite (USER_STORE_DB) с индексом в памяти
+users = UserStore(
+    os.environ.get('USER_STORE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'users.db')),
+    on_change=_invalidate_access,
+    sync_interval=float(os.environ.get('USER_STORE_SYNC_INTERVAL', 1)),
+)
+users.seed(ALLOWED_USERS)
 
 @app.route('/api/check-access', methods=['POST'])
 def check_access():
@@ -24,34 +203,48 @@ def check_access():
     Проверка доступа пользователя к Mini App
     """
     try:
-        data = request.json
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         init_data = data.get('initData')
         
         if not user_id:
             return jsonify({'access': False, 'error': 'No user ID'}), 400
+        # Telegram присылает id числом, клиенты - иногда строкой; белый список и кеш - по int
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return jsonify({'access': False, 'error': 'Invalid user ID'}), 400
         
-        # Проверка кеша (5 минут)
-        cache_key = f"user_{user_id}"
-        if cache_key in access_cache:
-            cached_data = access_cache[cache_key]
-            if datetime.now() - cached_data['timestamp'] < timedelta(minutes=5):
-                return jsonify({'access': cached_data['access'], 'user': cached_data['user']})
+        # С TELEGRAM_BOT_TOKEN подпись Telegram обязательна - без нее любой
+        # может назваться чужим user_id
+        if init_data_verifier.enabled and not init_data:
+            return jsonify({'access': False, 'error': 'initData required'}), 403
         
-        # Проверка подписи Telegram (опционально, но рекомендуется)
-        if not verify_telegram_init_data(init_data):
+        # Проверка подписи - до кеша, чтобы чужой user_id нельзя было получить
+        # из кеша без подписи
+        try:
+            verified = verify_telegram_init_data(init_data)
+        except InitDataError as e:
+            log.warning('auth.invalid_init_data', 'Ошибка проверки подписи', error=str(e))
             return jsonify({'access': False, 'error': 'Invalid signature'}), 403
         
+        if verified is not None and verified.user_id != user_id:
+            return jsonify({'access': False, 'error': 'User ID does not match initData'}), 403
+        
+        # Подтягиваем изменения белого списка из других воркеров
+        users.sync()
+        
+        # Проверка кеша
+        cached_data = access_cache.get(user_id)
+        if cached_data is not None:
+            return jsonify({'access': cached_data['access'], 'user': cached_data['user']})
+        
         # Проверка в белом списке
-        user_info = ALLOWED_USERS.get(user_id)
+        user_info = users.get(user_id)
         
         if user_info:
             # Сохраняем в кеш
-            access_cache[cache_key] = {
-                'access': True,
-                'user': user_info,
-                'timestamp': datetime.now()
-            }
+            access_cache.set(user_id, True, user_info)
             
             return jsonify({
                 'access': True,
@@ -60,14 +253,10 @@ def check_access():
             })
         else:
             # Логируем попытку доступа
-            print(f"Попытка доступа от неподтвержденного пользователя: {user_id}")
+            log.info('auth.denied', 'Попытка доступа от неподтвержденного пользователя', user_id=user_id)
             
             # Сохраняем в кеш
-            access_cache[cache_key] = {
-                'access': False,
-                'user': None,
-                'timestamp': datetime.now()
-            }
+            access_cache.set(user_id, False, None)
             
             return jsonify({
                 'access': False,
@@ -75,65 +264,86 @@ def check_access():
             }), 403
             
     except Exception as e:
-        print(f"Ошибка проверки доступа: {e}")
+        log.exception('auth.error', 'Ошибка проверки доступа')
         return jsonify({'access': False, 'error': 'Internal server error'}), 500
 
 def verify_telegram_init_data(init_data):
     """
-    Проверка подписи Telegram Web App
+    Проверка подписи Telegram Web App. Возвращает проверенную InitData или None,
+    если проверка пропущена (нет токена или initData); при ошибке - InitDataError
     """
+    if not init_data_verifier.enabled or not init_data:
+        return None  # Пропускаем проверку если нет токена
+    return init_data_verifier.verify(init_data)
+
+def init_data_user_id(init_data):
+    """user_id подписанной initData (подпись проверяется раз в INIT_DATA_CACHE_TTL); None - не прошла проверку"""
+    key = hashlib.sha256(init_data.encode()).hexdigest()
+    user_id = init_data_users.get(key, _UNVERIFIED)
+    if user_id is not _UNVERIFIED:
+        return user_id
+    ttl = INIT_DATA_CACHE_TTL
     try:
-        # Ваш bot token из @BotFather
-        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-        
-        if not bot_token or not init_data:
-            return True  # Пропускаем проверку если нет токена
-        
-        # Разбираем initData
-        params = {}
-        for pair in init_data.split('&'):
-            key, value = pair.split('=')
-            params[key] = value
-        
-        # Получаем подпись
-        received_hash = params.get('hash')
-        if not received_hash:
-            return False
-        
-        # Удаляем hash из параметров
-        del params['hash']
-        
-        # Сортируем параметры
-        data_check_string = '\n'.join([f"{k}={v}" for k, v in sorted(params.items())])
-        
-        # Вычисляем секретный ключ
-        secret_key = hmac.new(
-            key=b"WebAppData",
-            msg=bot_token.encode(),
-            digestmod=hashlib.sha256
-        ).digest()
-        
-        # Вычисляем хеш
-        computed_hash = hmac.new(
-            key=secret_key,
-            msg=data_check_string.encode(),
-            digestmod=hashlib.sha256
-        ).hexdigest()
-        
-        return computed_hash == received_hash
-        
-    except Exception as e:
-        print(f"Ошибка проверки подписи: {e}")
+        verified = init_data_verifier.verify(init_data, check_replay=False)
+        user_id = verified.user_id
+        if init_data_verifier.max_age:
+            # Запись не переживает срок действия самой initData
+            ttl = min(ttl, verified.auth_date + init_data_verifier.max_age - init_data_verifier.clock())
+    except InitDataError:
+        user_id = None
+    if ttl > 0:
+        init_data_users.set(key, user_id, ttl=ttl)
+    return user_id
+
+
+def is_admin_init_data(init_data, sync=True):
+    """
+    Подписанная initData администратора из белого списка. Без
+    TELEGRAM_BOT_TOKEN пользователя проверить нельзя - всегда False.
+    sync=False - без чтения SQLite (event loop): роль по индексу в памяти
+    """
+    if not init_data or not init_data_verifier.enabled:
         return False
+    user_id = init_data_user_id(init_data)
+    if user_id is None:
+        return False
+    if sync:
+        users.sync()
+    user_info = users.get(user_id)
+    return bool(user_info) and user_info.get('role') == 'admin'
+
+
+@app.before_request
+def set_upstream_priority():
+    """Запросы администраторов к WB берут резерв лимита и не стоят в общей очереди"""
+    g.is_admin = is_admin_init_data(request.headers.get('X-Telegram-Init-Data'))
+    priority_var.set(g.is_admin)
 
 @app.route('/api/admin/users', methods=['GET'])
 def get_allowed_users():
     """
     Получить список разрешенных пользователей (для админки)
     """
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    
+    users.sync()
+    page, total = users.list(
+        offset=offset,
+        limit=limit,
+        role=request.args.get('role'),
+        query=request.args.get('q')
+    )
+    
     return jsonify({
-        'users': ALLOWED_USERS,
-        'total': len(ALLOWED_USERS)
+        'users': {user_id: info for user_id, info in page},
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'version': users.version
     })
 
 @app.route('/api/admin/add-user', methods=['POST'])
@@ -151,18 +361,12 @@ def add_user():
         if not user_id:
             return jsonify({'error': 'User ID required'}), 400
         
-        ALLOWED_USERS[user_id] = {
-            'username': username,
-            'name': name,
-            'role': role,
-            'added_at': datetime.now().isoformat()
-        }
+        user_info = users.upsert(user_id, username, name, role)
         
-        # Очищаем кеш для этого пользователя
-        cache_key = f"user_{user_id}"
-        access_cache.pop(cache_key, None)
+        # Очищаем кеш для этого пользователя (остальные воркеры сбросят его по журналу изменений)
+        access_cache.invalidate(user_id)
         
-        return jsonify({'success': True, 'user': ALLOWED_USERS[user_id]})
+        return jsonify({'success': True, 'user': user_info})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -170,7 +374,282 @@ def add_user():
 
 
 # Обновленный URL вашего локального API с HTTPS и портом 8443
-LOCAL_API_URL = "https://192.168.171.248:8443"
+LOCAL_API_URL = os.environ.get('LOCAL_API_URL', "https://192.168.171.248:8443")
+WB_API_URL = os.environ.get('WB_API_URL', "https://card.wb.ru")
+
+# Заголовки браузера для запросов к WB API
+WB_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Referer': 'https://www.wildberries.ru/',
+    'Origin': 'https://www.wildberries.ru',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-site',
+}
+
+# Лимит запросов к WB на весь сервис (token bucket в общем для воркеров файле
+# WB_RATE_LIMIT_DB): сверх лимита запрос ждет до WB_RATE_MAX_WAIT с, затем -
+# устаревший кеш или 429. WB_RATE_LIMIT=0 - без ограничения
+WB_RATE_LIMIT = float(os.environ.get('WB_RATE_LIMIT', 10))
+wb_limiter = RateLimiter(
+    'wb',
+    rate=WB_RATE_LIMIT,
+    burst=int(os.environ.get('WB_RATE_BURST', 20)),
+    max_wait=float(os.environ.get('WB_RATE_MAX_WAIT', 1)),
+    priority_max_wait=float(os.environ.get('WB_RATE_PRIORITY_MAX_WAIT', 5)),
+    max_waiting=int(os.environ.get('WB_RATE_MAX_WAITING', 50)),
+    reserve=int(os.environ.get('WB_RATE_RESERVE', 2)),
+    shared_path=os.environ.get(
+        'WB_RATE_LIMIT_DB',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ratelimit.db')
+    ) or None,
+) if WB_RATE_LIMIT > 0 else None
+
+# Общие пулы соединений к внешним API (keep-alive, повторы, таймауты по хостам)
+upstream = UpstreamClient()
+upstream.register(
+    'wb',
+    WB_API_URL,
+    timeout=float(os.environ.get('WB_API_TIMEOUT', 10)),
+    headers=WB_HEADERS,
+    limiter=wb_limiter
+)
+# Статика WB (справочник складов) - отдельный хост без лимита запросов к API карточек
+WB_STATIC_URL = os.environ.get('WB_STATIC_URL', "https://static-basket-01.wbbasket.ru")
+upstream.register(
+    'wb_static',
+    WB_STATIC_URL,
+    timeout=float(os.environ.get('WB_STATIC_TIMEOUT', 10)),
+    headers=WB_HEADERS
+)
+# Фото запрашиваются полным адресом корзины товара (basket-01 ... basket-NN):
+# пул соединений на каждую корзину, иначе keep-alive теряется при смене хоста
+WB_BASKET_BOUNDS = tuple(
+    int(bound) for bound in os.environ['WB_BASKET_BOUNDS'].split(',')
+) if os.environ.get('WB_BASKET_BOUNDS') else BASKET_BOUNDS
+upstream.register(
+    'wb_images',
+    'https://basket-01.wbbasket.ru',
+    timeout=float(os.environ.get('WB_IMAGES_TIMEOUT', 10)),
+    headers=WB_HEADERS,
+    pool_connections=len(WB_BASKET_BOUNDS) + 1
+)
+upstream.register(
+    'local',
+    LOCAL_API_URL,
+    timeout=float(os.environ.get('LOCAL_API_TIMEOUT', 10)),
+    verify=False  # Самоподписанный сертификат локального API
+)
+
+# Кеш карточек WB по (nmId, dest) со stale-while-revalidate
+product_cache = TTLCache(
+    ttl=float(os.environ.get('PRODUCT_CACHE_TTL', 60)),
+    stale_ttl=float(os.environ.get('PRODUCT_CACHE_STALE_TTL', 600)),
+    max_entries=int(os.environ.get('PRODUCT_CACHE_MAX_ENTRIES', 5000)),
+    max_bytes=int(os.environ.get('PRODUCT_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+)
+
+# Валидаторы ответов WB (ETag/Last-Modified) для условных запросов при обновлении кеша
+wb_validators = TTLCache(
+    ttl=product_cache.ttl + product_cache.stale_ttl,
+    max_entries=product_cache.max_entries,
+    sizeof=lambda value: 0
+)
+
+# HTTP-кеширование ответов с товарами у клиента (ETag + Cache-Control)
+PRODUCT_HTTP_MAX_AGE = int(os.environ.get('PRODUCT_HTTP_MAX_AGE', 60))
+PRODUCT_HTTP_STALE = int(os.environ.get('PRODUCT_HTTP_STALE_WHILE_REVALIDATE', 600))
+# Заголовки кеширования локального API, которые передаются клиенту как есть
+PASSTHROUGH_CACHE_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Expires')
+CONDITIONAL_REQUEST_HEADERS = ('If-None-Match', 'If-Modified-Since')
+
+# Регион доставки по умолчанию для всех эндпоинтов с товарами (?dest= - другой регион);
+# WB_ALLOWED_DESTS="-1257786,-5818883" ограничивает допустимые регионы
+WB_PRODUCT_DEST = int(os.environ.get('WB_DEST', -5818883))
+WB_ALLOWED_DESTS = [int(dest) for dest in os.environ.get('WB_ALLOWED_DESTS', '').split(',') if dest.strip()]
+
+# Пакетная загрузка: сколько nmId в одном запросе к WB и сколько запросов параллельно
+WB_BATCH_SIZE = int(os.environ.get('WB_BATCH_SIZE', 100))
+WB_BATCH_MAX_IDS = int(os.environ.get('WB_BATCH_MAX_IDS', 1000))
+WB_BATCH_CONCURRENCY = int(os.environ.get('WB_BATCH_CONCURRENCY', 4))
+batch_executor = ThreadPoolExecutor(
+    max_workers=WB_BATCH_CONCURRENCY,
+    thread_name_prefix='wb-batch'
+)
+
+# Одновременные одинаковые запросы к внешним API ждут одну загрузку
+flights = SingleFlight(max_waiters=int(os.environ.get('SINGLEFLIGHT_MAX_WAITERS', 200)))
+
+# Карточки WB: одна загрузка и одна запись кеша на (nmId, dest) для всех эндпоинтов
+products = ProductService(
+    upstream,
+    product_cache,
+    wb_validators,
+    flights,
+    batch_executor,
+    default_dest=WB_PRODUCT_DEST,
+    batch_size=WB_BATCH_SIZE,
+    allowed_dests=WB_ALLOWED_DESTS,
+)
+
+# Параллельный опрос источников для /api/product/<id>/full и сроки ожидания каждого
+fanout_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('FULL_FANOUT_WORKERS', 16)),
+    thread_name_prefix='fanout'
+)
+FULL_SOURCE_DEADLINES = {
+    'local': float(os.environ.get('FULL_LOCAL_DEADLINE', 4)),
+    'wb': float(os.environ.get('FULL_WB_DEADLINE', 6)),
+}
+
+# Фоновая проверка внешних API: эндпоинты здоровья отвечают по последнему снимку
+health_prober = HealthProber(
+    interval=float(os.environ.get('HEALTH_PROBE_INTERVAL', 15)),
+    window=int(os.environ.get('HEALTH_PROBE_WINDOW', 20))
+)
+HEALTH_LOCAL_NM_ID = int(os.environ.get('HEALTH_LOCAL_NM_ID', 224851397))
+HEALTH_WB_NM_ID = int(os.environ.get('HEALTH_WB_NM_ID', 205886056))
+
+# /api/local/raw/nmInfo по умолчанию отдает байты локального API без разбора;
+# прежний ответ с _metadata внутри JSON - по ?format=merged или LOCAL_NMINFO_PASSTHROUGH=0
+LOCAL_NMINFO_PASSTHROUGH = os.environ.get('LOCAL_NMINFO_PASSTHROUGH', '1') == '1'
+LOCAL_STREAM_CHUNK_SIZE = int(os.environ.get('LOCAL_STREAM_CHUNK_SIZE', 64 * 1024))
+LOCAL_API_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'application/json',
+}
+
+def fetch_local_nm_info(nm_id):
+    """
+    Запрос nmInfo к локальному API через общий пул (SSL-проверка отключена
+    в настройках хоста); одновременные запросы одного nmId ждут один ответ
+    """
+    return flights.do(('local', str(nm_id)), lambda: upstream.get(
+        'local',
+        f"{LOCAL_API_URL}/api/nmInfo?nmId={nm_id}",
+        headers=LOCAL_API_HEADERS
+    ))
+
+
+def stream_local_nm_info(nm_id, conditional_headers=None):
+    """
+    Потоковый запрос nmInfo: тело не читается до отдачи клиенту, соединение
+    возвращается в пул после закрытия ответа. Поток нельзя разделить между
+    запросами, поэтому объединения одинаковых запросов здесь нет.
+    conditional_headers (If-None-Match и т.п. от клиента) передаются локальному API.
+    """
+    return upstream.get(
+        'local',
+        f"{LOCAL_API_URL}/api/nmInfo?nmId={nm_id}",
+        headers={**LOCAL_API_HEADERS, **(conditional_headers or {})},
+        stream=True
+    )
+
+
+def client_conditional_headers(headers):
+    """Заголовки условного запроса клиента для передачи внешнему API"""
+    return {name: headers[name] for name in CONDITIONAL_REQUEST_HEADERS if headers.get(name)}
+
+
+def passthrough_cache_headers(upstream_response, decoded):
+    """
+    Валидаторы и Cache-Control внешнего API для ответа клиенту. Если тело
+    распаковано, строгий ETag относится уже к другому представлению - ослабляем его.
+    """
+    headers = {
+        name: upstream_response.headers[name]
+        for name in PASSTHROUGH_CACHE_HEADERS if name in upstream_response.headers
+    }
+    if decoded and headers.get('ETag', 'W/').startswith('"'):
+        headers['ETag'] = 'W/' + headers['ETag']
+    return headers
+
+
+def wants_merged_nm_info():
+    """Нужен ли прежний формат nmInfo (JSON локального API + _metadata)"""
+    fmt = request.args.get('format')
+    if fmt in ('merged', 'raw'):
+        return fmt == 'merged'
+    return not LOCAL_NMINFO_PASSTHROUGH
+
+
+def nm_info_metadata_headers(nm_id):
+    """_metadata ответа nmInfo в заголовках (для потокового режима)"""
+    return {
+        'X-Source': 'local_api',
+        'X-Status': 'success',
+        'X-Local-Api-Url': LOCAL_API_URL,
+        'X-Nm-Id-Requested': quote(nm_id, safe=''),
+    }
+
+
+def passthrough_response(upstream_response, headers):
+    """
+    Потоковая отдача тела внешнего API клиенту кусками. Сжатое тело
+    (Content-Encoding) передается как есть, если клиент принимает это сжатие,
+    иначе распаковывается на лету.
+    """
+    encoding = upstream_response.headers.get('Content-Encoding', '').lower()
+    decode = bool(encoding) and encoding != 'identity' and encoding not in request.accept_encodings
+    
+    headers = {**headers, **passthrough_cache_headers(upstream_response, decode)}
+    headers['Content-Type'] = upstream_response.headers.get('Content-Type', 'application/json')
+    headers['Vary'] = 'Accept-Encoding'
+    if not decode:
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        if 'Content-Length' in upstream_response.headers:
+            headers['Content-Length'] = upstream_response.headers['Content-Length']
+    
+    def body():
+        try:
+            yield from upstream_response.raw.stream(LOCAL_STREAM_CHUNK_SIZE, decode_content=decode)
+        finally:
+            upstream_response.close()
+    
+    return Response(body(), status=upstream_response.status_code, headers=headers)
+
+
+def content_etag(body):
+    """Стабильный хеш тела ответа для ETag (ключи JSON отсортированы)"""
+    return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+def product_cache_control():
+    return f'public, max-age={PRODUCT_HTTP_MAX_AGE}, stale-while-revalidate={PRODUCT_HTTP_STALE}'
+
+
+def etag_matches(if_none_match, etag):
+    """Совпадает ли ETag (без кавычек) с If-None-Match - слабое сравнение по RFC 9110"""
+    return bool(if_none_match) and parse_etags(if_none_match).contains_weak(etag)
+
+
+def conditional_json(payload):
+    """
+    JSON-ответ со слабым ETag по содержимому (переживает сжатие) и Cache-Control.
+    Если клиент прислал совпадающий If-None-Match - 304 без тела.
+    """
+    response = jsonify(payload)
+    response.set_etag(content_etag(response.get_data()), weak=True)
+    response.headers['Cache-Control'] = product_cache_control()
+    return response.make_conditional(request)
+
+
+def retry_after_headers(e):
+    """Заголовок Retry-After для ответа 503 (разомкнут breaker) или 429 (лимит запросов к WB)"""
+    return {'Retry-After': str(e.retry_after)}
+
+
+def parse_nm_id(value):
+    """nmId из параметра запроса или None если это не число"""
+    try:
+        nm_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return nm_id if nm_id > 0 else None
+
 
 @app.route('/')
 def home():
@@ -182,14 +661,21 @@ def home():
             'DenCool': '/api/DenCool/<id>',
             'debug': '/api/debug/wb',
             'local_raw': '/api/local/raw/nmInfo?nmId=224851397',
-            'local_health': '/api/local/health'
+            'local_health': '/api/local/health',
+            'metrics': '/metrics'
         }
     })
 
 @app.route('/api/local/raw/nmInfo', methods=['GET'])
 def local_raw_nm_info():
     """
-    Получение всех данных с локального API как есть
+    Получение всех данных с локального API как есть.
+    По умолчанию тело передается потоком без разбора, а _metadata - в заголовках
+    X-Source, X-Status, X-Local-Api-Url, X-Nm-Id-Requested. Условные запросы
+    (If-None-Match, If-Modified-Since) передаются локальному API, его 304 и
+    валидаторы - клиенту.
+    ?format=merged - прежний ответ: JSON локального API с полем _metadata и
+    собственным ETag по содержимому.
     """
     try:
         nm_id = request.args.get('nmId')
@@ -199,32 +685,32 @@ def local_raw_nm_info():
         # Формируем URL к локальному API
         target_url = f"{LOCAL_API_URL}/api/nmInfo?nmId={nm_id}"
         
-        print(f"🔗 Запрос к локальному API: {target_url}")
-        
-        # Делаем запрос с отключенной проверкой SSL (для самоподписанных сертификатов)
-        response = requests.get(
-            target_url,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'application/json',
-            },
-            timeout=10,
-            verify=False  # Отключаем проверку SSL сертификата
-        )
+        merged = wants_merged_nm_info()
+        if merged:
+            response = fetch_local_nm_info(nm_id)
+        else:
+            response = stream_local_nm_info(nm_id, client_conditional_headers(request.headers))
+        
+        log.info('local.response', 'Ответ локального API', url=target_url, status=response.status_code)
         
-        print(f"📊 Статус ответа: {response.status_code}")
+        if response.status_code == 304 and not merged:
+            return passthrough_response(response, nm_info_metadata_headers(nm_id))
         
         if response.status_code != 200:
+            response.close()
             return jsonify({
                 'error': f'Локальный API вернул статус {response.status_code}',
                 'status_code': response.status_code,
                 'url': target_url
             }), 502
         
+        if not merged:
+            return passthrough_response(response, nm_info_metadata_headers(nm_id))
+        
         # Возвращаем данные как есть
         raw_data = response.json()
         
-        print(f"✅ Получены сырые данные с локального API")
+        log.info('local.ok', 'Получены сырые данные с локального API', nm_id=nm_id)
         
         result = {
             **raw_data,
@@ -236,10 +722,41 @@ def local_raw_nm_info():
             }
         }
         
-        return jsonify(result)
+        return conditional_json(result)
             
+    except SingleFlightOverflow as e:
+        return jsonify({
+            'error': str(e),
+            'local_api_url': LOCAL_API_URL,
+            '_metadata': {
+                'source': 'error',
+                'status': 'overloaded'
+            }
+        }), 503
+        
+    except DeadlineExceeded as e:
+        return jsonify({
+            'error': str(e),
+            'local_api_url': LOCAL_API_URL,
+            '_metadata': {
+                'source': 'error',
+                'status': 'deadline_exceeded'
+            }
+        }), 504
+        
+    except CircuitOpenError as e:
+        return jsonify({
+            'error': 'Локальный API временно недоступен',
+            'retry_after': e.retry_after,
+            'local_api_url': LOCAL_API_URL,
+            '_metadata': {
+                'source': 'error',
+                'status': 'circuit_open'
+            }
+        }), 503, retry_after_headers(e)
+        
     except requests.exceptions.SSLError as e:
-        print(f"🔒 Ошибка SSL: {e}")
+        log.warning('local.ssl_error', 'Ошибка SSL', error=str(e))
         return jsonify({
             'error': 'SSL ошибка при подключении к локальному API',
             'solution': 'Сертификат не доверенный или самоподписанный',
@@ -251,7 +768,7 @@ def local_raw_nm_info():
         }), 503
         
     except requests.exceptions.ConnectionError as e:
-        print(f"🔌 Ошибка подключения: {e}")
+        log.warning('local.connection_error', 'Ошибка подключения к локальному API', error=str(e))
         return jsonify({
             'error': 'Не удалось подключиться к локальному API',
             'solution': 'Убедитесь что сервер 192.168.171.248:8443 запущен и доступен',
@@ -273,7 +790,7 @@ def local_raw_nm_info():
         }), 504
         
     except Exception as e:
-        print(f"💥 Ошибка: {e}")
+        log.exception('local.error', 'Ошибка при запросе к локальному API')
         return jsonify({
             'error': f'Ошибка при запросе к локальному API: {str(e)}',
             'local_api_url': LOCAL_API_URL,
@@ -283,55 +800,71 @@ def local_raw_nm_info():
             }
         }), 500
 
+def probe_local_api():
+    """Проверка локального API для фонового пробника: /api/health и nmInfo тестового товара"""
+    response = upstream.get('local', '/api/health', timeout=5)
+    details = {'status_code': response.status_code}
+    if response.status_code == 200:
+        try:
+            nm_test = upstream.get('local', f'/api/nmInfo?nmId={HEALTH_LOCAL_NM_ID}', timeout=3)
+            details['nm_info_endpoint'] = 'available' if nm_test.status_code == 200 else 'unavailable'
+            details['nm_info_status'] = nm_test.status_code
+        except Exception as e:
+            details['nm_info_endpoint'] = 'unavailable'
+            details['nm_info_error'] = str(e)
+    return response.status_code == 200, details
+
+
+def probe_wb_api():
+    """Проверка WB API для фонового пробника: карточка тестового товара"""
+    response = upstream.get('wb', wb_detail_url([HEALTH_WB_NM_ID], WB_PRODUCT_DEST), timeout=5)
+    return response.status_code == 200, {'status_code': response.status_code}
+
+
+health_prober.register('local', probe_local_api)
+health_prober.register('wb', probe_wb_api)
+
+
+def upstream_health(name):
+    """Снимок здоровья внешнего API; ?probe=now - проверить прямо сейчас"""
+    health_prober.ensure_started()
+    if request.args.get('probe') == 'now':
+        return health_prober.probe(name)
+    return health_prober.snapshot(name)
+
+
 @app.route('/api/local/health', methods=['GET'])
 def local_health_check():
-    """Проверка доступности локального API"""
-    try:
-        # Отключаем проверку SSL для локального API
-        response = requests.get(
-            f"{LOCAL_API_URL}/api/health", 
-            timeout=5,
-            verify=False
-        )
-        
-        health_info = {
-            'local_api_status': 'available' if response.status_code == 200 else 'unavailable',
-            'status_code': response.status_code,
-            'local_api_url': LOCAL_API_URL,
-            'protocol': 'https'
-        }
-        
-        # Если доступен, пробуем получить информацию о nmInfo
-        if response.status_code == 200:
-            try:
-                nm_test = requests.get(
-                    f"{LOCAL_API_URL}/api/nmInfo?nmId=224851397", 
-                    timeout=3,
-                    verify=False
-                )
-                health_info['nm_info_endpoint'] = 'available' if nm_test.status_code == 200 else 'unavailable'
-                health_info['nm_info_status'] = nm_test.status_code
-            except Exception as e:
-                health_info['nm_info_endpoint'] = 'unavailable'
-                health_info['nm_info_error'] = str(e)
-        
-        return jsonify(health_info)
-        
-    except requests.exceptions.SSLError as e:
-        return jsonify({
-            'local_api_status': 'ssl_error',
-            'local_api_url': LOCAL_API_URL,
-            'error': f'SSL ошибка: {str(e)}',
-            'solution': 'Сервер использует самоподписанный сертификат'
-        }), 503
-        
-    except Exception as e:
-        return jsonify({
-            'local_api_status': 'unavailable',
-            'local_api_url': LOCAL_API_URL,
-            'error': str(e),
-            'solution': 'Проверьте что сервер запущен и доступен по сети'
-        }), 503
+    """
+    Доступность локального API по данным фоновой проверки (отвечает сразу,
+    без запросов к API) и состояние его circuit breaker
+    """
+    probe = upstream_health('local')
+    
+    health_info = {
+        'local_api_status': probe['status'],
+        'local_api_url': LOCAL_API_URL,
+        'protocol': 'https',
+        'breaker': upstream.breaker_state('local'),
+        'probe': {key: value for key, value in probe.items() if key != 'details'},
+        **probe.get('details', {})
+    }
+    
+    error_type = probe.get('error_type')
+    if error_type == 'SSLError':
+        health_info['local_api_status'] = 'ssl_error'
+        health_info['solution'] = 'Сервер использует самоподписанный сертификат'
+    elif error_type == 'CircuitOpenError':
+        health_info['local_api_status'] = 'circuit_open'
+    elif probe['status'] == 'unavailable':
+        health_info['solution'] = 'Проверьте что сервер запущен и доступен по сети'
+    if 'error' in probe:
+        health_info['error'] = probe['error']
+    
+    # Пока не было ни одной проверки, статус неизвестен - считаем API доступным
+    if probe['status'] == 'unavailable':
+        return jsonify(health_info), 503
+    return jsonify(health_info)
 
 @app.route('/api/local/debug', methods=['GET'])
 def local_debug():
@@ -348,7 +881,7 @@ def local_debug():
         
         try:
             # Пробуем без SSL проверки
-            response = requests.get(target_url, timeout=10, verify=False)
+            response = upstream.get('local', target_url)
             debug_info['response'] = {
                 'status_code': response.status_code,
                 'headers': dict(response.headers),
@@ -373,7 +906,81 @@ def local_debug():
     except Exception as e:
         return jsonify({'error': f'Debug error: {str(e)}'}), 500
 
-# server/app.py - добавить этот эндпоинт
+def request_dest(args):
+    """Регион доставки из ?dest=; None - некорректный или не разрешенный"""
+    return products.resolve_dest(args.get('dest'))
+
+
+INVALID_DEST_ERROR = 'dest must be an integer delivery region id'
+
+
+# Справочник складов WB: названия для warehouse_id в ответах. Загружается в фоне
+# (WAREHOUSES_REFRESH_INTERVAL), последняя загрузка хранится в WAREHOUSES_CACHE
+WB_WAREHOUSES_PATH = os.environ.get('WB_WAREHOUSES_PATH', '/vol0/data/stores-data.json')
+
+
+def fetch_warehouses():
+    response = upstream.get('wb_static', WB_WAREHOUSES_PATH)
+    if response.status_code != 200:
+        raise WBApiError(f'Справочник складов: статус {response.status_code}', status_code=response.status_code)
+    return response.json()
+
+
+warehouse_index = WarehouseIndex(
+    fetch_warehouses,
+    cache_path=os.environ.get(
+        'WAREHOUSES_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warehouses.json')
+    ) or None,
+    interval=float(os.environ.get('WAREHOUSES_REFRESH_INTERVAL', 6 * 3600))
+)
+
+
+@products.projection('wb')
+def project_wb_product(product):
+    """Проекция сырой карточки WB в формат /api/wb/product"""
+    # Цены и остатки по всем размерам: цена - самого дешевого размера,
+    # остатки складов - сумма по размерам
+    sizes = product.get('sizes', [])
+    stocks = aggregate_sizes(sizes, warehouse_index)
+    
+    basic_price = stocks['basicPrice']
+    product_price = stocks['productPrice']
+    discount = round((1 - product_price / basic_price) * 100, 1) if basic_price > 0 else 0
+    warehouses = stocks['warehouses']
+    
+    return {
+        'id': product.get('id'),
+        'brand': product.get('brand'),
+        'name': product.get('name'),
+        'rating': product.get('rating'),
+        'reviewRating': product.get('reviewRating'),
+        'feedbacks': product.get('feedbacks'),
+        'totalQuantity': stocks['quantity'] if warehouses else product.get('totalQuantity'),
+        'basicPrice': basic_price,
+        'productPrice': product_price,
+        'discount': discount,
+        'discountAmount': basic_price - product_price if basic_price > product_price else 0,
+        'supplier': product.get('supplier'),
+        'supplierRating': product.get('supplierRating'),
+        'pics': product.get('pics', 0),
+        'subject': product.get('entity'),
+        'subjectId': product.get('subjectId'),
+        'volume': product.get('volume'),
+        'weight': product.get('weight'),
+        'time1': product.get('time1'),
+        'time2': product.get('time2'),
+        'promotions': product.get('promotions', []),
+        'images': [f"/api/wb/product/{product.get('id')}/images/{index}" for index in range(1, (product.get('pics') or 0) + 1)],
+        'warehouses': warehouses,
+        'sizes': stocks['sizes'],
+        'priceMin': stocks['price']['min'],
+        'priceMax': stocks['price']['max'],
+        'deliveryMin': stocks['delivery']['min'],
+        'deliveryMax': stocks['delivery']['max'],
+        'sizesCount': len(sizes),
+        'hasStocks': len(warehouses) > 0
+    }
+
 @app.route('/api/wb/product', methods=['GET'])
 def get_wb_product():
     """
@@ -384,82 +991,24 @@ def get_wb_product():
         if not nm_id:
             return jsonify({'error': 'nmId parameter is required'}), 400
         
-        print(f"🔍 Запрос товара {nm_id} с WB API")
+        nm_id = parse_nm_id(nm_id)
+        if nm_id is None:
+            return jsonify({'error': 'nmId must be a positive integer'}), 400
         
-        # URL Wildberries API для одного товара
-        wb_url = f"https://card.wb.ru/cards/v4/detail?appType=1&curr=rub&dest=-5818883&spp=30&ab_testing=false&lang=ru&nm={nm_id}"
+        dest = request_dest(request.args)
+        if dest is None:
+            return jsonify({'error': INVALID_DEST_ERROR}), 400
         
-        response = requests.get(
-            wb_url,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'application/json',
-            },
-            timeout=10
-        )
+        log.debug('wb.product.request', 'Запрос товара с WB API', nm_id=nm_id, dest=dest)
         
-        if response.status_code != 200:
-            return jsonify({
-                'error': f'WB API вернул статус {response.status_code}',
-                'status_code': response.status_code
-            }), 502
+        result = products.view('wb', nm_id, dest)
         
-        data = response.json()
-        
-        if not data.get('products') or len(data['products']) == 0:
+        if result is None:
             return jsonify({'error': 'Товар не найден'}), 404
         
-        product = data['products'][0]
-        
-        # Получаем информацию о цене и складах
-        sizes = product.get('sizes', [])
-        price_info = sizes[0].get('price', {}) if sizes else {}
-        stocks = sizes[0].get('stocks', []) if sizes else []
-        
-        basic_price = price_info.get('basic', 0) // 100
-        product_price = price_info.get('product', 0) // 100
-        discount = round((1 - product_price / basic_price) * 100, 1) if basic_price > 0 else 0
-        
-        # Формируем информацию о складах
-        warehouses = []
-        for stock in stocks:
-            warehouses.append({
-                'warehouse_id': stock.get('wh'),
-                'quantity': stock.get('qty', 0),
-                'time1': stock.get('time1'),
-                'time2': stock.get('time2')
-            })
-        
-        result = {
-            'id': product.get('id'),
-            'brand': product.get('brand'),
-            'name': product.get('name'),
-            'rating': product.get('rating'),
-            'reviewRating': product.get('reviewRating'),
-            'feedbacks': product.get('feedbacks'),
-            'totalQuantity': product.get('totalQuantity'),
-            'basicPrice': basic_price,
-            'productPrice': product_price,
-            'discount': discount,
-            'discountAmount': basic_price - product_price if basic_price > product_price else 0,
-            'supplier': product.get('supplier'),
-            'supplierRating': product.get('supplierRating'),
-            'pics': product.get('pics', 0),
-            'subject': product.get('entity'),
-            'subjectId': product.get('subjectId'),
-            'volume': product.get('volume'),
-            'weight': product.get('weight'),
-            'time1': product.get('time1'),
-            'time2': product.get('time2'),
-            'promotions': product.get('promotions', []),
-            'warehouses': warehouses,
-            'sizesCount': len(sizes),
-            'hasStocks': len(stocks) > 0
-        }
-        
-        print(f"✅ Получен товар {product.get('name')} с WB API")
+        log.info('wb.product.ok', 'Получен товар с WB API', nm_id=nm_id, name=result['name'])
         
-        return jsonify({
+        return conditional_json({
             'product': result,
             '_metadata': {
                 'source': 'wildberries_api',
@@ -467,210 +1016,483 @@ def get_wb_product():
             }
         })
         
+    except WBApiError as e:
+        return jsonify({'error': str(e), **e.details}), e.status
+    except SingleFlightOverflow as e:
+        return jsonify({'error': str(e)}), 503
+    except RateLimited as e:
+        return jsonify({'error': str(e), 'retry_after': e.retry_after}), 429, retry_after_headers(e)
+    except CircuitOpenError as e:
+        return jsonify({'error': str(e), 'retry_after': e.retry_after}), 503, retry_after_headers(e)
+    except DeadlineExceeded as e:
+        return jsonify({'error': str(e)}), 504
+    except requests.exceptions.Timeout:
+        log.warning('wb.product.timeout', 'Таймаут при запросе к WB API', nm_id=nm_id)
+        return jsonify({'error': 'Таймаут при запросе к WB API'}), 504
     except Exception as e:
-        print(f"💥 Ошибка: {e}")
+        log.exception('wb.product.error', 'Ошибка при запросе к WB API')
         return jsonify({'error': f'Ошибка при запросе к WB API: {str(e)}'}), 500
 
-@app.route('/api/product/<int:product_id>', methods=['GET'])
-def get_product(product_id):
+# Подписки на изменения цены и остатков (SSE): один опрос WB на товар и регион
+# для всех подписчиков воркера. Под gunicorn каждое открытое соединение занимает
+# поток воркера (GUNICORN_THREADS), поэтому таких подписок не больше
+# SSE_MAX_THREAD_STREAMS на воркер (четверть потоков) - остальные получают 503
+# и опрашивают /api/wb/product; в ASGI-режиме (asgi.py) поток не занимается.
+SSE_MAX_THREAD_STREAMS = int(os.environ.get(
+    'SSE_MAX_THREAD_STREAMS', max(int(os.environ.get('GUNICORN_THREADS', 8)) // 4, 1)
+))
+product_streams = ProductStreamHub(
+    lambda nm_id, dest: products.project('wb', products.refresh(nm_id, dest)),
+    interval=float(os.environ.get('SSE_POLL_INTERVAL', 15)),
+    heartbeat=float(os.environ.get('SSE_HEARTBEAT', 15)),
+    max_products=int(os.environ.get('SSE_MAX_PRODUCTS', 200)),
+    max_subscribers=int(os.environ.get('SSE_MAX_SUBSCRIBERS', 1000)),
+    queue_size=int(os.environ.get('SSE_QUEUE_SIZE', 20)),
+    max_thread_streams=SSE_MAX_THREAD_STREAMS
+)
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # nginx и подобные прокси не буферизуют поток; identity - без сжатия,
+    # иначе события копятся в буфере gzip
+    'X-Accel-Buffering': 'no',
+    'Content-Encoding': 'identity',
+}
+
+
+@app.route('/api/wb/product/<int:product_id>/stream', methods=['GET'])
+def stream_wb_product(product_id):
+    """
+    Изменения цены, скидки и остатков товара (text/event-stream): сначала
+    snapshot - товар целиком в формате /api/wb/product, затем change с
+    изменившимися полями и остатками по складам
+    """
+    dest = request_dest(request.args)
+    if dest is None:
+        return jsonify({'error': INVALID_DEST_ERROR}), 400
     try:
-        print(f"🔍 Запрос товара {product_id}")
-        
-        # Основной URL WB API
-        wb_url = f"https://card.wb.ru/cards/v4/detail?appType=1&curr=rub&dest=-1257786&spp=30&nm={product_id}"
-        
-        print(f"🔄 Пробуем URL: {wb_url}")
-        
-        # Делаем запрос с подробными заголовками
-        response = requests.get(
-            wb_url,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36',
-                'Accept': 'application/json, text/plain, */*',
-                'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Referer': 'https://www.wildberries.ru/',
-                'Origin': 'https://www.wildberries.ru',
-                'Sec-Fetch-Dest': 'empty',
-                'Sec-Fetch-Mode': 'cors',
-                'Sec-Fetch-Site': 'same-site',
-            },
-            timeout=10
-        )
+        events = product_streams.stream((product_id, dest))
+    except StreamLimitError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(int(product_streams.interval))}
+    log.info('wb.stream.subscribe', 'Подписка на изменения товара', nm_id=product_id, dest=dest)
+    return Response(events, mimetype='text/event-stream', headers=SSE_HEADERS)
+
+# Фото товаров: адреса корзин WB вычисляются из nmId, файлы - в дисковом LRU-кеше
+IMAGE_HTTP_MAX_AGE = int(os.environ.get('IMAGE_HTTP_MAX_AGE', 86400))
+image_cache = DiskLRUCache(
+    os.environ.get('IMAGE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_cache')),
+    max_bytes=int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+)
+images = ImageProxy(
+    upstream,
+    image_cache,
+    flights,
+    bounds=WB_BASKET_BOUNDS,
+    thumb_widths=[int(width) for width in os.environ.get('IMAGE_THUMB_WIDTHS', '128,256,512').split(',')]
+)
+
+
+@app.route('/api/wb/product/<int:product_id>/images/<int:index>', methods=['GET'])
+def get_wb_product_image(product_id, index):
+    """
+    Фото index (с 1) товара из кеша: ?w= - миниатюра не уже w пикселей.
+    Файл отдается через sendfile сервера, с поддержкой Range и If-Modified-Since
+    """
+    try:
+        width = int(request.args['w']) if request.args.get('w') else None
+    except ValueError:
+        return jsonify({'error': 'w must be an integer'}), 400
+    if index < 1 or (width is not None and width < 1):
+        return jsonify({'error': 'index and w must be positive'}), 400
+
+    try:
+        # Файл могли вытеснить между поиском и открытием - тогда загружаем снова
+        for attempt in range(2):
+            path = images.image(product_id, index, width)
+            try:
+                response = send_file(path, mimetype=content_type(path), conditional=True, max_age=IMAGE_HTTP_MAX_AGE)
+                break
+            except FileNotFoundError:
+                if attempt:
+                    raise
+    except ImageNotFound as e:
+        return jsonify({'error': str(e)}), 404, {'Cache-Control': 'public, max-age=300'}
+    except SingleFlightOverflow as e:
+        return jsonify({'error': str(e)}), 503
+    except CircuitOpenError as e:
+        return jsonify({'error': str(e), 'retry_after': e.retry_after}), 503, retry_after_headers(e)
+    except DeadlineExceeded as e:
+        return jsonify({'error': str(e)}), 504
+    except requests.exceptions.Timeout:
+        return jsonify({'error': 'Таймаут загрузки фото WB'}), 504
+    except requests.exceptions.RequestException as e:
+        log.warning('wb.image.error', 'Ошибка загрузки фото WB', nm_id=product_id, index=index, error=str(e))
+        return jsonify({'error': f'Ошибка загрузки фото: {str(e)}'}), 502
+    response.headers['Cache-Control'] = f'public, max-age={IMAGE_HTTP_MAX_AGE}, immutable'
+    return response
+
+
+def collect_nm_ids(raw_ids):
+    """Уникальные nmId в порядке запроса и ошибки для некорректных"""
+    nm_ids = []
+    errors = []
+    for raw_id in raw_ids:
+        nm_id = parse_nm_id(raw_id)
+        if nm_id is None:
+            errors.append({'nmId': raw_id, 'error': 'invalid_id'})
+        elif nm_id not in nm_ids:
+            nm_ids.append(nm_id)
+    return nm_ids, errors
+
+
+def wb_products_payload(nm_ids, cards, errors, requested):
+    """Ответ /api/wb/products: проекции найденных товаров и ошибки по остальным"""
+    found = []
+    for nm_id in nm_ids:
+        card = cards.get(nm_id)
+        if isinstance(card, WBApiError):
+            error = {'nmId': nm_id, 'error': str(card), 'status': card.status}
+            if 'retry_after' in card.details:
+                error['retry_after'] = card.details['retry_after']
+            errors.append(error)
+        elif not card:
+            errors.append({'nmId': nm_id, 'error': 'not_found', 'status': 404})
+        else:
+            found.append(products.project('wb', card))
+    
+    return {
+        'products': found,
+        'errors': errors,
+        '_metadata': {
+            'source': 'wildberries_api',
+            'status': 'success' if not errors else 'partial',
+            'requested': requested,
+            'found': len(found)
+        }
+    }
+
+@app.route('/api/wb/products', methods=['GET', 'POST'])
+def get_wb_products():
+    """
+    Пакетное получение товаров с Wildberries API.
+    GET: ?nmIds=1,2,3  POST: JSON-массив nmId или {"nmIds": [...]}
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True)
+            raw_ids = data.get('nmIds') if isinstance(data, dict) else data
+            if not isinstance(raw_ids, list):
+                return jsonify({'error': 'JSON array of nmIds is required'}), 400
+        else:
+            raw = request.args.get('nmIds', '')
+            raw_ids = [part for part in raw.replace(';', ',').split(',') if part.strip()]
         
-        print(f"📊 Статус ответа: {response.status_code}")
-        print(f"📋 Заголовки ответа: {dict(response.headers)}")
+        if not raw_ids:
+            return jsonify({'error': 'nmIds parameter is required'}), 400
         
-        if response.status_code != 200:
-            return jsonify({
-                'error': f'WB API вернул статус {response.status_code}',
-                'status_code': response.status_code,
-                'product_id': product_id
-            }), 502
-            
-        # Пробуем распарсить JSON
-        try:
-            data = response.json()
-            print(f"📦 JSON получен успешно")
-        except json.JSONDecodeError as e:
-            print(f"❌ Ошибка парсинга JSON: {e}")
-            print(f"📄 Содержимое ответа: {response.text[:200]}")
-            return jsonify({
-                'error': 'Неверный формат ответа от WB API',
-                'response_preview': response.text[:200]
-            }), 502
+        nm_ids, errors = collect_nm_ids(raw_ids)
         
-        # Проверяем структуру ответа
-        if not data:
-            return jsonify({'error': 'Пустой ответ от WB API'}), 404
-            
-        # Пробуем разные возможные структуры данных
-        product_data = None
-        if data.get('data', {}).get('products'):
-            product_data = data['data']['products'][0]
-        elif data.get('products'):
-            product_data = data['products'][0]
-        else:
-            print(f"📋 Структура данных: {json.dumps(data, ensure_ascii=False)[:500]}")
-            return jsonify({
-                'error': 'Неизвестная структура данных от WB API',
-                'data_structure': list(data.keys()) if data else []
-            }), 502
+        if len(nm_ids) > WB_BATCH_MAX_IDS:
+            return jsonify({'error': f'Не более {WB_BATCH_MAX_IDS} nmId за запрос'}), 400
         
-        if not product_data:
-            return jsonify({'error': 'Товар не найден в ответе'}), 404
+        dest = request_dest(request.args)
+        if dest is None:
+            return jsonify({'error': INVALID_DEST_ERROR}), 400
         
-        # Форматируем успешный ответ
-        result = {
-            'id': product_data.get('id', product_id),
-            'name': product_data.get('name', 'Название не указано'),
-            'brand': product_data.get('brand', 'Бренд не указан'),
-            'price': product_data.get('salePriceU', 0),
-            'rating': product_data.get('rating', 0),
-            'feedbacks': product_data.get('feedbacks', 0),
-            'quantity': product_data.get('totalQuantity', 0),
-        }
+        log.info('wb.products.request', 'Пакетный запрос товаров с WB API', count=len(nm_ids), dest=dest)
         
-        print(f"✅ Успешно получен товар: {result['name']}")
-        return jsonify(result)
+        cards = products.cards(nm_ids, dest)
+        
+        return jsonify(wb_products_payload(nm_ids, cards, errors, len(raw_ids)))
         
-    except requests.exceptions.Timeout:
-        print("⏰ Таймаут при запросе к WB API")
-        return jsonify({'error': 'Таймаут при запросе к WB API'}), 504
-    except requests.exceptions.ConnectionError:
-        print("🔌 Ошибка подключения к WB API")
-        return jsonify({'error': 'Ошибка подключения к WB API'}), 503
-    except requests.exceptions.RequestException as e:
-        print(f"🌐 Ошибка сети: {e}")
-        return jsonify({'error': f'Ошибка сети: {str(e)}'}), 503
     except Exception as e:
-        print(f"💥 Неожиданная ошибка: {e}")
-        return jsonify({'error': f'Внутренняя ошибка: {str(e)}'}), 500
+        log.exception('wb.products.error', 'Ошибка пакетного запроса к WB API')
+        return jsonify({'error': f'Ошибка при запросе к WB API: {str(e)}'}), 500
+
+# Watchlist: фоновый опрос отслеживаемых товаров и история изменений цены и остатков
+WATCHLIST_ENABLED = os.environ.get('WATCHLIST_ENABLED', '1') == '1'
+WATCHLIST_MAX = int(os.environ.get('WATCHLIST_MAX', 10000))
+WATCHLIST_HISTORY_POINTS = int(os.environ.get('WATCHLIST_HISTORY_POINTS', 500))
+watchlist = WatchlistScheduler(
+    WatchlistStore(os.environ.get(
+        'WATCHLIST_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'watchlist.db')
+    )),
+    products,
+    interval=float(os.environ.get('WATCHLIST_INTERVAL', 600)),
+    batch_size=min(int(os.environ.get('WATCHLIST_BATCH_SIZE', WB_BATCH_SIZE)), WB_BATCH_SIZE),
+    lease_ttl=float(os.environ.get('WATCHLIST_LEASE_TTL', 60)),
+    retention=int(float(os.environ.get('WATCHLIST_RETENTION_DAYS', 365)) * 86400)
+)
 
 
+@app.before_request
+def start_background_tasks():
+    # Фоновые потоки в каждом процессе (после fork - свои); watchlist опрашивает один из них
+    warehouse_index.ensure_started()
+    if WATCHLIST_ENABLED:
+        watchlist.ensure_started()
+    if shared_metrics is not None:
+        shared_metrics.ensure_started()
+
+
+def watchlist_keys(data, args):
+    """(nmId, dest) из JSON {"nmIds": [...], "dest": ...} или ?nmIds=&dest=; ошибка - строка"""
+    if isinstance(data, dict):
+        raw_ids = data.get('nmIds')
+        dest = products.resolve_dest(data.get('dest'))
+    else:
+        raw = args.get('nmIds', '')
+        raw_ids = [part for part in raw.replace(';', ',').split(',') if part.strip()]
+        dest = request_dest(args)
+    if not isinstance(raw_ids, list) or not raw_ids:
+        return None, 'nmIds is required'
+    if dest is None:
+        return None, INVALID_DEST_ERROR
+    nm_ids, errors = collect_nm_ids(raw_ids)
+    if errors:
+        return None, f"invalid nmIds: {', '.join(str(error['nmId']) for error in errors)}"
+    return [(nm_id, dest) for nm_id in nm_ids], None
+
+
+@app.route('/api/admin/watchlist', methods=['GET', 'POST', 'DELETE'])
+def admin_watchlist():
+    """
+    Список отслеживаемых товаров: GET - страница списка, POST - добавить,
+    DELETE - убрать ({"nmIds": [...], "dest": ..., "keepHistory": true}).
+    Только для администраторов: подписанная initData в X-Telegram-Init-Data
+    """
+    if not g.is_admin:
+        return jsonify({'error': 'Admin initData required'}), 403
+    if request.method == 'GET':
+        try:
+            offset = max(int(request.args.get('offset', 0)), 0)
+            limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        except ValueError:
+            return jsonify({'error': 'offset and limit must be integers'}), 400
+        items, total = watchlist.store.list(offset=offset, limit=limit)
+        return jsonify({'items': items, 'total': total, 'offset': offset, 'limit': limit, 'max': WATCHLIST_MAX})
+
+    data = request.get_json(silent=True)
+    keys, error = watchlist_keys(data, request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    if request.method == 'POST':
+        try:
+            added = watchlist.store.add(keys, limit=WATCHLIST_MAX)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        log.info('watchlist.add', 'Товары добавлены в watchlist', count=added)
+        return jsonify({'success': True, 'added': added})
+
+    keep_history = not (isinstance(data, dict) and data.get('keepHistory') is False)
+    removed = watchlist.store.remove(keys, keep_history=keep_history)
+    log.info('watchlist.remove', 'Товары убраны из watchlist', count=removed, keep_history=keep_history)
+    return jsonify({'success': True, 'removed': removed})
+
+
+def parse_time(value):
+    """Unix-время в секундах или дата ISO 8601; None - некорректное значение"""
     try:
-        print(f"🔍 Запрос товара {product_id}")
-        
-        # Основной URL WB API
-        wb_url = f"https://card.wb.ru/cards/v4/detail?appType=1&curr=rub&dest=-1257786&spp=30&nm={product_id}"
-        
-        print(f"🔄 Пробуем URL: {wb_url}")
-        
-        # Делаем запрос с подробными заголовками
-        response = requests.get(
-            wb_url,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36',
-                'Accept': 'application/json, text/plain, */*',
-                'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Referer': 'https://www.wildberries.ru/',
-                'Origin': 'https://www.wildberries.ru',
-                'Sec-Fetch-Dest': 'empty',
-                'Sec-Fetch-Mode': 'cors',
-                'Sec-Fetch-Site': 'same-site',
-            },
-            timeout=10
-        )
-        
-        print(f"📊 Статус ответа: {response.status_code}")
-        print(f"📋 Заголовки ответа: {dict(response.headers)}")
+        return int(float(value))
+    except (ValueError, OverflowError):
+        pass
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return None
+
+
+@app.route('/api/wb/product/<int:product_id>/history', methods=['GET'])
+def get_wb_product_history(product_id):
+    """
+    История цены и остатков по складам из watchlist: ?from=&to= (unix-время или
+    ISO 8601, по умолчанию последние 7 дней), ?points= - не больше точек на ряд
+    """
+    dest = request_dest(request.args)
+    if dest is None:
+        return jsonify({'error': INVALID_DEST_ERROR}), 400
+    end = parse_time(request.args['to']) if request.args.get('to') else int(time.time())
+    start = parse_time(request.args['from']) if request.args.get('from') else (end or 0) - 7 * 86400
+    if start is None or end is None or start > end:
+        return jsonify({'error': 'from and to must be unix timestamps or ISO 8601 dates, from <= to'}), 400
+    try:
+        points = min(max(int(request.args.get('points', WATCHLIST_HISTORY_POINTS)), 2), 5000)
+    except ValueError:
+        return jsonify({'error': 'points must be an integer'}), 400
+
+    history = watchlist.history((product_id, dest), start, end, points)
+    return jsonify({
+        'nmId': product_id,
+        'dest': dest,
+        'from': start,
+        'to': end,
+        **history,
+    })
+
+@products.projection('basic')
+def project_basic_product(product_data):
+    """Проекция сырой карточки WB в формат /api/product/<id>"""
+    # salePriceU был в прежнем API карточек; в cards/v4 цена - у размеров (тоже в копейках),
+    # берется самый дешевый размер
+    size_prices = [(size.get('price') or {}).get('product') for size in product_data.get('sizes') or ()]
+    return {
+        'id': product_data.get('id'),
+        'name': product_data.get('name', 'Название не указано'),
+        'brand': product_data.get('brand', 'Бренд не указан'),
+        'price': product_data.get('salePriceU') or min(filter(None, size_prices), default=0),
+        'rating': product_data.get('rating', 0),
+        'feedbacks': product_data.get('feedbacks', 0),
+        'quantity': product_data.get('totalQuantity', 0),
+    }
+
+@app.route('/api/product/<int:product_id>', methods=['GET'])
+def get_product(product_id):
+    try:
+        dest = request_dest(request.args)
+        if dest is None:
+            return jsonify({'error': INVALID_DEST_ERROR, 'product_id': product_id}), 400
         
-        if response.status_code != 200:
-            return jsonify({
-                'error': f'WB API вернул статус {response.status_code}',
-                'status_code': response.status_code,
-                'product_id': product_id
-            }), 502
-            
-        # Пробуем распарсить JSON
-        try:
-            data = response.json()
-            print(f"📦 JSON получен успешно")
-        except json.JSONDecodeError as e:
-            print(f"❌ Ошибка парсинга JSON: {e}")
-            print(f"📄 Содержимое ответа: {response.text[:200]}")
-            return jsonify({
-                'error': 'Неверный формат ответа от WB API',
-                'response_preview': response.text[:200]
-            }), 502
+        log.debug('product.request', 'Запрос товара', nm_id=product_id, dest=dest)
         
-        # Проверяем структуру ответа
-        if not data:
-            return jsonify({'error': 'Пустой ответ от WB API'}), 404
-            
-        # Пробуем разные возможные структуры данных
-        product_data = None
-        if data.get('data', {}).get('products'):
-            product_data = data['data']['products'][0]
-        elif data.get('products'):
-            product_data = data['products'][0]
-        else:
-            print(f"📋 Структура данных: {json.dumps(data, ensure_ascii=False)[:500]}")
-            return jsonify({
-                'error': 'Неизвестная структура данных от WB API',
-                'data_structure': list(data.keys()) if data else []
-            }), 502
+        result = products.view('basic', product_id, dest)
         
-        if not product_data:
+        if result is None:
             return jsonify({'error': 'Товар не найден в ответе'}), 404
         
-        # Форматируем успешный ответ
-        result = {
-            'id': product_data.get('id', product_id),
-            'name': product_data.get('name', 'Название не указано'),
-            'brand': product_data.get('brand', 'Бренд не указан'),
-            'price': product_data.get('salePriceU', 0),
-            'rating': product_data.get('rating', 0),
-            'feedbacks': product_data.get('feedbacks', 0),
-            'quantity': product_data.get('totalQuantity', 0),
-        }
-        
-        print(f"✅ Успешно получен товар: {result['name']}")
-        return jsonify(result)
+        log.info('product.ok', 'Успешно получен товар', nm_id=product_id, name=result['name'])
+        return conditional_json(result)
         
+    except WBApiError as e:
+        return jsonify({'error': str(e), 'product_id': product_id, **e.details}), e.status
+    except SingleFlightOverflow as e:
+        return jsonify({'error': str(e), 'product_id': product_id}), 503
+    except RateLimited as e:
+        return jsonify({
+            'error': str(e),
+            'product_id': product_id,
+            'retry_after': e.retry_after
+        }), 429, retry_after_headers(e)
+    except CircuitOpenError as e:
+        return jsonify({
+            'error': str(e),
+            'product_id': product_id,
+            'retry_after': e.retry_after
+        }), 503, retry_after_headers(e)
+    except DeadlineExceeded as e:
+        return jsonify({'error': str(e), 'product_id': product_id}), 504
     except requests.exceptions.Timeout:
-        print("⏰ Таймаут при запросе к WB API")
+        log.warning('product.timeout', 'Таймаут при запросе к WB API', nm_id=product_id)
         return jsonify({'error': 'Таймаут при запросе к WB API'}), 504
     except requests.exceptions.ConnectionError:
-        print("🔌 Ошибка подключения к WB API")
+        log.warning('product.connection_error', 'Ошибка подключения к WB API', nm_id=product_id)
         return jsonify({'error': 'Ошибка подключения к WB API'}), 503
     except requests.exceptions.RequestException as e:
-        print(f"🌐 Ошибка сети: {e}")
+        log.warning('product.network_error', 'Ошибка сети', nm_id=product_id, error=str(e))
         return jsonify({'error': f'Ошибка сети: {str(e)}'}), 503
     except Exception as e:
-        print(f"💥 Неожиданная ошибка: {e}")
+        log.exception('product.error', 'Неожиданная ошибка', nm_id=product_id)
         return jsonify({'error': f'Внутренняя ошибка: {str(e)}'}), 500
 
+
+def _full_local_source(nm_id):
+    response = fetch_local_nm_info(nm_id)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise RuntimeError(f'Локальный API вернул статус {response.status_code}')
+    return response.json()
+
+
+def _full_wb_source(nm_id, dest):
+    return products.view('wb', nm_id, dest)
+
+
+@app.route('/api/product/<int:product_id>/full', methods=['GET'])
+def get_product_full(product_id):
+    """
+    Данные локального API и карточка WB одним ответом. Источники опрашиваются
+    параллельно, каждый со своим сроком; в ответ попадают те, что успели,
+    а статус каждого источника - в _metadata.sources
+    """
+    dest = request_dest(request.args)
+    if dest is None:
+        return jsonify({'error': INVALID_DEST_ERROR, 'nmId': product_id}), 400
+    
+    log.debug('product.full.request', 'Полный запрос товара', nm_id=product_id, dest=dest)
+    
+    started = time.monotonic()
+    # Срок источника - его доля бюджета запроса: запросы к API источника,
+    # не успевшего к сроку, тоже прерываются, а не доделываются в фоне
+    contexts = {name: narrowed_context(budget) for name, budget in FULL_SOURCE_DEADLINES.items()}
+    futures = {
+        'local': fanout_executor.submit(contexts['local'].run, _full_local_source, product_id),
+        'wb': fanout_executor.submit(contexts['wb'].run, _full_wb_source, product_id, dest),
+    }
+    
+    result = {'nmId': product_id}
+    sources = {}
+    for name, future in futures.items():
+        remaining = contexts[name].get(deadline_var).remaining()
+        try:
+            result[name] = future.result(timeout=remaining)
+            sources[name] = {'status': 'success' if result[name] is not None else 'not_found'}
+        except (FuturesTimeout, requests.exceptions.Timeout):
+            result[name] = None
+            sources[name] = {'status': 'timeout'}
+        except (CircuitOpenError, RateLimited) as e:
+            result[name] = None
+            sources[name] = {'status': e.status, 'retry_after': e.retry_after}
+        except DeadlineExceeded as e:
+            result[name] = None
+            sources[name] = {'status': e.status}
+        except Exception as e:
+            log.warning('product.full.source_error', 'Источник недоступен', source=name, error=str(e))
+            result[name] = None
+            sources[name] = {'status': 'error', 'error': str(e)}
+        sources[name]['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+    
+    status_code = finish_full_result(result, sources)
+    return jsonify(result), status_code, full_result_headers(sources, status_code)
+
+
+def finish_full_result(result, sources):
+    """Добавляет _metadata в ответ /full и возвращает HTTP-статус по статусам источников"""
+    statuses = {source['status'] for source in sources.values()}
+    if 'success' in statuses:
+        status_code = 200
+    elif statuses == {'not_found'}:
+        status_code = 404
+    elif statuses <= {'timeout', 'deadline_exceeded', 'not_found'}:
+        status_code = 504
+    elif statuses <= {'rate_limited', 'not_found'}:
+        status_code = 429
+    elif statuses <= {'circuit_open', 'rate_limited', 'not_found'}:
+        status_code = 503
+    else:
+        status_code = 502
+    
+    result['_metadata'] = {
+        'status': 'success' if statuses == {'success'} else 'partial' if status_code == 200 else 'failed',
+        'sources': sources
+    }
+    return status_code
+
+
+def full_result_headers(sources, status_code):
+    """Retry-After для ответа 503/429 от /full, когда источники отключены breaker или лимитом"""
+    if status_code not in (429, 503):
+        return {}
+    retry_after = [source['retry_after'] for source in sources.values() if 'retry_after' in source]
+    return {'Retry-After': str(max(retry_after))} if retry_after else {}
+
 @app.route('/api/debug/wb', methods=['GET'])
 def debug_wb():
     """Эндпоинт для отладки подключения к WB"""
     test_id = 205886056
-    wb_url = f"https://card.wb.ru/cards/v4/detail?appType=1&curr=rub&dest=-1257786&spp=30&nm={test_id}"
+    wb_url = WB_API_URL + wb_detail_url([test_id], request_dest(request.args) or WB_PRODUCT_DEST)
     
     try:
-        print(f"🔧 Отладка: проверка подключения к {wb_url}")
-        response = requests.get(wb_url, timeout=10)
+        log.info('debug.wb', 'Отладка: проверка подключения к WB', url=wb_url)
+        response = upstream.get('wb', wb_url)
         
         debug_info = {
             'status_code': response.status_code,
@@ -698,16 +1520,169 @@ def debug_wb():
             'type': type(e).__name__
         }), 500
 
+upstream.add_observer(UpstreamMetrics())
+upstream.add_observer(DeadlineObserver())
+
+stats_collector(
+    'product_cache', product_cache.stats,
+    counters=('hits', 'stale_hits', 'misses', 'evictions', 'expirations', 'refreshes', 'refresh_errors'),
+    gauges=('entries', 'bytes', 'refreshing')
+)
+stats_collector('access_cache', access_cache.stats, counters=('hits', 'shared_hits', 'misses'))
+stats_collector(
+    'singleflight', flights.stats,
+    counters=('executed', 'coalesced', 'rejected'),
+    gauges=('in_flight', 'waiting')
+)
+stats_collector(
+    'product_streams', product_streams.stats,
+    counters=('polls', 'rejected', 'dropped'),
+    gauges=('products', 'subscribers', 'thread_streams')
+)
+stats_collector(
+    'watchlist', watchlist.stats,
+    counters=('cycles', 'polled', 'errors', 'points'),
+    gauges=('leader', 'queued_batches')
+)
+stats_collector(
+    'warehouse_index', warehouse_index.stats,
+    counters=('refreshes', 'errors'),
+    gauges=('warehouses', 'age')
+)
+stats_collector(
+    'image_cache', image_cache.stats,
+    counters=('hits', 'misses', 'evictions'),
+    gauges=('files', 'bytes')
+)
+stats_collector(
+    'upstream_pool', upstream.stats,
+    counters=('requests', 'connections_opened', 'connections_reused', 'pool_waits', 'retries'),
+    gauges=('connections_in_use',),
+    label='upstream'
+)
+
+
+@metrics_registry.add_collector
+def collect_service_metrics():
+    breakers = {name: upstream.breaker_state(name) for name in upstream.hosts}
+    breakers = {name: state for name, state in breakers.items() if state is not None}
+    limits = {name: host.limiter.snapshot() for name, host in upstream.hosts.items() if host.limiter is not None}
+    health = health_prober.snapshots()
+    return [
+        ('upstream_breaker_state', 'gauge', 'Состояние circuit breaker: 0 - closed, 1 - half_open, 2 - open',
+         [({'upstream': name}, BREAKER_STATES[state['state']]) for name, state in breakers.items()]),
+        ('upstream_breaker_rejected_total', 'counter', 'Запросы, отклоненные открытым circuit breaker',
+         [({'upstream': name}, state['rejected']) for name, state in breakers.items()]),
+        ('upstream_rate_limit_tokens', 'gauge', 'Свободные токены лимита запросов к внешнему API',
+         [({'upstream': name}, limit['tokens']) for name, limit in limits.items() if limit['tokens'] is not None]),
+        ('upstream_rate_limit_waiting', 'gauge', 'Запросы, ждущие токен лимита',
+         [({'upstream': name}, limit['waiting']) for name, limit in limits.items()]),
+        ('upstream_rate_limit_acquired_total', 'counter', 'Запросы, получившие токен лимита',
+         [({'upstream': name, 'priority': 'admin'}, limit['priority_acquired']) for name, limit in limits.items()]
+         + [({'upstream': name, 'priority': 'normal'}, limit['acquired'] - limit['priority_acquired'])
+            for name, limit in limits.items()]),
+        ('upstream_rate_limit_rejected_total', 'counter', 'Запросы, отклоненные лимитом (очередь полна или истек срок)',
+         [({'upstream': name, 'reason': reason}, count)
+          for name, limit in limits.items() for reason, count in limit['rejected'].items()]),
+        ('upstream_health_success_rate', 'gauge', 'Доля успешных фоновых проверок внешнего API',
+         [({'upstream': name}, snapshot['success_rate'])
+          for name, snapshot in health.items() if 'success_rate' in snapshot]),
+        ('log_dropped_records_total', 'counter', 'Записи лога, потерянные из-за переполненной очереди',
+         [({}, dropped_records())]),
+    ]
+
+
+# METRICS_DIR - общий каталог воркеров (задает gunicorn.conf.py): /metrics любого
+# воркера отдает метрики всех с меткой worker; без него - только своего процесса
+METRICS_DIR = os.environ.get('METRICS_DIR')
+shared_metrics = SharedMetrics(
+    metrics_registry,
+    METRICS_DIR,
+    interval=float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)),
+) if METRICS_DIR else None
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики в текстовом формате Prometheus: всех воркеров (METRICS_DIR) или процесса"""
+    text = shared_metrics.render() if shared_metrics is not None else metrics_registry.render()
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/admin/stats', methods=['GET'])
+def admin_stats():
+    """Статистика пулов соединений к внешним API, кешей и объединения запросов"""
+    return jsonify({
+        'upstream': upstream.stats(),
+        'product_cache': product_cache.stats(),
+        'singleflight': flights.stats(),
+        'access_cache': access_cache.stats(),
+        'product_streams': product_streams.stats(),
+        'watchlist': {**watchlist.stats(), **watchlist.store.counts()},
+        'warehouses': warehouse_index.stats(),
+        'image_cache': image_cache.stats(),
+        'health': health_prober.snapshots()
+    })
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    """Состояние сервиса и внешних API по последнему снимку фоновой проверки"""
+    health_prober.ensure_started()
+    if request.args.get('probe') == 'now':
+        health_prober.probe_all()
+    
     return jsonify({
         'status': 'ok', 
         'service': 'WB API Proxy',
-        'timestamp': os.times().user
+        'timestamp': os.times().user,
+        'upstreams': {
+            name: {
+                'status': snapshot['status'],
+                'success_rate': snapshot.get('success_rate'),
+                'latency_ms_avg': snapshot.get('latency_ms_avg'),
+                'breaker': (upstream.breaker_state(name) or {}).get('state')
+            }
+            for name, snapshot in health_prober.snapshots().items()
+        }
     })
 
+def reset_after_fork():
+    """
+    Воркер после fork (gunicorn с preload): соединения пулов мастера не
+    используются, пулы создаются заново в самом воркере
+    """
+    upstream.close()
+
+
+def shutdown(wait=True):
+    """
+    Остановка воркера: фоновая проверка прекращается, начатые запросы к внешним
+    API (пачки WB, опрос источников /full, фоновые обновления кеша) дорабатывают,
+    затем закрываются пулы соединений и дописывается лог
+    """
+    health_prober.stop()
+    if shared_metrics is not None:
+        shared_metrics.stop()
+    product_streams.stop()
+    watchlist.stop()
+    warehouse_index.stop()
+    for executor in (batch_executor, fanout_executor):
+        executor.shutdown(wait=wait)
+    product_cache.shutdown(wait=wait)
+    upstream.close()
+    log.info('server.shutdown', 'Воркер остановлен', pid=os.getpid())
+    shutdown_logging()
+
+
+GUNICORN_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+
 if __name__ == '__main__':
+    # python app.py - gunicorn с настройками gunicorn.conf.py;
+    # FLASK_DEBUG=1 python app.py - отладочный сервер Flask с перезагрузкой
     port = int(os.environ.get('PORT', 5000))
-    print(f"🚀 Запуск сервера на порту {port}")
-    print(f"🔗 Локальный API: {LOCAL_API_URL}")
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    if os.environ.get('FLASK_DEBUG') == '1':
+        log.info('server.start', 'Запуск отладочного сервера', port=port, local_api_url=LOCAL_API_URL)
+        app.run(host='0.0.0.0', port=port, debug=True)
+    else:
+        os.execv(sys.executable, [sys.executable, '-m', 'gunicorn', '--config', GUNICORN_CONFIG, 'app:app'])
\ No newline at end of file
@@ -0,0 +1,522 @@
+"""
+Асинхронный (ASGI) режим бэкенда.
+
+Маршруты, которые ждут внешние API (товары WB, nmInfo, /full), обслуживаются
+асинхронно через httpx и не занимают поток на время запроса - один процесс
+держит тысячи одновременных запросов. Остальные маршруты отдает исходное
+Flask-приложение через WSGI-мост. Адреса, параметры и JSON ответов те же.
+
+Запуск:
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import re
+import time
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Match, Mount, Route
+
+import app as backend
+from breaker import CircuitOpenError
+from deadline import DeadlineExceeded, deadline_var, narrowed
+from instrumentation import request_finished, request_started
+from log import get_logger, request_id_var, request_level, route_var
+from products import AsyncProducts
+from ratelimit import RateLimited, priority_var
+from singleflight import SingleFlightOverflow
+from streams import StreamLimitError
+from upstream import AsyncUpstreamClient
+
+
+log = get_logger('asgi')
+
+aupstream = AsyncUpstreamClient(backend.upstream)
+products = AsyncProducts(backend.products, aupstream, concurrency=backend.WB_BATCH_CONCURRENCY)
+
+def json_response(payload, status_code=200, headers=None):
+    """JSON-ответ тем же сериализатором и форматом, что и jsonify во Flask"""
+    return Response(
+        backend.app.json.encode(payload),
+        status_code=status_code,
+        headers=headers,
+        media_type='application/json'
+    )
+
+
+def conditional_json_response(request, payload):
+    """JSON с ETag и Cache-Control, как backend.conditional_json; If-None-Match -> 304"""
+    body = backend.app.json.encode(payload)
+    etag = backend.content_etag(body)
+    headers = {
+        'ETag': f'W/"{etag}"',
+        'Cache-Control': backend.product_cache_control(),
+    }
+    if backend.etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, headers=headers, media_type='application/json')
+
+
+async def fetch_local_nm_info(nm_id):
+    return await backend.flights.ado(('local', str(nm_id)), lambda: aupstream.get(
+        'local',
+        f"{backend.LOCAL_API_URL}/api/nmInfo?nmId={nm_id}",
+        headers=backend.LOCAL_API_HEADERS
+    ))
+
+
+async def stream_local_nm_info(nm_id, conditional_headers=None):
+    return await aupstream.get(
+        'local',
+        f"{backend.LOCAL_API_URL}/api/nmInfo?nmId={nm_id}",
+        headers={**backend.LOCAL_API_HEADERS, **(conditional_headers or {})},
+        stream=True
+    )
+
+
+def wants_merged_nm_info(request):
+    fmt = request.query_params.get('format')
+    if fmt in ('merged', 'raw'):
+        return fmt == 'merged'
+    return not backend.LOCAL_NMINFO_PASSTHROUGH
+
+
+def passthrough_response(request, upstream_response, headers):
+    """Потоковая отдача тела внешнего API, как backend.passthrough_response"""
+    encoding = upstream_response.headers.get('content-encoding', '').lower()
+    accepted = {
+        part.split(';')[0].strip().lower()
+        for part in request.headers.get('accept-encoding', '').split(',')
+    }
+    decode = bool(encoding) and encoding != 'identity' and encoding not in accepted and '*' not in accepted
+
+    headers = {**headers, **backend.passthrough_cache_headers(upstream_response, decode)}
+    headers['Vary'] = 'Accept-Encoding'
+    if not decode:
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        if 'content-length' in upstream_response.headers:
+            headers['Content-Length'] = upstream_response.headers['content-length']
+
+    async def body():
+        chunk_size = backend.LOCAL_STREAM_CHUNK_SIZE
+        chunks = upstream_response.aiter_bytes(chunk_size) if decode else upstream_response.aiter_raw(chunk_size)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await upstream_response.aclose()
+
+    return StreamingResponse(
+        body(),
+        status_code=upstream_response.status_code,
+        headers=headers,
+        media_type=upstream_response.headers.get('content-type', 'application/json')
+    )
+
+
+async def wb_product(request):
+    nm_id = request.query_params.get('nmId')
+    if not nm_id:
+        return json_response({'error': 'nmId parameter is required'}, 400)
+
+    nm_id = backend.parse_nm_id(nm_id)
+    if nm_id is None:
+        return json_response({'error': 'nmId must be a positive integer'}, 400)
+
+    dest = backend.request_dest(request.query_params)
+    if dest is None:
+        return json_response({'error': backend.INVALID_DEST_ERROR}, 400)
+
+    try:
+        result = await products.view('wb', nm_id, dest)
+        if result is None:
+            return json_response({'error': 'Товар не найден'}, 404)
+
+        return conditional_json_response(request, {
+            'product': result,
+            '_metadata': {
+                'source': 'wildberries_api',
+                'status': 'success'
+            }
+        })
+
+    except backend.WBApiError as e:
+        return json_response({'error': str(e), **e.details}, e.status)
+    except SingleFlightOverflow as e:
+        return json_response({'error': str(e)}, 503)
+    except RateLimited as e:
+        return json_response(
+            {'error': str(e), 'retry_after': e.retry_after}, 429, backend.retry_after_headers(e)
+        )
+    except CircuitOpenError as e:
+        return json_response(
+            {'error': str(e), 'retry_after': e.retry_after}, 503, backend.retry_after_headers(e)
+        )
+    except DeadlineExceeded as e:
+        return json_response({'error': str(e)}, 504)
+    except httpx.TimeoutException:
+        return json_response({'error': 'Таймаут при запросе к WB API'}, 504)
+    except Exception as e:
+        log.exception('wb.product.error', 'Ошибка при запросе к WB API')
+        return json_response({'error': f'Ошибка при запросе к WB API: {str(e)}'}, 500)
+
+
+async def stream_wb_product(request):
+    dest = backend.request_dest(request.query_params)
+    if dest is None:
+        return json_response({'error': backend.INVALID_DEST_ERROR}, 400)
+    hub = backend.product_streams
+    try:
+        events = hub.astream((request.path_params['product_id'], dest))
+    except StreamLimitError as e:
+        return json_response({'error': str(e)}, 503, {'Retry-After': str(int(hub.interval))})
+    log.info('wb.stream.subscribe', 'Подписка на изменения товара', nm_id=request.path_params['product_id'], dest=dest)
+    return StreamingResponse(events, media_type='text/event-stream', headers=backend.SSE_HEADERS)
+
+
+async def wb_products(request):
+    try:
+        if request.method == 'POST':
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            raw_ids = data.get('nmIds') if isinstance(data, dict) else data
+            if not isinstance(raw_ids, list):
+                return json_response({'error': 'JSON array of nmIds is required'}, 400)
+        else:
+            raw = request.query_params.get('nmIds', '')
+            raw_ids = [part for part in raw.replace(';', ',').split(',') if part.strip()]
+
+        if not raw_ids:
+            return json_response({'error': 'nmIds parameter is required'}, 400)
+
+        nm_ids, errors = backend.collect_nm_ids(raw_ids)
+
+        if len(nm_ids) > backend.WB_BATCH_MAX_IDS:
+            return json_response({'error': f'Не более {backend.WB_BATCH_MAX_IDS} nmId за запрос'}, 400)
+
+        dest = backend.request_dest(request.query_params)
+        if dest is None:
+            return json_response({'error': backend.INVALID_DEST_ERROR}, 400)
+
+        cards = await products.cards(nm_ids, dest)
+
+        return json_response(backend.wb_products_payload(nm_ids, cards, errors, len(raw_ids)))
+
+    except Exception as e:
+        log.exception('wb.products.error', 'Ошибка пакетного запроса к WB API')
+        return json_response({'error': f'Ошибка при запросе к WB API: {str(e)}'}, 500)
+
+
+async def product(request):
+    product_id = request.path_params['product_id']
+    dest = backend.request_dest(request.query_params)
+    if dest is None:
+        return json_response({'error': backend.INVALID_DEST_ERROR, 'product_id': product_id}, 400)
+
+    try:
+        result = await products.view('basic', product_id, dest)
+
+        if result is None:
+            return json_response({'error': 'Товар не найден в ответе'}, 404)
+
+        return conditional_json_response(request, result)
+
+    except backend.WBApiError as e:
+        return json_response({'error': str(e), 'product_id': product_id, **e.details}, e.status)
+    except SingleFlightOverflow as e:
+        return json_response({'error': str(e), 'product_id': product_id}, 503)
+    except RateLimited as e:
+        return json_response(
+            {'error': str(e), 'product_id': product_id, 'retry_after': e.retry_after},
+            429,
+            backend.retry_after_headers(e)
+        )
+    except CircuitOpenError as e:
+        return json_response(
+            {'error': str(e), 'product_id': product_id, 'retry_after': e.retry_after},
+            503,
+            backend.retry_after_headers(e)
+        )
+    except DeadlineExceeded as e:
+        return json_response({'error': str(e), 'product_id': product_id}, 504)
+    except httpx.TimeoutException:
+        return json_response({'error': 'Таймаут при запросе к WB API'}, 504)
+    except httpx.ConnectError:
+        return json_response({'error': 'Ошибка подключения к WB API'}, 503)
+    except httpx.HTTPError as e:
+        return json_response({'error': f'Ошибка сети: {str(e)}'}, 503)
+    except Exception as e:
+        log.exception('product.error', 'Неожиданная ошибка', nm_id=product_id)
+        return json_response({'error': f'Внутренняя ошибка: {str(e)}'}, 500)
+
+
+async def _full_local_source(nm_id):
+    response = await fetch_local_nm_info(nm_id)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise RuntimeError(f'Локальный API вернул статус {response.status_code}')
+    return response.json()
+
+
+async def _full_wb_source(nm_id, dest):
+    return await products.view('wb', nm_id, dest)
+
+
+async def product_full(request):
+    product_id = request.path_params['product_id']
+    dest = backend.request_dest(request.query_params)
+    if dest is None:
+        return json_response({'error': backend.INVALID_DEST_ERROR, 'nmId': product_id}, 400)
+    started = time.monotonic()
+
+    async def run(name, coro):
+        # Задача gather со своей копией контекста: срок источника - доля бюджета запроса
+        source_deadline = narrowed(backend.FULL_SOURCE_DEADLINES[name])
+        deadline_var.set(source_deadline)
+        try:
+            # shield: таймаут источника прекращает ожидание этого запроса, но не общую
+            # загрузку single-flight, которую ждут и другие запросы
+            value = await asyncio.wait_for(asyncio.shield(coro), source_deadline.remaining())
+            source = {'status': 'success' if value is not None else 'not_found'}
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            value, source = None, {'status': 'timeout'}
+        except (CircuitOpenError, RateLimited) as e:
+            value, source = None, {'status': e.status, 'retry_after': e.retry_after}
+        except DeadlineExceeded as e:
+            value, source = None, {'status': e.status}
+        except Exception as e:
+            log.warning('product.full.source_error', 'Источник недоступен', source=name, error=str(e))
+            value, source = None, {'status': 'error', 'error': str(e)}
+        source['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return name, value, source
+
+    result = {'nmId': product_id}
+    sources = {}
+    for name, value, source in await asyncio.gather(
+        run('local', _full_local_source(product_id)),
+        run('wb', _full_wb_source(product_id, dest)),
+    ):
+        result[name] = value
+        sources[name] = source
+
+    status_code = backend.finish_full_result(result, sources)
+    return json_response(result, status_code, backend.full_result_headers(sources, status_code))
+
+
+def _local_error(status_code, error, status, solution=None, headers=None, **extra):
+    payload = {
+        'error': error,
+        'local_api_url': backend.LOCAL_API_URL,
+        '_metadata': {
+            'source': 'error',
+            'status': status
+        },
+        **extra
+    }
+    if solution:
+        payload['solution'] = solution
+    return json_response(payload, status_code, headers)
+
+
+async def local_raw_nm_info(request):
+    nm_id = request.query_params.get('nmId')
+    if not nm_id:
+        return json_response({'error': 'nmId parameter is required'}, 400)
+
+    target_url = f"{backend.LOCAL_API_URL}/api/nmInfo?nmId={nm_id}"
+    try:
+        merged = wants_merged_nm_info(request)
+        if merged:
+            response = await fetch_local_nm_info(nm_id)
+        else:
+            response = await stream_local_nm_info(nm_id, backend.client_conditional_headers(request.headers))
+
+        if response.status_code == 304 and not merged:
+            return passthrough_response(request, response, backend.nm_info_metadata_headers(nm_id))
+
+        if response.status_code != 200:
+            await response.aclose()
+            return json_response({
+                'error': f'Локальный API вернул статус {response.status_code}',
+                'status_code': response.status_code,
+                'url': target_url
+            }, 502)
+
+        if not merged:
+            return passthrough_response(request, response, backend.nm_info_metadata_headers(nm_id))
+
+        return conditional_json_response(request, {
+            **response.json(),
+            '_metadata': {
+                'source': 'local_api',
+                'status': 'success',
+                'local_api_url': backend.LOCAL_API_URL,
+                'nm_id_requested': nm_id
+            }
+        })
+
+    except SingleFlightOverflow as e:
+        return _local_error(503, str(e), 'overloaded')
+    except DeadlineExceeded as e:
+        return _local_error(504, str(e), 'deadline_exceeded')
+    except CircuitOpenError as e:
+        return _local_error(
+            503, 'Локальный API временно недоступен', 'circuit_open',
+            headers=backend.retry_after_headers(e), retry_after=e.retry_after
+        )
+    except httpx.ConnectError as e:
+        # httpx сообщает об ошибке SSL как об ошибке подключения
+        if 'SSL' in str(e) or 'CERTIFICATE' in str(e):
+            return _local_error(
+                503, 'SSL ошибка при подключении к локальному API', 'ssl_error',
+                'Сертификат не доверенный или самоподписанный'
+            )
+        return _local_error(
+            503, 'Не удалось подключиться к локальному API', 'connection_failed',
+            'Убедитесь что сервер 192.168.171.248:8443 запущен и доступен'
+        )
+    except httpx.TimeoutException:
+        return _local_error(504, 'Таймаут при запросе к локальному API', 'timeout')
+    except Exception as e:
+        log.exception('local.error', 'Ошибка при запросе к локальному API')
+        return _local_error(500, f'Ошибка при запросе к локальному API: {str(e)}', 'exception')
+
+
+async def _startup():
+    # Фоновые задачи Flask-части запускает его before_request, а запросы к
+    # нативным маршрутам до Flask не доходят
+    backend.start_background_tasks()
+
+
+async def _shutdown():
+    await aupstream.aclose()
+    # Пулы и фоновые задачи Flask-части - как у воркера gunicorn
+    await asyncio.to_thread(backend.shutdown)
+
+
+def flask_rule(path):
+    """Маршрут Starlette в виде правила Flask: /x/{id:int} -> /x/<int:id>"""
+    return re.sub(r'\{(\w+):int\}', r'<int:\1>', path)
+
+
+class RequestContextMiddleware:
+    """
+    request_id и маршрут в логах асинхронных маршрутов, приоритет запросов
+    администраторов к WB, срок запроса с заголовком Server-Timing, метрики и
+    строка access-лога. Запросы, которые уходят во Flask, получают тот же X-Request-ID заголовком,
+    а access-лог для них пишет Flask.
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = [route for route in routes if isinstance(route, Route)]
+
+    def route_for(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                return route.path
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        incoming = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'x-request-id'), None)
+        request_id = backend.request_id_from(incoming)
+        scope = dict(scope, headers=[
+            *((name, value) for name, value in scope['headers'] if name != b'x-request-id'),
+            (b'x-request-id', request_id.encode()),
+        ])
+
+        route = self.route_for(scope)
+        if route is None:
+            return await self.app(scope, receive, send)
+
+        request_token = request_id_var.set(request_id)
+        route_token = route_var.set(route)
+        init_data = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'x-telegram-init-data'), None)
+        if init_data and backend.users.sync_due:
+            # Изменения белого списка из других воркеров - чтение SQLite не в event loop
+            await asyncio.to_thread(backend.users.sync)
+        # Подпись initData проверяется по кешу, роль - по индексу белого списка в памяти
+        priority_token = priority_var.set(backend.is_admin_init_data(init_data, sync=False))
+        timeout = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'x-request-timeout'), None)
+        deadline = backend.request_deadline(flask_rule(route), timeout)
+        deadline_token = deadline_var.set(deadline)
+        started = time.monotonic()
+        status = [500]
+        size = [0]
+        request_started()
+
+        async def send_with_request_id(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                message['headers'] = [*message.get('headers', []), (b'x-request-id', request_id.encode())]
+                if deadline is not None:
+                    timing = deadline.server_timing(time.monotonic() - started)
+                    message['headers'].append((b'server-timing', timing.encode()))
+            elif message['type'] == 'http.response.body':
+                size[0] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_finished(route, scope['method'], status[0], time.monotonic() - started, size[0])
+            log.log(
+                request_level(status[0]), 'request', 'Запрос обработан',
+                method=scope['method'],
+                path=scope['path'],
+                status=status[0],
+                duration_ms=round((time.monotonic() - started) * 1000, 1)
+            )
+            request_id_var.reset(request_token)
+            route_var.reset(route_token)
+            priority_var.reset(priority_token)
+            deadline_var.reset(deadline_token)
+
+
+ROUTES = [
+    Route('/api/wb/product', wb_product, methods=['GET']),
+    Route('/api/wb/product/{product_id:int}/stream', stream_wb_product, methods=['GET']),
+    Route('/api/wb/products', wb_products, methods=['GET', 'POST']),
+    Route('/api/product/{product_id:int}', product, methods=['GET']),
+    Route('/api/product/{product_id:int}/full', product_full, methods=['GET']),
+    Route('/api/local/raw/nmInfo', local_raw_nm_info, methods=['GET']),
+    # Все остальные маршруты - исходное Flask-приложение
+    Mount('/', app=WSGIMiddleware(backend.app)),
+]
+
+app = Starlette(
+    routes=ROUTES,
+    middleware=[
+        Middleware(RequestContextMiddleware, routes=ROUTES),
+        Middleware(
+            CORSMiddleware,
+            allow_origins=['*'],
+            allow_methods=['*'],
+            allow_headers=['*'],
+            expose_headers=backend.NM_INFO_METADATA_HEADERS + ['X-Request-ID', 'Server-Timing'],
+            max_age=backend.CORS_MAX_AGE
+        ),
+        # Ответы Flask уже сжаты его after_request; ответы с Content-Encoding
+        # не трогаются (SSE отдается с identity, чтобы события не копились в буфере gzip)
+        Middleware(
+            GZipMiddleware,
+            minimum_size=backend.compressor.min_size,
+            compresslevel=backend.compressor.gzip_level
+        ),
+    ],
+    on_startup=[_startup],
+    on_shutdown=[_shutdown],
+)
@@ -0,0 +1,63 @@
+"""
+Микробенчмарк проверки initData Telegram: проверок в секунду.
+
+Сравнивает InitDataVerifier (ключ HMAC вычисляется один раз на токен) с
+вычислением ключа на каждый вызов, как было раньше в verify_telegram_init_data.
+
+    python bench/bench_init_data.py --iterations 200000
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram_auth import InitDataVerifier, secret_key  # noqa: E402
+
+
+BOT_TOKEN = '123456:bench-token'
+
+
+def make_init_data(user_id):
+    fields = {
+        'auth_date': str(int(time.time())),
+        'query_id': 'AAHdF6IQAAAAAN0XohDhrOrc',
+        'user': json.dumps({'id': user_id, 'first_name': 'Менеджер', 'username': 'manager'}, ensure_ascii=False),
+    }
+    data_check_string = '\n'.join(f"{key}={value}" for key, value in sorted(fields.items()))
+    fields['hash'] = hmac.new(secret_key(BOT_TOKEN), data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def verify_with_key_per_call(verifier, init_data):
+    secret_key.cache_clear()
+    return verifier.verify(init_data)
+
+
+def run(name, fn, samples, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(samples[i % len(samples)])
+    elapsed = time.perf_counter() - started
+    print(f"{name:<28} {iterations / elapsed:>12,.0f} проверок/с  {elapsed / iterations * 1e6:>8.2f} мкс/проверка")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    verifier = InitDataVerifier(BOT_TOKEN)
+    samples = [make_init_data(user_id) for user_id in range(1000, 1100)]
+
+    run('ключ на каждый вызов', lambda data: verify_with_key_per_call(verifier, data), samples, args.iterations)
+    run('InitDataVerifier', verifier.verify, samples, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
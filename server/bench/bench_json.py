@@ -0,0 +1,109 @@
+"""
+Бенчмарк ответа /api/wb/product: время кодирования JSON и размер ответа.
+
+Сравнивает прежний jsonify (стандартный json, \\uXXXX-экранирование кириллицы)
+с FastJSONProvider (orjson или json без экранирования) и размер тела без
+сжатия, с gzip и brotli (если установлен пакет brotli).
+
+    python bench/bench_json.py --iterations 20000 --warehouses 60
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Бенчмарку не нужна база пользователей приложения
+os.environ.setdefault('USER_STORE_DB', os.path.join(tempfile.mkdtemp(), 'users.db'))
+
+import app as backend  # noqa: E402
+from compression import Compressor, brotli  # noqa: E402
+from json_provider import FastJSONProvider, orjson  # noqa: E402
+
+
+def make_card(nm_id, warehouses):
+    """Сырая карточка WB, похожая на реальную: кириллица, склады, акции"""
+    return {
+        'id': nm_id,
+        'brand': 'Бренд Коллекция',
+        'name': 'Платье женское летнее миди из хлопка с поясом и карманами',
+        'entity': 'Платья',
+        'rating': 5,
+        'reviewRating': 4.8,
+        'feedbacks': 12873,
+        'totalQuantity': 4210,
+        'supplier': 'ИП Иванова Мария Сергеевна',
+        'supplierRating': 4.7,
+        'subjectId': 69,
+        'pics': 12,
+        'volume': 12,
+        'weight': 0.35,
+        'time1': 2,
+        'time2': 36,
+        'promotions': [117501, 151123, 159442, 163804, 170032, 173111, 180523],
+        'sizes': [{
+            'name': size,
+            'origName': size,
+            'price': {'basic': 499900, 'product': 219900},
+            'stocks': [
+                {'wh': 100000 + i * 137, 'qty': (i * 7) % 90 + 1, 'time1': 1 + i % 5, 'time2': 20 + i % 40}
+                for i in range(warehouses)
+            ],
+        } for size in ('42', '44', '46', '48', '50')],
+    }
+
+
+def jsonify_before(payload):
+    """Кодирование, как у jsonify до FastJSONProvider"""
+    return (json.dumps(payload, ensure_ascii=True, sort_keys=True, separators=(',', ':')) + '\n').encode()
+
+
+def run(name, encode, payload, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        body = encode(payload)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<26} {iterations / elapsed:>10,.0f} ответов/с  {elapsed / iterations * 1e6:>8.1f} мкс/ответ")
+    return body
+
+
+def sizes(name, body, compressor):
+    row = f"{name:<26} {len(body):>8,} байт"
+    for encoding in compressor.encodings:
+        row += f"  {encoding}: {len(compressor.compress(body, encoding)):>7,} байт"
+    print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--warehouses', type=int, default=60, help='складов у первого размера')
+    args = parser.parse_args()
+
+    payload = {
+        'product': backend.project_wb_product(make_card(205886056, args.warehouses)),
+        '_metadata': {'source': 'wildberries_api', 'status': 'success'},
+    }
+    compressor = Compressor()
+    fast_json = FastJSONProvider(backend.app, backend='json')
+    candidates = [('jsonify (до)', jsonify_before), ('FastJSONProvider/json', fast_json.encode)]
+    if orjson is not None:
+        candidates.append(('FastJSONProvider/orjson', FastJSONProvider(backend.app, backend='orjson').encode))
+    else:
+        print('orjson не установлен - сравнение только со стандартным json')
+    if brotli is None:
+        print('brotli не установлен - только gzip')
+
+    print('\nКодирование:')
+    bodies = [(name, run(name, encode, payload, args.iterations)) for name, encode in candidates]
+
+    print('\nРазмер ответа:')
+    for name, body in bodies:
+        sizes(name, body, compressor)
+
+
+if __name__ == '__main__':
+    main()
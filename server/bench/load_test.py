@@ -0,0 +1,304 @@
+"""
+Нагрузочный тест бэкенда без внешних API: RPS и p50/p95/p99 по эндпоинтам.
+
+Поднимает заглушки WB и локального API (bench/stubs.py), запускает бэкенд в
+выбранном режиме (flask - встроенный сервер, gunicorn, uvicorn - ASGI) с
+адресами заглушек и по очереди нагружает каждый эндпоинт из app.py заданным
+числом параллельных клиентов. Лимит запросов к WB отключается, база
+пользователей - временная.
+
+    python bench/load_test.py --mode gunicorn --workers 2 --threads 8 --concurrency 32 --duration 10
+    python bench/load_test.py --mode uvicorn --scenarios wb_product,product_full --json result.json
+    python bench/load_test.py --url http://127.0.0.1:5000 --scenarios health
+
+--compare baseline.json завершает тест с кодом 1, если RPS упал или p95
+вырос больше чем на --max-regression (для CI).
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import requests
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from stubs import add_stub_arguments, start_stub, stub_config  # noqa: E402
+
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ADMIN_ID = 5429222882
+
+
+def nm_id(rng, args):
+    return 100000 + rng.randrange(args.id_space)
+
+
+# Эндпоинт: (метод, путь(rng, args), тело(rng, args) или None)
+SCENARIOS = {
+    'home': ('GET', lambda rng, args: '/', None),
+    'health': ('GET', lambda rng, args: '/api/health', None),
+    'metrics': ('GET', lambda rng, args: '/metrics', None),
+    'admin_stats': ('GET', lambda rng, args: '/api/admin/stats', None),
+    'admin_users': ('GET', lambda rng, args: '/api/admin/users?limit=50', None),
+    'add_user': ('POST', lambda rng, args: '/api/admin/add-user', lambda rng, args: {
+        'user_id': 1000000 + rng.randrange(100000), 'username': 'bench', 'name': 'Нагрузочный тест',
+    }),
+    'check_access': ('POST', lambda rng, args: '/api/check-access', lambda rng, args: {
+        'user_id': ADMIN_ID if rng.random() < 0.5 else 2000000 + rng.randrange(args.id_space),
+    }),
+    'wb_product': ('GET', lambda rng, args: f'/api/wb/product?nmId={nm_id(rng, args)}', None),
+    'wb_products': ('GET', lambda rng, args: '/api/wb/products?nmIds=' + ','.join(
+        str(nm_id(rng, args)) for _ in range(args.batch_size)
+    ), None),
+    'product': ('GET', lambda rng, args: f'/api/product/{nm_id(rng, args)}', None),
+    'product_full': ('GET', lambda rng, args: f'/api/product/{nm_id(rng, args)}/full', None),
+    'wb_history': ('GET', lambda rng, args: f'/api/wb/product/{nm_id(rng, args)}/history', None),
+    'admin_watchlist': ('GET', lambda rng, args: '/api/admin/watchlist?limit=50', None),
+    'local_raw': ('GET', lambda rng, args: f'/api/local/raw/nmInfo?nmId={nm_id(rng, args)}', None),
+    'local_health': ('GET', lambda rng, args: '/api/local/health', None),
+    'local_debug': ('GET', lambda rng, args: f'/api/local/debug?nmId={nm_id(rng, args)}', None),
+    'debug_wb': ('GET', lambda rng, args: '/api/debug/wb', None),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(args, port):
+    if args.mode == 'gunicorn':
+        return [
+            sys.executable, '-m', 'gunicorn', 'app:app',
+            # Настройки как в проде (хуки, keepalive, лимиты); ключи ниже их переопределяют
+            '--config', 'gunicorn.conf.py',
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(args.workers),
+            '--threads', str(args.threads),
+            '--log-level', 'warning',
+        ]
+    if args.mode == 'uvicorn':
+        return [
+            sys.executable, '-m', 'uvicorn', 'asgi:app',
+            '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(args.workers),
+            '--log-level', 'warning',
+        ]
+    return [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--with-threads']
+
+
+def start_backend(args, wb_url, local_url, workdir):
+    """Запускает бэкенд подпроцессом и ждет, пока он начнет отвечать"""
+    port = free_port()
+    env = {
+        **os.environ,
+        'WB_API_URL': wb_url,
+        'WB_STATIC_URL': wb_url,
+        'WAREHOUSES_CACHE': os.path.join(workdir, 'warehouses.json'),
+        'LOCAL_API_URL': local_url,
+        'USER_STORE_DB': os.path.join(workdir, 'users.db'),
+        'WATCHLIST_DB': os.path.join(workdir, 'watchlist.db'),
+        'WB_RATE_LIMIT': '0',
+        'LOG_LEVEL': args.log_level,
+        # gunicorn.conf.py и app.py (лимит SSE на воркер) читают число потоков из окружения
+        'GUNICORN_THREADS': str(args.threads),
+    }
+    process = subprocess.Popen(
+        server_command(args, port),
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL if args.quiet else None,
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Бэкенд завершился с кодом {process.returncode}')
+        try:
+            requests.get(f'{url}/api/health', timeout=1)
+            return process, url
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('Бэкенд не ответил за 30 с')
+
+
+def percentile(values, q):
+    """Перцентиль по ближайшему рангу; values отсортированы"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(int(len(values) * q + 0.5) - 1, 0))]
+
+
+def run_scenario(name, url, args):
+    method, path, body = SCENARIOS[name]
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    stop_at = [None]
+    started = threading.Barrier(args.concurrency + 1)
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = 'gzip'
+        local_latencies = []
+        local_statuses = Counter()
+        started.wait()
+        while time.monotonic() < stop_at[0]:
+            request_started = time.perf_counter()
+            try:
+                response = session.request(
+                    method, url + path(rng, args),
+                    json=body(rng, args) if body else None,
+                    timeout=args.timeout
+                )
+                response.content
+                status = response.status_code
+            except requests.exceptions.RequestException as e:
+                status = type(e).__name__
+            local_latencies.append(time.perf_counter() - request_started)
+            local_statuses[status] += 1
+        session.close()
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    threads = [threading.Thread(target=client, args=(seed,), daemon=True) for seed in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    begin = time.monotonic()
+    stop_at[0] = begin + args.duration
+    started.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - begin
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if isinstance(status, int) and status < 400)
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'ok_rate': round(ok / len(latencies), 4) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    }
+
+
+def print_report(results):
+    print(f"\n{'эндпоинт':<14} {'запросов':>9} {'RPS':>9} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'успешно':>8}  статусы")
+    for name, result in results.items():
+        print(
+            f"{name:<14} {result['requests']:>9,} {result['rps']:>9,.1f} "
+            f"{result['p50_ms'] or 0:>9.2f} {result['p95_ms'] or 0:>9.2f} {result['p99_ms'] or 0:>9.2f} "
+            f"{result['ok_rate']:>8.1%}  {result['statuses']}"
+        )
+
+
+def compare(results, baseline, max_regression):
+    """Эндпоинты, где RPS упал или p95 вырос больше допустимого"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        if before['rps'] and result['rps'] < before['rps'] * (1 - max_regression):
+            regressions.append(f"{name}: RPS {before['rps']} -> {result['rps']}")
+        if before['p95_ms'] and result['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} мс")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=('flask', 'gunicorn', 'uvicorn'), default='gunicorn')
+    parser.add_argument('--url', help='адрес уже запущенного бэкенда (заглушки и запуск не нужны)')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='потоков на воркер gunicorn')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='эндпоинты через запятую')
+    parser.add_argument('--concurrency', type=int, default=16, help='параллельных клиентов')
+    parser.add_argument('--duration', type=float, default=5.0, help='секунд на эндпоинт')
+    parser.add_argument('--warmup', type=float, default=1.0, help='секунд прогрева перед замером')
+    parser.add_argument('--id-space', type=int, default=500, help='разных nmId в запросах (меньше - чаще попадания в кеш)')
+    parser.add_argument('--batch-size', type=int, default=20, help='nmId в запросе wb_products')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--log-level', default='WARNING', help='LOG_LEVEL бэкенда')
+    parser.add_argument('--quiet', action='store_true', help='не показывать вывод бэкенда')
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    parser.add_argument('--compare', help='файл с результатами предыдущего запуска')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='допустимое ухудшение RPS/p95')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные эндпоинты: {', '.join(unknown)}; доступны: {', '.join(SCENARIOS)}")
+
+    process = None
+    stubs = []
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    try:
+        if args.url:
+            url = args.url.rstrip('/')
+        else:
+            config = stub_config(args)
+            stubs = [start_stub(config), start_stub(config)]
+            process, url = start_backend(args, stubs[0].url, stubs[1].url, workdir)
+
+        print(f"Бэкенд: {url} ({'внешний' if args.url else args.mode}), клиентов: {args.concurrency}, "
+              f"{args.duration} с на эндпоинт")
+        results = {}
+        for name in scenarios:
+            if args.warmup:
+                run_scenario(name, url, argparse.Namespace(**{**vars(args), 'duration': args.warmup}))
+            results[name] = run_scenario(name, url, args)
+            print(f"  {name}: {results[name]['rps']:,.1f} RPS, p95 {results[name]['p95_ms']} мс")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for stub in stubs:
+            stub.shutdown()
+
+    print_report(results)
+    report = {
+        'mode': 'external' if args.url else args.mode,
+        'workers': args.workers,
+        'threads': args.threads,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'stub': {'latency': args.latency, 'error_rate': args.error_rate, 'warehouses': args.warehouses},
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print('\nУхудшение относительно ' + args.compare + ':')
+            for line in regressions:
+                print('  ' + line)
+            sys.exit(1)
+        print(f'\nУхудшений относительно {args.compare} нет')
+
+
+if __name__ == '__main__':
+    main()
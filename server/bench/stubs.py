@@ -0,0 +1,189 @@
+"""
+Заглушки внешних API для нагрузочных тестов: WB (cards/v4/detail,
+справочник складов) и локальный API (/api/nmInfo, /api/health).
+
+Задержка, доля ошибок и размер ответов настраиваются; ответы похожи на
+настоящие по структуре и размеру. Можно запустить отдельно:
+
+    python bench/stubs.py --wb-port 9001 --local-port 9002 --latency 0.05
+"""
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubConfig:
+    def __init__(self, latency=0.02, jitter=0.01, error_rate=0.0, not_found_rate=0.0,
+                 warehouses=30, nm_info_size=20000):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.not_found_rate = not_found_rate
+        self.warehouses = warehouses
+        self.nm_info_size = nm_info_size
+
+
+def wb_card(nm_id, warehouses):
+    """Карточка WB со складами по размерам, как в ответе cards/v4/detail"""
+    return {
+        'id': nm_id,
+        'brand': 'Бренд Коллекция',
+        'name': f'Платье женское летнее миди {nm_id}',
+        'entity': 'Платья',
+        'rating': 5,
+        'reviewRating': 4.8,
+        'feedbacks': 12873,
+        'totalQuantity': 4210,
+        'supplier': 'ИП Иванова Мария Сергеевна',
+        'supplierRating': 4.7,
+        'subjectId': 69,
+        'pics': 12,
+        'volume': 12,
+        'weight': 0.35,
+        'time1': 2,
+        'time2': 36,
+        'sizes': [{
+            'name': size,
+            'origName': size,
+            'price': {'basic': 499900, 'product': 219900},
+            'stocks': [
+                {'wh': 100000 + i * 137, 'qty': (i * 7) % 90 + 1, 'time1': 1 + i % 5, 'time2': 20 + i % 40}
+                for i in range(warehouses)
+            ],
+        } for size in ('42', '44', '46', '48', '50')],
+    }
+
+
+def warehouses(count):
+    """Справочник складов (stores-data.json) для складов из wb_card"""
+    return [{'id': 100000 + i * 137, 'name': f'Склад {i}', 'city': 'Москва'} for i in range(count)]
+
+
+def nm_info(nm_id, size):
+    """Ответ /api/nmInfo локального API; size - примерный размер JSON в байтах"""
+    return {
+        'value': {
+            'nmId': nm_id,
+            'price': 2199,
+            'stocks': [{'warehouse': f'Склад {i}', 'qty': i % 17} for i in range(max(size // 40, 1))],
+        }
+    }
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Заголовки и тело уходят разными write: без TCP_NODELAY Nagle и
+        # delayed ACK клиента добавляют ~40 мс к каждому ответу
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            if config.latency or config.jitter:
+                time.sleep(max(config.latency + random.uniform(-config.jitter, config.jitter), 0))
+            if config.error_rate and random.random() < config.error_rate:
+                return self.send_json(503, {'error': 'stub error'})
+
+            if url.path == '/cards/v4/detail':
+                nm_ids = [int(nm_id) for nm_id in query.get('nm', [''])[0].split(';') if nm_id.isdigit()]
+                products = [
+                    wb_card(nm_id, config.warehouses) for nm_id in nm_ids
+                    if not (config.not_found_rate and random.random() < config.not_found_rate)
+                ]
+                return self.send_json(200, {'data': {'products': products}})
+            if url.path == '/vol0/data/stores-data.json':
+                return self.send_json(200, warehouses(config.warehouses))
+            if url.path == '/api/nmInfo':
+                nm_id = query.get('nmId', [''])[0]
+                if not nm_id.isdigit():
+                    return self.send_json(400, {'error': 'bad nmId'})
+                if config.not_found_rate and random.random() < config.not_found_rate:
+                    return self.send_json(404, {'error': 'not found'})
+                return self.send_json(200, nm_info(int(nm_id), config.nm_info_size))
+            if url.path == '/api/health':
+                return self.send_json(200, {'status': 'ok'})
+            return self.send_json(404, {'error': 'unknown path'})
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode()
+            compress = 'gzip' in self.headers.get('Accept-Encoding', '') and len(body) > 1024
+            if compress:
+                body = gzip.compress(body, compresslevel=1)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            if compress:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Нагрузочный тест открывает много соединений сразу
+    request_queue_size = 1024
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def start_stub(config, port=0, host='127.0.0.1'):
+    """Запускает заглушку в фоновом потоке; server.url - ее адрес, server.shutdown() - остановка"""
+    server = StubServer((host, port), make_handler(config))
+    threading.Thread(target=server.serve_forever, name='stub', daemon=True).start()
+    return server
+
+
+def add_stub_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка ответа заглушек, с')
+    parser.add_argument('--jitter', type=float, default=0.01, help='разброс задержки, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--not-found-rate', type=float, default=0.0, help='доля ненайденных товаров')
+    parser.add_argument('--warehouses', type=int, default=30, help='складов у каждого размера карточки WB')
+    parser.add_argument('--nm-info-size', type=int, default=20000, help='размер ответа nmInfo, байт')
+
+
+def stub_config(args):
+    return StubConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        not_found_rate=args.not_found_rate,
+        warehouses=args.warehouses,
+        nm_info_size=args.nm_info_size,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--wb-port', type=int, default=9001)
+    parser.add_argument('--local-port', type=int, default=9002)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    config = stub_config(args)
+    wb = start_stub(config, args.wb_port)
+    local = start_stub(config, args.local_port)
+    print(f'WB_API_URL={wb.url} LOCAL_API_URL={local.url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
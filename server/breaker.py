@@ -0,0 +1,142 @@
+"""
+Circuit breaker для внешних API.
+
+closed    - запросы идут, исходы копятся в скользящем окне;
+open      - доля ошибок или медленных ответов в окне превысила порог: запросы
+            сразу отклоняются с CircuitOpenError (retry_after - сколько ждать);
+half_open - после open_timeout пропускается несколько пробных запросов;
+            все успешны - снова closed, любая ошибка - снова open.
+"""
+import threading
+import time
+from collections import deque
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Внешний API считается недоступным, запрос не выполнялся"""
+
+    # Статус источника в ответах API (/full, _metadata)
+    status = 'circuit_open'
+
+    def __init__(self, name, retry_after):
+        super().__init__(f'{name}: внешний API временно недоступен, повторите через {retry_after} с')
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, window=20, min_calls=10, error_rate=0.5,
+                 slow_call_duration=5.0, slow_call_rate=0.8, open_timeout=30.0,
+                 half_open_probes=3, clock=time.monotonic):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_timeout = open_timeout
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._outcomes = deque(maxlen=window)  # (ошибка, медленный)
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+        self.rejected = 0
+        self.opened_count = 0
+        self.last_error = None
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_timeout:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self._outcomes.clear()
+        self.opened_count += 1
+
+    def retry_after(self):
+        return max(1, int(self.open_timeout - (self.clock() - self._opened_at) + 0.999))
+
+    def before_call(self):
+        """Разрешает запрос или выбрасывает CircuitOpenError"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == OPEN:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.retry_after())
+            if self._state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 1)
+                self._probes_in_flight += 1
+
+    def after_call(self, duration, error=None, neutral=False):
+        """
+        Учитывает исход запроса: error - исключение или описание ошибки.
+        neutral - исход ничего не говорит о здоровье API (запрос отменен или
+        прерван сроком клиента): слот пробы освобождается, в окно не попадает
+        """
+        slow = duration >= self.slow_call_duration
+        with self._lock:
+            if neutral:
+                if self._state == HALF_OPEN:
+                    self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                return
+            if error is not None:
+                self.last_error = str(error)
+
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                if error is not None:
+                    self._open()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self._state = CLOSED
+                        self._outcomes.clear()
+                return
+
+            if self._state != CLOSED:
+                return
+
+            self._outcomes.append((error is not None, slow))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            errors = sum(1 for failed, _ in self._outcomes if failed)
+            slow_calls = sum(1 for _, was_slow in self._outcomes if was_slow)
+            if errors / calls >= self.error_rate or slow_calls / calls >= self.slow_call_rate:
+                self._open()
+
+    def snapshot(self):
+        with self._lock:
+            self._maybe_half_open()
+            calls = len(self._outcomes)
+            errors = sum(1 for failed, _ in self._outcomes if failed)
+            return {
+                'state': self._state,
+                'retry_after': self.retry_after() if self._state == OPEN else 0,
+                'window_calls': calls,
+                'window_error_rate': round(errors / calls, 3) if calls else 0.0,
+                'opened_count': self.opened_count,
+                'rejected': self.rejected,
+                'last_error': self.last_error,
+            }
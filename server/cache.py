@@ -0,0 +1,217 @@
+"""
+Ограниченный in-process кеш с TTL, LRU-вытеснением и stale-while-revalidate.
+
+Запись живет ttl секунд как свежая, затем еще stale_ttl секунд может отдаваться
+как устаревшая - в этом случае сразу возвращается старое значение, а обновление
+запускается в фоне. Вытеснение - по давности использования, с ограничением
+по числу записей и суммарному размеру в байтах.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from log import get_logger
+
+
+log = get_logger(__name__)
+
+_MISSING = object()
+
+
+def json_size(value):
+    """Приблизительный размер значения - длина его JSON в байтах"""
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'expires_at', 'stale_until')
+
+    def __init__(self, value, size, expires_at, stale_until):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+
+
+class TTLCache:
+    """Потокобезопасный TTL + LRU кеш"""
+
+    def __init__(self, ttl, max_entries, max_bytes=None, stale_ttl=0,
+                 sizeof=json_size, clock=time.monotonic, refresh_workers=4):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.clock = clock
+
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._refresh_workers = refresh_workers
+        self._executor = None
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key, now):
+        """Возвращает (entry, fresh) или (None, False); вызывается под блокировкой"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None, False
+        if now < entry.expires_at:
+            self._data.move_to_end(key)
+            return entry, True
+        if now < entry.stale_until:
+            self._data.move_to_end(key)
+            return entry, False
+        # Запись окончательно устарела
+        self._remove(key)
+        self.expirations += 1
+        return None, False
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.evictions += 1
+
+    def get(self, key, default=None, allow_stale=False):
+        with self._lock:
+            entry, fresh = self._lookup(key, self.clock())
+            if entry is not None and (fresh or allow_stale):
+                if fresh:
+                    self.hits += 1
+                else:
+                    self.stale_hits += 1
+                return entry.value
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        now = self.clock()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        entry = _Entry(value, size, expires_at, expires_at + self.stale_ttl)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = entry
+            self._bytes += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data[key].value
+            self._remove(key)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def get_or_refresh(self, key, loader, default=None):
+        """
+        Значение из кеша; для устаревшей записи дополнительно запускает
+        фоновое обновление через loader(). При промахе возвращает default.
+        """
+        with self._lock:
+            entry, fresh = self._lookup(key, self.clock())
+            if entry is not None:
+                if fresh:
+                    self.hits += 1
+                else:
+                    self.stale_hits += 1
+                    self._schedule_refresh(key, loader)
+                return entry.value
+            self.misses += 1
+            return default
+
+    def get_or_load(self, key, loader):
+        """
+        Возвращает значение из кеша или загружает его через loader().
+        Устаревшая запись отдается сразу, а loader запускается в фоне.
+        Исключения loader() при промахе пробрасываются вызывающему.
+        """
+        value = self.get_or_refresh(key, loader, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def _schedule_refresh(self, key, loader):
+        # Вызывается под блокировкой: одно фоновое обновление на ключ
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._refresh_workers,
+                thread_name_prefix='cache-refresh'
+            )
+        self._executor.submit(self._refresh, key, loader)
+
+    def _refresh(self, key, loader):
+        try:
+            value = loader()
+            self.set(key, value)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            with self._lock:
+                self.refresh_errors += 1
+            log.warning('cache.refresh_error', 'Ошибка фонового обновления кеша', key=str(key), error=str(e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def shutdown(self, wait=True):
+        """Останавливает фоновые обновления; wait=True - дожидается начатых"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'stale_ttl': self.stale_ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'refreshing': len(self._refreshing),
+            }
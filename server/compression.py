@@ -0,0 +1,66 @@
+"""
+Сжатие ответов API (gzip, brotli) по заголовку Accept-Encoding клиента.
+
+Сжимаются только текстовые ответы (JSON и т.п.) не меньше min_size байт.
+Потоковые ответы и ответы, уже имеющие Content-Encoding (например, сжатые
+локальным API), не трогаются. brotli используется, если установлен пакет brotli.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'text/',
+    'application/javascript',
+)
+
+
+class Compressor:
+    def __init__(self, min_size=1024, gzip_level=6, brotli_level=4):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_level = brotli_level
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_level)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def choose_encoding(self, accept_encodings):
+        """Лучшее поддерживаемое сжатие с учетом q-значений или None"""
+        return accept_encodings.best_match(self.encodings)
+
+    def after_request(self, response):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)
+        ):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        response.set_data(self.compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
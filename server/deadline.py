@@ -0,0 +1,153 @@
+"""
+Бюджет времени запроса к сервису (deadline).
+
+Срок задается заголовком X-Request-Timeout (секунды) или значением по
+умолчанию для маршрута и хранится в contextvar - его видят все запросы к
+внешним API из обработчика, в том числе из потоков пула (copy_context) и
+задач event loop. Таймаут каждого запроса к API не больше остатка бюджета,
+ожидание токена лимита и повторы тоже укладываются в остаток; если бюджета
+не осталось, запрос к API не выполняется, а таймаут, который наступил из-за
+сокращенного сроком таймаута, становится DeadlineExceeded - обработчики
+отвечают 504. Такие исходы не считаются отказами API в circuit breaker:
+короткий срок одного клиента не должен размыкать breaker для всех.
+
+Время запросов к API по хостам и ожидания лимита копится в Deadline и
+отдается клиенту заголовком Server-Timing. Фоновые задачи (обновление кеша,
+опросы) срока запроса не наследуют.
+"""
+import os
+import threading
+import time
+from contextvars import ContextVar, copy_context
+
+
+# Меньше этого остатка запрос к API не начинается - он все равно не успеет
+MIN_UPSTREAM_TIMEOUT = float(os.environ.get('DEADLINE_MIN_TIMEOUT', 0.05))
+
+deadline_var = ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени запроса исчерпан: запрос к внешнему API не выполнялся или прерван"""
+
+    # Статус источника в ответах API (/full, _metadata)
+    status = 'deadline_exceeded'
+
+    def __init__(self, name, budget):
+        super().__init__(f'{name}: истек бюджет времени запроса ({budget:g} с)')
+        self.name = name
+        self.budget = budget
+
+
+class Deadline:
+    def __init__(self, budget, clock=time.monotonic, stages=None, expires_at=None):
+        self.budget = budget
+        self.clock = clock
+        self.started = clock()
+        self.expires_at = self.started + budget if expires_at is None else expires_at
+        # {этап: [секунд, вызовов]}; у вложенного срока - общий с родителем
+        self.stages = {} if stages is None else stages
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return max(self.expires_at - self.clock(), 0.0)
+
+    def narrow(self, budget):
+        """Вложенный срок не дальше budget секунд (этап запроса); время этапов общее"""
+        expires_at = min(self.expires_at, self.clock() + budget)
+        child = Deadline(budget, self.clock, self.stages, expires_at)
+        child._lock = self._lock
+        return child
+
+    def timeout(self, name, timeout=None):
+        """Таймаут запроса к API name в пределах остатка; DeadlineExceeded, если остаток мал"""
+        remaining = self.expires_at - self.clock()
+        if remaining < MIN_UPSTREAM_TIMEOUT:
+            raise DeadlineExceeded(name, self.budget)
+        if timeout is None:
+            return remaining
+        if isinstance(timeout, tuple):
+            return tuple(remaining if part is None else min(part, remaining) for part in timeout)
+        return min(timeout, remaining)
+
+    @property
+    def expired(self):
+        return self.expires_at - self.clock() < MIN_UPSTREAM_TIMEOUT
+
+    def allows(self, delay):
+        """Успеет ли еще одна попытка после паузы delay"""
+        return self.expires_at - self.clock() >= delay + MIN_UPSTREAM_TIMEOUT
+
+    def record(self, stage, duration):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += duration
+            entry[1] += 1
+
+    def server_timing(self, total=None):
+        """Значение заголовка Server-Timing: этапы, общее время и бюджет (мс)"""
+        with self._lock:
+            stages = sorted(self.stages.items())
+        parts = [f'{stage};dur={duration * 1000:.1f};desc="{calls}"' for stage, (duration, calls) in stages]
+        if total is not None:
+            parts.append(f'total;dur={total * 1000:.1f}')
+        parts.append(f'budget;dur={self.budget * 1000:.0f}')
+        return ', '.join(parts)
+
+
+def budget_timeout(name, timeout=None):
+    """Таймаут запроса к API с учетом срока текущего запроса (без срока - как есть)"""
+    deadline = deadline_var.get()
+    return timeout if deadline is None else deadline.timeout(name, timeout)
+
+
+def remaining():
+    """Остаток бюджета текущего запроса в секундах; None - срока нет"""
+    deadline = deadline_var.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def exceeded(name):
+    """DeadlineExceeded для текущего срока (ожидание чужой загрузки и т.п.)"""
+    deadline = deadline_var.get()
+    return DeadlineExceeded(name, deadline.budget if deadline is not None else 0)
+
+
+def expired():
+    """Срок текущего запроса истек (без срока - никогда)"""
+    deadline = deadline_var.get()
+    return deadline is not None and deadline.expired
+
+
+def allows(delay):
+    deadline = deadline_var.get()
+    return deadline is None or deadline.allows(delay)
+
+
+def record_stage(stage, duration):
+    deadline = deadline_var.get()
+    if deadline is not None:
+        deadline.record(stage, duration)
+
+
+def narrowed(budget):
+    """Срок текущего запроса, суженный до budget секунд (для этапа или источника)"""
+    deadline = deadline_var.get()
+    return deadline.narrow(budget) if deadline is not None else Deadline(budget)
+
+
+def narrowed_context(budget):
+    """Копия контекста с narrowed(budget) - для executor.submit(context.run, ...)"""
+    context = copy_context()
+    context.run(deadline_var.set, narrowed(budget))
+    return context
+
+
+class DeadlineObserver:
+    """Наблюдатель UpstreamClient: время запросов к API в этапы срока текущего запроса"""
+
+    def upstream_started(self, name):
+        pass
+
+    def upstream_finished(self, name, duration, response=None, error=None):
+        record_stage(name, duration)
@@ -0,0 +1,73 @@
+"""
+Настройки gunicorn для продакшена: gunicorn -c gunicorn.conf.py app:app
+(или python app.py).
+
+Несколько процессов-воркеров с потоками (gthread): обработчики в основном
+ждут внешние API, потоки дешевле процессов. Приложение загружается в мастере
+до fork (preload) - воркеры стартуют быстрее и делят память с мастером.
+
+Перезапуск без простоя: kill -HUP <мастер> - новые воркеры стартуют, старые
+дорабатывают начатые запросы (до GUNICORN_GRACEFUL_TIMEOUT с). С preload код
+приложения при HUP не перечитывается - для нового кода нужен USR2 (новый мастер)
+или GUNICORN_PRELOAD=0.
+
+Переменные окружения:
+    PORT                      порт (5000)
+    WEB_CONCURRENCY           число воркеров (2 * CPU + 1, не больше 8)
+    GUNICORN_THREADS          потоков на воркер (8)
+    GUNICORN_TIMEOUT          сколько воркер может не отвечать мастеру, с (60)
+    GUNICORN_GRACEFUL_TIMEOUT сколько ждать начатые запросы при остановке, с (30)
+    GUNICORN_KEEPALIVE        keep-alive соединений с клиентами, с (5)
+    GUNICORN_MAX_REQUESTS     перезапуск воркера после N запросов (0 - никогда)
+    GUNICORN_PRELOAD          загружать приложение до fork (1)
+    METRICS_DIR               каталог снимков метрик воркеров (временный)
+
+Метрики (/metrics) считаются в каждом воркере отдельно, а запрос Prometheus
+попадает в случайный воркер. Поэтому воркеры раз в METRICS_FLUSH_INTERVAL с
+пишут снимки в общий METRICS_DIR, и /metrics любого воркера отдает метрики
+всех с меткой worker (сумма по сервису - sum without (worker)). Снимок другого
+воркера отстает до METRICS_FLUSH_INTERVAL с; после перезапуска воркера его
+счетчики начинаются с нуля под новой меткой - rate()/increase() это учитывают.
+Каталог - на машину: воркеры разных машин (реплик) сводит уже Prometheus.
+"""
+import multiprocessing
+import os
+import tempfile
+
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Таймауты запросов к WB/локальному API (10 с + повторы) должны укладываться в timeout
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Новый каталог на каждый запуск мастера - в нем нет снимков прошлых воркеров;
+# задается до загрузки приложения (app.py читает его при импорте)
+os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='telegram-app-metrics-'))
+
+# Логи приложения - JSON lines в stdout (log.py); access-лог пишет само приложение
+accesslog = None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    import app
+    app.reset_after_fork()
+
+
+def worker_exit(server, worker):
+    # Вызывается после того, как воркер перестал принимать запросы и дождался начатых
+    import app
+    app.shutdown()
@@ -0,0 +1,136 @@
+"""
+Фоновая проверка доступности внешних API.
+
+Поток периодически вызывает зарегистрированные проверки и хранит скользящее
+окно результатов (успех, задержка). Эндпоинты здоровья отвечают мгновенно по
+этому снимку, не нагружая внешние API на каждый запрос балансировщика.
+Поток запускается лениво при первом обращении и заново после fork
+(у воркеров gunicorn свой поток).
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextvars import copy_context
+from datetime import datetime
+
+from deadline import deadline_var
+from log import get_logger
+
+
+log = get_logger(__name__)
+
+
+class _Probe:
+    __slots__ = ('checked_at', 'ok', 'latency', 'details', 'error', 'error_type')
+
+    def __init__(self, checked_at, ok, latency, details, error=None, error_type=None):
+        self.checked_at = checked_at
+        self.ok = ok
+        self.latency = latency
+        self.details = details
+        self.error = error
+        self.error_type = error_type
+
+
+class HealthProber:
+    def __init__(self, interval=15.0, window=20):
+        self.interval = interval
+        self.window = window
+        self.checks = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._probe_locks = {}
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def register(self, name, check):
+        """
+        check() -> (ok, details): ok - доступен ли API, details - dict для ответа.
+        Исключение проверки считается недоступностью.
+        """
+        self.checks[name] = check
+        self._results[name] = deque(maxlen=self.window)
+        self._probe_locks[name] = threading.Lock()
+
+    def probe(self, name):
+        """Немедленная проверка одного API; одновременные вызовы ждут одну проверку"""
+        lock = self._probe_locks[name]
+        if not lock.acquire(blocking=False):
+            # Проверка уже идет - дождемся ее результата
+            with lock:
+                return self.snapshot(name)
+        try:
+            started = time.monotonic()
+            # Снимок общий для всех: ?probe=now идет без срока вызвавшего клиента
+            context = copy_context()
+            context.run(deadline_var.set, None)
+            try:
+                ok, details = context.run(self.checks[name])
+                result = _Probe(time.time(), bool(ok), time.monotonic() - started, details)
+            except Exception as e:
+                result = _Probe(time.time(), False, time.monotonic() - started, {}, str(e), type(e).__name__)
+            with self._lock:
+                self._results[name].append(result)
+        finally:
+            lock.release()
+        return self.snapshot(name)
+
+    def probe_all(self):
+        return {name: self.probe(name) for name in self.checks}
+
+    def ensure_started(self):
+        """Запускает фоновый поток, если его нет в этом процессе"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for name in self.checks:
+                if self._stop.is_set():
+                    return
+                try:
+                    self.probe(name)
+                except Exception as e:
+                    log.warning('health.probe_error', 'Ошибка фоновой проверки', upstream=name, error=str(e))
+            self._stop.wait(self.interval)
+
+    def snapshot(self, name):
+        with self._lock:
+            results = list(self._results[name])
+
+        if not results:
+            return {'status': 'unknown', 'samples': 0}
+
+        last = results[-1]
+        latencies = sorted(result.latency for result in results)
+        snapshot = {
+            'status': 'available' if last.ok else 'unavailable',
+            'checked_at': datetime.fromtimestamp(last.checked_at).isoformat(),
+            'age_s': round(time.time() - last.checked_at, 1),
+            'latency_ms': round(last.latency * 1000, 1),
+            'latency_ms_avg': round(sum(latencies) / len(latencies) * 1000, 1),
+            'latency_ms_p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+            'success_rate': round(sum(1 for result in results if result.ok) / len(results), 3),
+            'samples': len(results),
+            'details': last.details,
+        }
+        if last.error:
+            snapshot['error'] = last.error
+            snapshot['error_type'] = last.error_type
+        return snapshot
+
+    def snapshots(self):
+        return {name: self.snapshot(name) for name in self.checks}
@@ -0,0 +1,271 @@
+"""
+Фотографии товаров WB через дисковый кеш.
+
+Адрес фото вычисляется из nmId без запросов к WB: корзина (basket-NN)
+определяется по vol = nmId // 100000 из таблицы границ, путь -
+/vol{vol}/part{nmId // 1000}/{nmId}/images/{размер}/{номер}.webp.
+
+Файлы лежат в каталоге кеша по шардам (два уровня по первым байтам хеша
+ключа), общем для всех воркеров. Размер ограничен: при превышении удаляются
+давно не читавшиеся файлы (mtime обновляется при каждом чтении, поэтому
+порядок LRU общий для процессов и переживает перезапуск). Миниатюры
+заданной ширины уменьшаются локально (Pillow) и кешируются рядом с
+оригиналом; без Pillow отдается ближайший готовый размер WB.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow необязателен - миниатюры берутся у WB
+    Image = None
+
+from log import get_logger
+
+
+log = get_logger(__name__)
+
+
+# Верхние границы vol для basket-01, basket-02, ...; больше последней -
+# следующая корзина. WB добавляет корзины по мере роста nmId - новые границы
+# можно задать без релиза (WB_BASKET_BOUNDS)
+BASKET_BOUNDS = (
+    143, 287, 431, 719, 1007, 1061, 1115, 1169, 1313, 1601, 1655, 1919, 2045,
+    2189, 2405, 2621, 2837, 3053, 3269, 3485, 3701, 3917, 4133, 4349, 4565,
+)
+
+# Готовые размеры WB по возрастанию ширины
+WB_SIZES = (('tm', 96), ('c246x328', 246), ('c516x688', 516), ('big', None))
+
+
+def basket_number(nm_id, bounds=BASKET_BOUNDS):
+    vol = nm_id // 100000
+    for number, bound in enumerate(bounds, 1):
+        if vol <= bound:
+            return number
+    return len(bounds) + 1
+
+
+def image_url(nm_id, index, size='big', bounds=BASKET_BOUNDS):
+    """Полный адрес фото index (с 1) товара nm_id"""
+    return (
+        f'https://basket-{basket_number(nm_id, bounds):02d}.wbbasket.ru'
+        f'/vol{nm_id // 100000}/part{nm_id // 1000}/{nm_id}/images/{size}/{index}.webp'
+    )
+
+
+def wb_size_for_width(width):
+    """Наименьший готовый размер WB не уже width"""
+    for name, size_width in WB_SIZES:
+        if size_width is None or size_width >= width:
+            return name
+    return 'big'
+
+
+def content_type(path):
+    """MIME-тип по сигнатуре файла"""
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    return 'application/octet-stream'
+
+
+def resize(source, target, width, quality=80):
+    """Уменьшенная до width копия source в target (webp); меньшие не увеличиваются"""
+    with Image.open(source) as image:
+        if image.width > width:
+            image.thumbnail((width, round(image.height * width / image.width)))
+        image.save(target, 'WEBP', quality=quality)
+
+
+class DiskLRUCache:
+    def __init__(self, root, max_bytes, rescan_interval=300.0):
+        """
+        root - каталог кеша; max_bytes - предел размера файлов. Другие процессы
+        пишут в тот же каталог - их файлы учитываются при пересканировании
+        раз в rescan_interval секунд
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._scanned_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def path(self, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def _scan(self):
+        """Индекс файлов каталога по времени последнего чтения"""
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, os.path.join(dirpath, filename), stat.st_size))
+        found.sort()
+        with self._lock:
+            self._entries = OrderedDict((path, size) for _, path, size in found)
+            self._bytes = sum(size for _, _, size in found)
+            self._scanned_at = time.monotonic()
+
+    def get(self, key):
+        """Путь к файлу ключа или None; чтение продлевает жизнь файла"""
+        path = self.lookup(key)
+        if path is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return path
+
+    def lookup(self, key):
+        """get без учета в статистике (повторная проверка после ожидания загрузки)"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                size = self._entries.pop(path, None)
+                if size is not None:
+                    self._bytes -= size
+            return None
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        return path
+
+    def put(self, key, write):
+        """write(tmp_path) создает файл; он атомарно становится записью ключа. Возвращает путь"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            write(tmp)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            self._bytes += size - (previous or 0)
+            self._entries[path] = size
+        if time.monotonic() - self._scanned_at > self.rescan_interval:
+            self._scan()
+        self._evict()
+        return path
+
+    def put_bytes(self, key, data):
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                f.write(data)
+        return self.put(key, write)
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self._bytes <= self.max_bytes or len(self._entries) <= 1:
+                    return
+                path, size = self._entries.popitem(last=False)
+                self._bytes -= size
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class ImageNotFound(Exception):
+    """У WB нет фото с таким номером"""
+
+
+class ImageProxy:
+    def __init__(self, upstream, cache, flights, upstream_name='wb_images', bounds=BASKET_BOUNDS,
+                 thumb_widths=(128, 256, 512)):
+        self.upstream = upstream
+        self.cache = cache
+        self.flights = flights
+        self.upstream_name = upstream_name
+        self.bounds = bounds
+        self.thumb_widths = sorted(thumb_widths)
+
+    def thumb_width(self, width):
+        """
+        Ширина из разрешенного набора (наименьшая не уже запрошенной) - ограничивает
+        число вариантов; None - шире всех миниатюр, нужен оригинал
+        """
+        for allowed in self.thumb_widths:
+            if allowed >= width:
+                return allowed
+        return None
+
+    def _download(self, nm_id, index, size):
+        key = f'{nm_id}/{index}/{size}'
+        path = self.cache.get(key)
+        if path:
+            return path
+
+        def load():
+            response = self.upstream.get(self.upstream_name, image_url(nm_id, index, size, self.bounds))
+            if response.status_code == 404:
+                raise ImageNotFound(f'Фото {index} товара {nm_id} не найдено')
+            response.raise_for_status()
+            return self.cache.put_bytes(key, response.content)
+
+        # Одновременные запросы одного фото ждут одну загрузку
+        return self.flights.do(('image', key), lambda: self.cache.lookup(key) or load())
+
+    def image(self, nm_id, index, width=None):
+        """Путь к файлу фото в кеше: оригинал или миниатюра ширины width"""
+        if not width:
+            return self._download(nm_id, index, 'big')
+        if Image is None:
+            return self._download(nm_id, index, wb_size_for_width(width))
+
+        width = self.thumb_width(width)
+        if width is None:
+            return self._download(nm_id, index, 'big')
+        key = f'{nm_id}/{index}/w{width}'
+        path = self.cache.get(key)
+        if path:
+            return path
+        original = self._download(nm_id, index, 'big')
+        try:
+            return self.flights.do(
+                ('image', key),
+                lambda: self.cache.lookup(key) or self.cache.put(key, lambda tmp: resize(original, tmp, width))
+            )
+        except OSError as e:
+            # Формат, который Pillow не читает, - отдаем оригинал
+            log.warning('image.resize_error', 'Не удалось уменьшить фото', nm_id=nm_id, index=index, error=str(e))
+            return original
@@ -0,0 +1,89 @@
+"""
+Метрики бэкенда для /metrics: запросы к API (по маршрутам), запросы к внешним
+API (по хостам) и счетчики кешей, пулов и circuit breaker.
+"""
+from metrics import SIZE_BUCKETS, Registry
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    'http_requests_total', 'Обработанные запросы к API', ('route', 'method', 'status')
+)
+HTTP_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Время обработки запроса к API', ('route', 'method')
+)
+HTTP_IN_FLIGHT = registry.gauge(
+    'http_requests_in_flight', 'Запросы к API в обработке'
+)
+HTTP_RESPONSE_SIZE = registry.histogram(
+    'http_response_size_bytes', 'Размер тела ответа API', ('route',), SIZE_BUCKETS
+)
+
+UPSTREAM_REQUESTS = registry.counter(
+    'upstream_requests_total', 'Запросы к внешним API по исходу (HTTP-статус или тип ошибки)', ('upstream', 'outcome')
+)
+UPSTREAM_DURATION = registry.histogram(
+    'upstream_request_duration_seconds', 'Время запроса к внешнему API, включая повторы', ('upstream',)
+)
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    'upstream_requests_in_flight', 'Запросы к внешним API в процессе', ('upstream',)
+)
+UPSTREAM_RESPONSE_SIZE = registry.histogram(
+    'upstream_response_size_bytes', 'Размер ответа внешнего API (Content-Length)', ('upstream',), SIZE_BUCKETS
+)
+
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def request_started():
+    HTTP_IN_FLIGHT.inc()
+
+
+def request_finished(route, method, status, duration, size=None):
+    HTTP_IN_FLIGHT.dec()
+    HTTP_REQUESTS.labels(route, method, status).inc()
+    HTTP_DURATION.labels(route, method).observe(duration)
+    if size is not None:
+        HTTP_RESPONSE_SIZE.labels(route).observe(size)
+
+
+class UpstreamMetrics:
+    """Наблюдатель UpstreamClient: время, исход и размер каждого запроса к внешнему API"""
+
+    def upstream_started(self, name):
+        UPSTREAM_IN_FLIGHT.labels(name).inc()
+
+    def upstream_finished(self, name, duration, response=None, error=None):
+        UPSTREAM_IN_FLIGHT.labels(name).dec()
+        UPSTREAM_DURATION.labels(name).observe(duration)
+        if response is not None:
+            outcome = str(response.status_code)
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit():
+                UPSTREAM_RESPONSE_SIZE.labels(name).observe(int(length))
+        else:
+            outcome = type(error).__name__ if error is not None else 'cancelled'
+        UPSTREAM_REQUESTS.labels(name, outcome).inc()
+
+
+def stats_collector(prefix, stats, counters=(), gauges=(), label=None):
+    """
+    Коллектор для метода stats(): counters - накопительные поля (имя_total),
+    gauges - текущие значения. Если label задан, stats() возвращает
+    {значение метки: поля}, например по хостам внешних API.
+    """
+    def collect():
+        snapshot = stats()
+        rows = snapshot.items() if label else [(None, snapshot)]
+        families = []
+        for fields, metric_type, suffix in ((counters, 'counter', '_total'), (gauges, 'gauge', '')):
+            for field in fields:
+                samples = [
+                    ({label: key} if label else {}, row[field])
+                    for key, row in rows if isinstance(row.get(field), (int, float))
+                ]
+                families.append((f'{prefix}_{field}{suffix}', metric_type, f'{prefix}: {field}', samples))
+        return families
+
+    return registry.add_collector(collect)
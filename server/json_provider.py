@@ -0,0 +1,54 @@
+"""
+Быстрая сериализация JSON для ответов API.
+
+FastJSONProvider кодирует ответы через orjson, если он установлен, иначе -
+стандартным json. В обоих случаях вывод компактный, в UTF-8 без \\uXXXX-экранирования
+(кириллица занимает 2 байта вместо 6), ключи отсортированы, как у jsonify
+по умолчанию. Даты orjson передает в default провайдера Flask - формат тот же,
+что у jsonify. Значения, которые orjson не умеет кодировать (например, целые
+больше 64 бит), кодируются стандартным json.
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    ensure_ascii = False
+
+    def __init__(self, app, backend='auto'):
+        super().__init__(app)
+        if backend == 'orjson' and orjson is None:
+            raise RuntimeError('JSON_PROVIDER=orjson, но пакет orjson не установлен')
+        self.use_orjson = orjson is not None and backend != 'json'
+
+    @property
+    def backend(self):
+        return 'orjson' if self.use_orjson else 'json'
+
+    def encode(self, obj):
+        """Компактный JSON в байтах (UTF-8) с переводом строки в конце, как у jsonify"""
+        if self.use_orjson:
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE | orjson.OPT_PASSTHROUGH_DATETIME
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            try:
+                return orjson.dumps(obj, default=self.default, option=option)
+            except TypeError:
+                pass
+        return (self.dumps(obj, separators=(',', ':')) + '\n').encode()
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            # orjson.JSONDecodeError - подкласс json.JSONDecodeError (ValueError)
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(obj)
+        return self._app.response_class(self.encode(obj), mimetype=self.mimetype)
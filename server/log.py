@@ -0,0 +1,230 @@
+"""
+Структурированные логи в формате JSON lines.
+
+Записи кладутся в очередь (QueueHandler) и пишутся в stdout отдельным потоком
+(QueueListener), поэтому обработчик запроса не ждет вывода. Каждая запись -
+одна строка JSON с событием (event), уровнем, request_id и маршрутом текущего
+запроса и дополнительными полями.
+
+Частые события прореживаются (LOG_SAMPLE="wb.product.ok=0.01,request=0.1",
+по умолчанию - DEFAULT_SAMPLE), предупреждения и ошибки не прореживаются
+никогда. Для отдельных маршрутов можно задать минимальный уровень
+(LOG_ROUTE_LEVELS="/api/health=WARNING").
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+
+request_id_var = ContextVar('request_id', default=None)
+route_var = ContextVar('route', default=None)
+
+# Обработанные запросы и успешные загрузки товаров - самые частые события; в лог
+# попадает каждое десятое (ответы 5xx пишутся предупреждением - все)
+DEFAULT_SAMPLE = 'request=0.1,wb.product.ok=0.1,product.ok=0.1,local.ok=0.1,local.response=0.1'
+
+# Библиотеки, которые пишут INFO на каждый запрос к внешнему API
+QUIET_LOGGERS = ('httpx', 'httpcore')
+
+_STANDARD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+def parse_mapping(value, convert):
+    """'a=1,b=2' -> {'a': convert('1'), 'b': convert('2')}"""
+    result = {}
+    for part in (value or '').split(','):
+        if '=' in part:
+            key, raw = part.rsplit('=', 1)
+            result[key.strip()] = convert(raw.strip())
+    return result
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога - одна строка JSON"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': getattr(record, 'event', None),
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        route = getattr(record, 'route', None)
+        if route:
+            entry['route'] = route
+        entry.update(getattr(record, 'fields', None) or {})
+        # Поля, переданные через extra= напрямую
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key not in entry and key not in ('fields', 'request_id', 'route'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Добавляет request_id и маршрут текущего запроса, применяет уровни по
+    маршрутам и прореживание событий. Работает в потоке, создавшем запись.
+    """
+
+    def __init__(self, sample_rates=None, route_levels=None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self.route_levels = route_levels or {}
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.route = route_var.get()
+
+        min_level = self.route_levels.get(record.route)
+        if min_level is not None and record.levelno < min_level:
+            return False
+
+        if record.levelno < logging.WARNING:
+            rate = self.sample_rates.get(getattr(record, 'event', None))
+            if rate is not None and random.random() >= rate:
+                return False
+            if rate is not None:
+                record.sample_rate = rate
+        return True
+
+
+class EventLogger:
+    """
+    Логгер событий: log.info('wb.product.ok', 'Получен товар', nm_id=1).
+    event - короткое имя события для фильтрации и прореживания.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def log(self, level, event, msg, exc_info=None, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, exc_info=exc_info, extra={'event': event, 'fields': fields}, stacklevel=3)
+
+    def debug(self, event, msg, **fields):
+        self.log(logging.DEBUG, event, msg, **fields)
+
+    def info(self, event, msg, **fields):
+        self.log(logging.INFO, event, msg, **fields)
+
+    def warning(self, event, msg, **fields):
+        self.log(logging.WARNING, event, msg, **fields)
+
+    def error(self, event, msg, **fields):
+        self.log(logging.ERROR, event, msg, **fields)
+
+    def exception(self, event, msg, **fields):
+        self.log(logging.ERROR, event, msg, exc_info=True, **fields)
+
+
+def request_level(status):
+    """Уровень события request: ответы 5xx - предупреждение, их прореживание не касается"""
+    return logging.WARNING if status >= 500 else logging.INFO
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который не блокируется и не шумит при переполненной очереди
+    и оставляет запись неотформатированной - ее форматирует JsonFormatter
+    """
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _QueueHandler.dropped += 1
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+
+
+def _start_listener(handler_queue, handler):
+    global _listener
+    _listener = logging.handlers.QueueListener(handler_queue, handler, respect_handler_level=False)
+    _listener.start()
+
+
+def setup_logging(level=None, sample_rates=None, route_levels=None, queue_size=10000, stream=None):
+    """
+    Настраивает корневой логгер: запись в очередь и фоновый вывод в stdout.
+    Без аргументов берет настройки из LOG_LEVEL, LOG_SAMPLE, LOG_ROUTE_LEVELS.
+    Повторный вызов ничего не делает.
+    """
+    root = logging.getLogger()
+    if any(isinstance(handler, logging.handlers.QueueHandler) for handler in root.handlers):
+        return
+
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    if sample_rates is None:
+        sample_rates = parse_mapping(os.environ.get('LOG_SAMPLE', DEFAULT_SAMPLE), float)
+    if route_levels is None:
+        route_levels = parse_mapping(os.environ.get('LOG_ROUTE_LEVELS'), logging.getLevelName)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    # Переполненная очередь не должна блокировать запросы - лишние записи теряются
+    handler_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = _QueueHandler(handler_queue)
+    queue_handler.addFilter(ContextFilter(sample_rates, route_levels))
+
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    _start_listener(handler_queue, output)
+    atexit.register(shutdown_logging)
+
+    # Поток вывода не переживает fork (воркеры gunicorn с --preload)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: _start_listener(handler_queue, output))
+
+
+def shutdown_logging():
+    """Дописывает оставшиеся в очереди записи"""
+    if _listener is not None and _listener._thread is not None:
+        try:
+            _listener.stop()
+        except queue.Full:
+            pass
+
+
+def dropped_records():
+    """Сколько записей потеряно из-за переполненной очереди"""
+    return _QueueHandler.dropped
+
+
+def get_logger(name):
+    return EventLogger(logging.getLogger(name))
+
+
+def new_request_id():
+    return f'{int(time.time() * 1000):x}-{random.getrandbits(32):08x}'
@@ -0,0 +1,311 @@
+"""
+Метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей.
+
+Counter, Gauge и Histogram с метками; запись - одна блокировка и пара
+арифметических операций. Registry.render() отдает текст для /metrics.
+Коллекторы (Registry.add_collector) вызываются только при чтении метрик -
+через них выдаются счетчики, которые уже есть у кешей, пулов и т.п.
+
+Метрики считаются в каждом процессе отдельно: при нескольких воркерах
+gunicorn опрос /metrics попадает в случайный из них. SharedMetrics сводит
+процессы: каждый раз в interval секунд пишет свой снимок с меткой worker в
+общий каталог, а /metrics любого воркера отдает снимки всех живых воркеров
+(свой - на момент опроса); сумма по сервису - sum without (worker) (...).
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ('_lock', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames) if labels else tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            items = list(self._children.items())
+        return [(dict(zip(self.labelnames, key)), child) for key, child in items]
+
+    def samples(self):
+        """[(суффикс имени, метки, значение)]"""
+        return [('', labels, child.value) for labels, child in self._items()]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def samples(self):
+        result = []
+        for labels, child in self._items():
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                result.append(('_bucket', {**labels, 'le': _format_value(float(bound))}, cumulative))
+            result.append(('_sum', labels, total))
+            result.append(('_count', labels, count))
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """
+        collector() -> [(имя, тип, описание, [(метки, значение)])] - значения,
+        которые вычисляются в момент опроса
+        """
+        self._collectors.append(collector)
+        return collector
+
+    def collect(self):
+        """[(имя, тип, описание, [(суффикс, метки, значение)])] - все метрики процесса"""
+        families = [
+            (metric.name, metric.type, metric.documentation, metric.samples())
+            for metric in self._metrics
+        ]
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                families.append((name, metric_type, documentation, [('', labels, value) for labels, value in samples]))
+        return families
+
+    def render(self):
+        return render_families(self.collect())
+
+
+def render_families(families):
+    """Текст для /metrics; семейства с одним именем объединяются (несколько процессов)"""
+    merged = {}
+    for name, metric_type, documentation, samples in families:
+        family = merged.setdefault(name, (metric_type, documentation, []))
+        family[2].extend(samples)
+    lines = []
+    for name, (metric_type, documentation, samples) in merged.items():
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for suffix, labels, value in samples:
+            lines.append(f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class SharedMetrics:
+    """
+    Метрики всех воркеров машины через каталог directory: снимок процесса -
+    файл <pid>.json, обновляется раз в interval секунд и при каждом опросе.
+    Снимки старше stale_after (воркер убит без worker_exit) не отдаются.
+    """
+
+    def __init__(self, registry, directory, interval=5.0, stale_after=None):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.stale_after = stale_after or interval * 3
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+        self.write_errors = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def ensure_started(self):
+        """Запускает запись снимков, если ее нет в этом процессе"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._stop = threading.Event()
+            threading.Thread(target=self._run, name='metrics', daemon=True).start()
+
+    def stop(self):
+        """Останавливает запись и убирает снимок процесса - его метрики больше не отдаются"""
+        self._stop.set()
+        if self._pid == os.getpid():
+            try:
+                os.remove(self._path(self._pid))
+            except OSError:
+                pass
+
+    def _run(self):
+        while True:
+            self.write()
+            if self._stop.wait(self.interval):
+                return
+
+    def write(self):
+        """Снимок метрик процесса с меткой worker (запись через временный файл)"""
+        pid = os.getpid()
+        worker = {'worker': str(pid)}
+        families = [
+            (name, metric_type, documentation, [(suffix, {**labels, **worker}, value) for suffix, labels, value in samples])
+            for name, metric_type, documentation, samples in self.registry.collect()
+        ]
+        path = self._path(pid)
+        try:
+            with open(f'{path}.tmp', 'w') as file:
+                json.dump(families, file)
+            os.replace(f'{path}.tmp', path)
+        except OSError:
+            self.write_errors += 1
+        return families
+
+    def render(self):
+        """Метрики всех живых воркеров; свои - свежие"""
+        families = self.write()
+        own = f'{os.getpid()}.json'
+        now = time.time()
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith('.json') or filename == own:
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                if now - os.path.getmtime(path) > self.stale_after:
+                    continue
+                with open(path) as file:
+                    families.extend(json.load(file))
+            except (OSError, ValueError):
+                # Воркер как раз завершился или файл недописан - пропускаем
+                continue
+        return render_families(families)
@@ -0,0 +1,321 @@
+"""
+Сервис товаров Wildberries.
+
+Сырая карточка WB загружается и кешируется один раз на (nmId, dest) - регион
+доставки, от которого зависят цены и склады. Ответ каждого эндпоинта -
+проекция этой карточки, зарегистрированная под своим именем
+(ProductService.projection), поэтому разные эндпоинты с одним товаром и
+регионом делят одну загрузку и одну запись кеша.
+
+Загрузки одного товара объединяются (SingleFlight), устаревшая запись кеша
+отдается сразу и обновляется в фоне, при известном валидаторе WB запрос
+условный. AsyncProducts - то же для ASGI-режима на AsyncUpstreamClient.
+"""
+import asyncio
+import json
+from contextvars import copy_context
+
+import requests
+
+from breaker import CircuitOpenError
+from deadline import DeadlineExceeded
+from log import get_logger
+from ratelimit import RateLimited
+from upstream import is_timeout
+
+try:
+    import httpx
+except ImportError:  # Нужен только для ASGI-режима
+    httpx = None
+
+
+log = get_logger(__name__)
+
+_MISSING = object()
+
+
+class WBApiError(Exception):
+    """Некорректный ответ WB API; details попадают в JSON ответа клиенту"""
+
+    def __init__(self, message, status=502, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def wb_detail_url(nm_ids, dest):
+    """URL cards/v4/detail для списка nmId"""
+    nm = ';'.join(str(nm_id) for nm_id in nm_ids)
+    return f"/cards/v4/detail?appType=1&curr=rub&dest={dest}&spp=30&ab_testing=false&lang=ru&nm={nm}"
+
+
+def extract_wb_products(data):
+    """Список товаров из ответа WB API (поддерживает обе известные структуры)"""
+    if not data:
+        return []
+    if data.get('data', {}).get('products'):
+        return data['data']['products']
+    if 'products' in data:
+        return data['products'] or []
+    log.warning(
+        'wb.unknown_structure', 'Неизвестная структура данных от WB API',
+        preview=json.dumps(data, ensure_ascii=False)[:500]
+    )
+    raise WBApiError('Неизвестная структура данных от WB API', data_structure=list(data.keys()))
+
+
+def wb_cards_from_response(response, nm_ids):
+    """Разбор ответа cards/v4/detail (requests или httpx) в {nmId: карточка | None}"""
+    if response.status_code != 200:
+        raise WBApiError(
+            f'WB API вернул статус {response.status_code}',
+            status_code=response.status_code
+        )
+
+    try:
+        data = response.json()
+    except ValueError as e:
+        log.error('wb.bad_json', 'Ошибка парсинга JSON', error=str(e))
+        raise WBApiError('Неверный формат ответа от WB API', response_preview=response.text[:200])
+
+    found = {product.get('id'): product for product in extract_wb_products(data)}
+    return {nm_id: found.get(nm_id) for nm_id in nm_ids}
+
+
+def chunk_error(e):
+    """Ошибка загрузки пачки как WBApiError для ответа по каждому nmId"""
+    if isinstance(e, WBApiError):
+        return e
+    if isinstance(e, RateLimited):
+        return WBApiError(str(e), status=429, retry_after=e.retry_after)
+    if isinstance(e, CircuitOpenError):
+        return WBApiError(str(e), status=503, retry_after=e.retry_after)
+    if isinstance(e, DeadlineExceeded):
+        return WBApiError(str(e), status=504)
+    if is_timeout(e):
+        return WBApiError(f'Таймаут при запросе к WB API: {str(e)}', status=504)
+    return WBApiError(f'Ошибка сети: {str(e)}', status=503)
+
+
+class ProductService:
+    def __init__(self, upstream, cache, validators, flights, executor, default_dest,
+                 batch_size=100, allowed_dests=None, upstream_name='wb'):
+        self.upstream = upstream
+        self.cache = cache
+        self.validators = validators
+        self.flights = flights
+        self.executor = executor
+        self.default_dest = default_dest
+        self.batch_size = batch_size
+        self.allowed_dests = set(allowed_dests) if allowed_dests else None
+        self.upstream_name = upstream_name
+        self.projections = {}
+
+    # Проекции
+
+    def projection(self, name):
+        """Декоратор: @products.projection('wb') def project(card) -> dict"""
+        def register(fn):
+            self.projections[name] = fn
+            return fn
+        return register
+
+    def project(self, name, card):
+        """Проекция сырой карточки; None для ненайденного товара"""
+        return self.projections[name](card) if card else None
+
+    def resolve_dest(self, value=None):
+        """Регион из параметра запроса: пусто - по умолчанию, не число или не разрешен - None"""
+        if value is None or value == '':
+            return self.default_dest
+        try:
+            dest = int(value)
+        except (TypeError, ValueError):
+            return None
+        if self.allowed_dests is not None and dest not in self.allowed_dests:
+            return None
+        return dest
+
+    # Загрузка с WB
+
+    def conditional_headers(self, key):
+        """If-None-Match/If-Modified-Since для карточки, которая еще есть в кеше"""
+        validators = self.validators.get(key)
+        if not validators or self.cache.get(key, _MISSING, allow_stale=True) is _MISSING:
+            return None
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def card_from_conditional_response(self, response, key):
+        """Карточка из ответа на условный запрос: 304 - прежняя карточка из кеша"""
+        if response.status_code == 304:
+            cached = self.cache.get(key, _MISSING, allow_stale=True)
+            if cached is not _MISSING:
+                return cached
+            raise WBApiError('WB API вернул 304, а карточки нет в кеше', status_code=304)
+
+        nm_id = key[0]
+        card = wb_cards_from_response(response, [nm_id])[nm_id]
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        if any(validators.values()):
+            self.validators.set(key, validators)
+        else:
+            self.validators.pop(key)
+        return card
+
+    def load_card(self, nm_id, dest):
+        """
+        Загрузка сырой карточки товара с WB API; None если товар не найден.
+        Если WB отдавал валидатор для этой карточки, запрос условный.
+        """
+        key = (nm_id, dest)
+        response = self.upstream.get(
+            self.upstream_name, wb_detail_url([nm_id], dest), headers=self.conditional_headers(key)
+        )
+        return self.card_from_conditional_response(response, key)
+
+    def load_cards(self, nm_ids, dest):
+        """
+        Загрузка сырых карточек нескольких товаров одним запросом к WB API.
+        Возвращает {nmId: карточка или None если товар не найден}
+        """
+        response = self.upstream.get(self.upstream_name, wb_detail_url(nm_ids, dest))
+        return wb_cards_from_response(response, nm_ids)
+
+    def card_loader(self, nm_id, dest):
+        """Загрузчик карточки для кеша: одновременные загрузки одного товара объединяются"""
+        return lambda: self.flights.do(('wb', nm_id, dest), lambda: self.load_card(nm_id, dest))
+
+    # Чтение через кеш
+
+    def card(self, nm_id, dest=None):
+        """Сырая карточка через кеш; устаревшая запись отдается сразу и обновляется в фоне"""
+        dest = self.default_dest if dest is None else dest
+        return self.cache.get_or_load((nm_id, dest), self.card_loader(nm_id, dest))
+
+    def view(self, name, nm_id, dest=None):
+        """Проекция name карточки товара; None если товар не найден"""
+        return self.project(name, self.card(nm_id, dest))
+
+    def refresh(self, nm_id, dest=None):
+        """Карточка прямо с WB мимо свежести кеша (опрос для подписок); результат кладется в кеш"""
+        dest = self.default_dest if dest is None else dest
+        card = self.card_loader(nm_id, dest)()
+        self.cache.set((nm_id, dest), card)
+        return card
+
+    def refresh_cards(self, nm_ids, dest=None):
+        """
+        Пачка карточек прямо с WB одним запросом, мимо кеша: фоновый опрос
+        тысяч товаров не вытесняет из кеша карточки, которые смотрят пользователи
+        """
+        dest = self.default_dest if dest is None else dest
+        return self.load_cards(nm_ids, dest)
+
+    def split_cached(self, nm_ids, dest):
+        """(найденные в кеше {nmId: карточка}, пачки nmId для загрузки)"""
+        results = {}
+        missing = []
+        for nm_id in nm_ids:
+            card = self.cache.get((nm_id, dest), _MISSING)
+            if card is _MISSING:
+                missing.append(nm_id)
+            else:
+                results[nm_id] = card
+        size = self.batch_size
+        return results, [missing[i:i + size] for i in range(0, len(missing), size)]
+
+    def store_chunk(self, results, chunk, dest, loaded):
+        """Результат пачки в кеш и в ответ; при ошибке - устаревшие записи, где есть"""
+        if isinstance(loaded, WBApiError):
+            log.warning('wb.batch.error', 'Ошибка загрузки пачки товаров', size=len(chunk), error=str(loaded))
+            for nm_id in chunk:
+                stale = self.cache.get((nm_id, dest), _MISSING, allow_stale=True)
+                results[nm_id] = loaded if stale is _MISSING else stale
+            return
+        for nm_id, card in loaded.items():
+            self.cache.set((nm_id, dest), card)
+            results[nm_id] = card
+
+    def cards(self, nm_ids, dest=None):
+        """
+        Карточки нескольких товаров: свежие берутся из кеша, остальные загружаются
+        пачками по batch_size параллельно. Возвращает {nmId: карточка | None | WBApiError}.
+        При ошибке загрузки пачки отдается устаревшая запись кеша, если она есть.
+        """
+        dest = self.default_dest if dest is None else dest
+        results, chunks = self.split_cached(nm_ids, dest)
+        # copy_context - приоритет и request_id запроса действуют и в потоках пула
+        futures = [
+            (chunk, self.executor.submit(copy_context().run, self.load_cards, chunk, dest))
+            for chunk in chunks
+        ]
+        for chunk, future in futures:
+            try:
+                loaded = future.result()
+            except (WBApiError, CircuitOpenError, RateLimited, DeadlineExceeded, requests.exceptions.RequestException) as e:
+                loaded = chunk_error(e)
+            self.store_chunk(results, chunk, dest, loaded)
+        return results
+
+
+class AsyncProducts:
+    """Неблокирующая загрузка товаров для ASGI-режима: тот же кеш, проекции и правила"""
+
+    def __init__(self, service, aupstream, concurrency=4):
+        self.service = service
+        self.aupstream = aupstream
+        self.concurrency = concurrency
+
+    async def load_card(self, nm_id, dest):
+        """Одна карточка, с условным запросом при известном валидаторе WB"""
+        service = self.service
+        key = (nm_id, dest)
+        response = await self.aupstream.get(
+            service.upstream_name, wb_detail_url([nm_id], dest), headers=service.conditional_headers(key)
+        )
+        return service.card_from_conditional_response(response, key)
+
+    async def load_cards(self, nm_ids, dest):
+        response = await self.aupstream.get(self.service.upstream_name, wb_detail_url(nm_ids, dest))
+        return wb_cards_from_response(response, nm_ids)
+
+    async def card(self, nm_id, dest=None):
+        """Карточка через общий кеш; при промахе - неблокирующая загрузка"""
+        service = self.service
+        dest = service.default_dest if dest is None else dest
+        key = (nm_id, dest)
+        card = service.cache.get_or_refresh(key, service.card_loader(nm_id, dest), _MISSING)
+        if card is _MISSING:
+            card = await service.flights.ado(('wb', nm_id, dest), lambda: self.load_card(nm_id, dest))
+            service.cache.set(key, card)
+        return card
+
+    async def view(self, name, nm_id, dest=None):
+        return self.service.project(name, await self.card(nm_id, dest))
+
+    async def cards(self, nm_ids, dest=None):
+        """Асинхронный вариант ProductService.cards с теми же правилами кеша и ошибок"""
+        service = self.service
+        dest = service.default_dest if dest is None else dest
+        results, chunks = service.split_cached(nm_ids, dest)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def load_chunk(chunk):
+            async with semaphore:
+                try:
+                    return await self.load_cards(chunk, dest)
+                except (WBApiError, CircuitOpenError, RateLimited, DeadlineExceeded, httpx.HTTPError) as e:
+                    return chunk_error(e)
+
+        loaded_chunks = await asyncio.gather(*(load_chunk(chunk) for chunk in chunks))
+        for chunk, loaded in zip(chunks, loaded_chunks):
+            service.store_chunk(results, chunk, dest, loaded)
+        return results
@@ -0,0 +1,284 @@
+"""
+Ограничение частоты запросов к внешнему API (token bucket).
+
+Корзина пополняется со скоростью rate токенов в секунду до burst; каждый
+запрос забирает токен. Состояние корзины хранится в файле SQLite, общем для
+всех воркеров на машине, поэтому лимит действует на сервис целиком, а не на
+каждый процесс (без файла - в памяти процесса). Время в SQLite - обычное
+(time.time), монотонные часы разных процессов несравнимы.
+
+Если токена нет, запрос ждет его не дольше max_wait, а ждущих не больше
+max_waiting - остальные сразу получают RateLimited (обработчики отдают
+устаревшую запись кеша или 429 с Retry-After). Последние reserve токенов
+достаются только приоритетным запросам (администраторы): они не стоят в
+общей очереди и ждут до priority_max_wait. Ожидание не дольше остатка
+срока текущего запроса к сервису (deadline.py).
+
+Общая корзина в SQLite - блокирующий ввод-вывод с блокировкой файла, поэтому
+в асинхронном режиме (aacquire) она читается в потоке пула, а не в event loop.
+"""
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+
+import deadline as request_deadline
+from log import get_logger
+
+
+log = get_logger(__name__)
+
+# Приоритет текущего запроса; выставляется обработчиком запроса к API сервиса
+priority_var = ContextVar('upstream_priority', default=False)
+
+
+class RateLimited(Exception):
+    """
+    Лимит запросов к внешнему API исчерпан, запрос не выполнялся. API при этом
+    исправен (в отличие от CircuitOpenError): обработчики отвечают 429 с Retry-After.
+    """
+
+    # Статус источника в ответах API (/full, _metadata)
+    status = 'rate_limited'
+
+    def __init__(self, name, retry_after, reason):
+        super().__init__(f'{name}: превышен лимит запросов к внешнему API ({reason}), повторите через {retry_after} с')
+        self.name = name
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class MemoryBucketStore:
+    """Корзины в памяти процесса"""
+
+    path = None
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, name, rate, burst, floor):
+        """
+        Забирает токен, если после этого останется не меньше floor.
+        Возвращает (сколько ждать до следующей попытки или 0, токенов осталось)
+        """
+        with self._lock:
+            now = self.clock()
+            tokens, updated_at = self._buckets.get(name, (burst, now))
+            tokens, wait = _take(tokens, now - updated_at, rate, burst, floor)
+            self._buckets[name] = (tokens, now)
+            return wait, tokens
+
+    def peek(self, name, rate, burst):
+        with self._lock:
+            tokens, updated_at = self._buckets.get(name, (burst, self.clock()))
+            return _refill(tokens, self.clock() - updated_at, rate, burst)
+
+
+class SQLiteBucketStore:
+    """Корзины в файле SQLite, общем для воркеров"""
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS token_buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+
+    def _connect(self):
+        # Соединение на поток; после fork открываем заново
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, name, rate, burst, floor):
+        conn = self._connect()
+        # BEGIN IMMEDIATE - чтение и запись корзины одной транзакцией для всех процессов
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = self.clock()
+            row = conn.execute('SELECT tokens, updated_at FROM token_buckets WHERE name = ?', (name,)).fetchone()
+            tokens, updated_at = row if row else (burst, now)
+            tokens, wait = _take(tokens, now - updated_at, rate, burst, floor)
+            conn.execute(
+                'INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)',
+                (name, tokens, now)
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait, tokens
+
+    def peek(self, name, rate, burst):
+        now = self.clock()
+        row = self._connect().execute(
+            'SELECT tokens, updated_at FROM token_buckets WHERE name = ?', (name,)
+        ).fetchone()
+        return _refill(row[0], now - row[1], rate, burst) if row else burst
+
+
+def _refill(tokens, elapsed, rate, burst):
+    # Часы могли уйти назад - не отнимаем токены
+    return min(burst, tokens + max(elapsed, 0.0) * rate)
+
+
+def _take(tokens, elapsed, rate, burst, floor):
+    tokens = _refill(tokens, elapsed, rate, burst)
+    if tokens - 1 >= floor:
+        return tokens - 1, 0.0
+    return tokens, (floor + 1 - tokens) / rate
+
+
+class RateLimiter:
+    def __init__(self, name, rate, burst, max_wait=1.0, priority_max_wait=5.0,
+                 max_waiting=50, reserve=2, shared_path=None,
+                 clock=time.monotonic):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.priority_max_wait = priority_max_wait
+        self.max_waiting = max_waiting
+        self.reserve = min(reserve, burst - 1)
+        self.clock = clock
+        self.local_store = MemoryBucketStore()
+        self.store = SQLiteBucketStore(shared_path) if shared_path else self.local_store
+
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.acquired = 0
+        self.priority_acquired = 0
+        self.waited = 0
+        self.rejected = {'queue_full': 0, 'timeout': 0}
+        self.store_errors = 0
+
+    def _take(self, priority):
+        floor = 0 if priority else self.reserve
+        try:
+            return self.store.take(self.name, self.rate, self.burst, floor)[0]
+        except sqlite3.Error as e:
+            # Файл занят или недоступен - ограничиваем хотя бы этот процесс
+            with self._lock:
+                self.store_errors += 1
+            log.warning('ratelimit.store_error', 'Ошибка общего хранилища лимита', limiter=self.name, error=str(e))
+            return self.local_store.take(self.name, self.rate, self.burst, floor)[0]
+
+    async def _atake(self, priority):
+        # Корзина в памяти - без блокировок ввода-вывода, поток пула не нужен
+        if self.store is self.local_store:
+            return self._take(priority)
+        return await asyncio.to_thread(self._take, priority)
+
+    def _admit(self, priority, waited):
+        with self._lock:
+            self.acquired += 1
+            if priority:
+                self.priority_acquired += 1
+            if waited:
+                self.waited += 1
+
+    def _reject(self, reason, wait):
+        with self._lock:
+            self.rejected[reason] += 1
+        raise RateLimited(self.name, max(1, math.ceil(wait)), reason)
+
+    def _enter_queue(self, priority, wait):
+        """Место в очереди ожидания; приоритетные запросы не ограничены max_waiting"""
+        with self._lock:
+            if not priority and self.waiting >= self.max_waiting:
+                full = True
+            else:
+                full = False
+                self.waiting += 1
+        if full:
+            self._reject('queue_full', wait)
+
+    def _leave_queue(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def _max_wait(self, priority):
+        """Предел ожидания токена: настройка лимита, но не дольше остатка срока запроса"""
+        max_wait = self.priority_max_wait if priority else self.max_wait
+        remaining = request_deadline.remaining()
+        return max_wait if remaining is None else min(max_wait, remaining)
+
+    def _next_sleep(self, deadline, wait):
+        """Сколько спать перед следующей попыткой; RateLimited, если токен не успеет появиться"""
+        remaining = deadline - self.clock()
+        if wait > remaining:
+            self._reject('timeout', wait)
+        return wait
+
+    def acquire(self, priority=None):
+        """Забирает токен, при необходимости ждет; RateLimited - если не дождался"""
+        priority = priority_var.get() if priority is None else priority
+        wait = self._take(priority)
+        if not wait:
+            self._admit(priority, False)
+            return
+        deadline = self.clock() + self._max_wait(priority)
+        self._next_sleep(deadline, wait)
+        self._enter_queue(priority, wait)
+        try:
+            while wait:
+                time.sleep(self._next_sleep(deadline, wait))
+                wait = self._take(priority)
+        finally:
+            self._leave_queue()
+        self._admit(priority, True)
+
+    async def aacquire(self, priority=None):
+        """acquire для event loop: ни ожидание, ни общая корзина не блокируют loop"""
+        priority = priority_var.get() if priority is None else priority
+        wait = await self._atake(priority)
+        if not wait:
+            self._admit(priority, False)
+            return
+        deadline = self.clock() + self._max_wait(priority)
+        self._next_sleep(deadline, wait)
+        self._enter_queue(priority, wait)
+        try:
+            while wait:
+                await asyncio.sleep(self._next_sleep(deadline, wait))
+                wait = await self._atake(priority)
+        finally:
+            self._leave_queue()
+        self._admit(priority, True)
+
+    def snapshot(self):
+        try:
+            tokens = self.store.peek(self.name, self.rate, self.burst)
+        except sqlite3.Error:
+            tokens = None
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'reserve': self.reserve,
+                'tokens': round(tokens, 2) if tokens is not None else None,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'acquired': self.acquired,
+                'priority_acquired': self.priority_acquired,
+                'waited': self.waited,
+                'rejected': dict(self.rejected),
+                'store_errors': self.store_errors,
+                'shared_path': self.store.path,
+            }
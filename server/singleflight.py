@@ -0,0 +1,139 @@
+"""
+Объединение одновременных одинаковых запросов к внешним API (single-flight).
+
+Первый запрос по ключу выполняет загрузку, остальные ждут ее завершения и
+получают тот же результат или то же исключение. Число ожидающих на ключ
+ограничено - при превышении сразу выбрасывается SingleFlightOverflow.
+Для ASGI-режима есть асинхронный вариант ado() с теми же счетчиками: загрузка
+идет отдельной задачей, поэтому отмена ведущего запроса (клиент ушел, истек
+таймаут источника) не отменяет ее для ожидающих.
+
+Ожидающий ждет не дольше своего срока запроса (deadline.py). DeadlineExceeded
+ведущего - следствие его собственного срока, поэтому ожидающим не передается:
+они загружают заново в пределах своих сроков.
+"""
+import asyncio
+import functools
+import threading
+
+import deadline
+
+
+class SingleFlightOverflow(Exception):
+    """Слишком много запросов ждут одну и ту же загрузку"""
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+def _key_name(key):
+    return str(key[0]) if isinstance(key, tuple) else str(key)
+
+
+class SingleFlight:
+    def __init__(self, max_waiters=200):
+        self.max_waiters = max_waiters
+        self._calls = {}
+        self._async_calls = {}
+        self._async_waiters = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def do(self, key, fn):
+        """Выполняет fn() один раз на ключ среди одновременных вызовов"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+            elif call.waiters >= self.max_waiters:
+                self.rejected += 1
+                raise SingleFlightOverflow(f'Слишком много ожидающих запросов для {key}')
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if not call.event.wait(deadline.remaining()):
+                # Свой срок вышел раньше загрузки - она продолжается для остальных
+                with self._lock:
+                    call.waiters -= 1
+                raise deadline.exceeded(_key_name(key))
+            if isinstance(call.error, deadline.DeadlineExceeded):
+                return self.do(key, fn)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key, coro_fn):
+        """Асинхронный вариант do(): await coro_fn() один раз на ключ в event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._async_calls.get((loop, key))
+            if task is None:
+                task = self._async_calls[(loop, key)] = loop.create_task(coro_fn())
+                task.add_done_callback(functools.partial(self._async_done, loop, key))
+                self.executed += 1
+                leader = True
+            elif self._async_waiters.get((loop, key), 0) >= self.max_waiters:
+                self.rejected += 1
+                raise SingleFlightOverflow(f'Слишком много ожидающих запросов для {key}')
+            else:
+                self._async_waiters[(loop, key)] = self._async_waiters.get((loop, key), 0) + 1
+                self.coalesced += 1
+                leader = False
+
+        # shield: отмена или срок одного запроса не отменяют общую загрузку
+        if leader:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), deadline.remaining())
+        except asyncio.TimeoutError:
+            if task.done():
+                raise
+            with self._lock:
+                if (loop, key) in self._async_waiters:
+                    self._async_waiters[(loop, key)] -= 1
+            raise deadline.exceeded(_key_name(key))
+        except deadline.DeadlineExceeded:
+            return await self.ado(key, coro_fn)
+
+    def _async_done(self, loop, key, task):
+        # Колбэк добавлен первым, поэтому ключ освобождается раньше, чем проснутся
+        # ожидающие: повтор после DeadlineExceeded начинает новую загрузку
+        with self._lock:
+            del self._async_calls[(loop, key)]
+            self._async_waiters.pop((loop, key), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls) + len(self._async_calls),
+                'waiting': sum(call.waiters for call in self._calls.values()) + sum(self._async_waiters.values()),
+                'max_waiters': self.max_waiters,
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,208 @@
+"""
+Остатки и цены карточки WB по всем размерам и справочник складов.
+
+aggregate_sizes за один проход по размерам и их остаткам собирает суммы по
+складам и по размерам, минимальную и максимальную цену и диапазон сроков
+доставки - около микросекунды на пару размер x склад, карточка с сотнями
+пар разбирается за доли миллисекунды. Названия складов берутся из WarehouseIndex: справочник
+загружается при старте из файла последней успешной загрузки (если есть) и
+обновляется в фоне, поиск - словарь в памяти.
+"""
+import json
+import os
+import threading
+import time
+
+from log import get_logger
+
+
+log = get_logger(__name__)
+
+
+def aggregate_sizes(sizes, warehouses=None):
+    """
+    Сводка по размерам карточки cards/v4 (цены в копейках -> рубли):
+    warehouses - склады с суммой остатков по размерам и лучшим сроком доставки,
+    sizes - размеры с ценой и остатком, price - мин./макс. цены размеров,
+    delivery - диапазон сроков доставки (time1 + time2), quantity - всего
+    """
+    names = warehouses.names if warehouses is not None else {}
+    by_warehouse = {}
+    size_rows = []
+    cheapest = None
+    product_min = product_max = None
+    delivery_min = delivery_max = None
+    total = 0
+
+    for size in sizes or ():
+        price = size.get('price') or {}
+        basic = (price.get('basic') or 0) // 100
+        product = (price.get('product') or 0) // 100
+        size_quantity = 0
+        stocks = size.get('stocks') or ()
+        for stock in stocks:
+            warehouse_id = stock.get('wh')
+            quantity = stock.get('qty') or 0
+            time1 = stock.get('time1')
+            time2 = stock.get('time2')
+            size_quantity += quantity
+
+            entry = by_warehouse.get(warehouse_id)
+            if entry is None:
+                entry = by_warehouse[warehouse_id] = {
+                    'warehouse_id': warehouse_id,
+                    'name': names.get(warehouse_id),
+                    'quantity': 0,
+                    'sizes': 0,
+                    'time1': time1,
+                    'time2': time2,
+                }
+            entry['quantity'] += quantity
+            entry['sizes'] += 1
+            if time1 is not None and time2 is not None:
+                delivery = time1 + time2
+                if entry['time1'] is None or entry['time2'] is None or delivery < entry['time1'] + entry['time2']:
+                    entry['time1'] = time1
+                    entry['time2'] = time2
+                if delivery_min is None or delivery < delivery_min:
+                    delivery_min = delivery
+                if delivery_max is None or delivery > delivery_max:
+                    delivery_max = delivery
+
+        total += size_quantity
+        if product:
+            if product_min is None or product < product_min:
+                product_min = product
+                cheapest = (basic, product)
+            if product_max is None or product > product_max:
+                product_max = product
+        size_rows.append({
+            'name': size.get('name'),
+            'origName': size.get('origName'),
+            'basicPrice': basic,
+            'productPrice': product,
+            'quantity': size_quantity,
+            'warehouses': len(stocks),
+        })
+
+    return {
+        'warehouses': sorted(by_warehouse.values(), key=lambda entry: -entry['quantity']),
+        'sizes': size_rows,
+        'quantity': total,
+        'basicPrice': cheapest[0] if cheapest else 0,
+        'productPrice': cheapest[1] if cheapest else 0,
+        'price': {'min': product_min, 'max': product_max},
+        'delivery': {'min': delivery_min, 'max': delivery_max},
+    }
+
+
+def parse_warehouses(data):
+    """{id склада: название} из справочника WB (список объектов с id и name)"""
+    items = data.get('data', data.get('warehouses', [])) if isinstance(data, dict) else data
+    names = {}
+    for item in items or ():
+        if not isinstance(item, dict):
+            continue
+        warehouse_id = item.get('id', item.get('origid', item.get('wh')))
+        name = item.get('name') or item.get('warehouse')
+        if warehouse_id is None or not name:
+            continue
+        try:
+            names[int(warehouse_id)] = name
+        except (TypeError, ValueError):
+            continue
+    return names
+
+
+class WarehouseIndex:
+    def __init__(self, fetch, cache_path=None, interval=6 * 3600.0, retry_interval=300.0):
+        """
+        fetch() -> ответ справочника (JSON); cache_path - файл последней
+        успешной загрузки, читается при старте
+        """
+        self.fetch = fetch
+        self.cache_path = cache_path
+        self.interval = interval
+        self.retry_interval = retry_interval
+        # Словарь заменяется целиком - читатели не берут блокировку
+        self.names = {}
+        self.loaded_at = None
+        self.refreshes = 0
+        self.errors = 0
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._load_cache()
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                self.names = {int(key): name for key, name in json.load(f).items()}
+            self.loaded_at = os.path.getmtime(self.cache_path)
+        except (OSError, ValueError) as e:
+            log.warning('warehouses.cache_error', 'Не удалось прочитать справочник складов', error=str(e))
+
+    def _save_cache(self, names):
+        if not self.cache_path:
+            return
+        tmp = f'{self.cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(names, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            log.warning('warehouses.cache_error', 'Не удалось сохранить справочник складов', error=str(e))
+
+    def refresh(self):
+        """Загружает справочник; при ошибке остается прежний. True - обновлен"""
+        try:
+            names = parse_warehouses(self.fetch())
+        except Exception as e:
+            self.errors += 1
+            log.warning('warehouses.refresh_error', 'Ошибка загрузки справочника складов', error=str(e))
+            return False
+        if not names:
+            self.errors += 1
+            log.warning('warehouses.empty', 'Справочник складов пуст - оставлен прежний')
+            return False
+        self.names = names
+        self.loaded_at = time.time()
+        self.refreshes += 1
+        self._save_cache(names)
+        log.info('warehouses.refreshed', 'Справочник складов обновлен', count=len(names))
+        return True
+
+    def ensure_started(self):
+        """Запускает фоновое обновление, если его нет в этом процессе"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='warehouses', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Справочник из файла еще свежий (перезапуск воркера) - не загружаем сразу
+        wait = 0
+        if self.loaded_at is not None:
+            wait = max(self.loaded_at + self.interval - time.time(), 0)
+        while not self._stop.wait(wait):
+            wait = self.interval if self.refresh() else self.retry_interval
+
+    def stats(self):
+        return {
+            'warehouses': len(self.names),
+            'age': round(time.time() - self.loaded_at, 1) if self.loaded_at else None,
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+        }
@@ -0,0 +1,359 @@
+"""
+Server-Sent Events с изменениями цены и остатков открытых товаров.
+
+На каждый отслеживаемый (nmId, dest) работает один поток-опросчик: он
+загружает карточку раз в interval секунд и рассылает всем подписчикам
+изменения (цена, скидка, остатки по складам). Новый подписчик сразу
+получает снимок товара. Когда уходит последний подписчик, опрос
+прекращается. N открытых страниц одного товара - один запрос к WB за период.
+
+Подписчик не ждет опросчика: события лежат в его очереди. Если очередь
+переполнена (клиент не успевает читать), она очищается и следующим
+событием идет полный снимок.
+
+Во Flask (gthread) открытое соединение занимает поток воркера на все время
+подписки, поэтому таких подписок не больше max_thread_streams на процесс -
+остальные получают 503 и переходят на опрос. В ASGI-режиме подписка потока
+не занимает, действует только общий max_subscribers.
+"""
+import asyncio
+import json
+import queue
+import threading
+
+from log import get_logger
+
+
+log = get_logger(__name__)
+
+# Поля проекции 'wb', изменения которых рассылаются
+WATCHED_FIELDS = ('basicPrice', 'productPrice', 'discount', 'discountAmount', 'totalQuantity', 'hasStocks')
+
+
+class StreamLimitError(Exception):
+    """Превышено число отслеживаемых товаров или подписчиков"""
+
+
+def format_event(event, data, event_id=None):
+    """Сообщение в формате text/event-stream"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+HEARTBEAT = ': ping\n\n'
+
+
+def warehouse_quantities(product):
+    return {str(stock['warehouse_id']): stock['quantity'] for stock in product.get('warehouses') or []}
+
+
+def diff_product(old, new):
+    """
+    Изменения между двумя проекциями товара или None: fields - новые значения
+    полей, previous - прежние, warehouses - новый остаток по складу (None -
+    склад пропал из карточки)
+    """
+    fields = {name: new.get(name) for name in WATCHED_FIELDS if old.get(name) != new.get(name)}
+    old_stocks = warehouse_quantities(old)
+    new_stocks = warehouse_quantities(new)
+    warehouses = {
+        warehouse: new_stocks.get(warehouse)
+        for warehouse in old_stocks.keys() | new_stocks.keys()
+        if old_stocks.get(warehouse) != new_stocks.get(warehouse)
+    }
+    if not fields and not warehouses:
+        return None
+    return {
+        'fields': fields,
+        'previous': {name: old.get(name) for name in fields},
+        'warehouses': warehouses,
+    }
+
+
+class Subscriber:
+    """Подписчик с очередью для потока обработчика запроса (Flask)"""
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def put(self, message, resync):
+        """message - событие; resync - снимок вместо пропущенных событий при переполнении"""
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            _drain(self.queue)
+            self.queue.put_nowait(resync)
+
+    def get(self, timeout):
+        """Следующее событие или None, если за timeout ничего не пришло"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscriber(Subscriber):
+    """Подписчик для event loop (ASGI): события передаются в loop потокобезопасно"""
+
+    def __init__(self, queue_size, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def put(self, message, resync):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message, resync)
+        except RuntimeError:
+            # Event loop уже закрыт - подписчик отпишется сам
+            pass
+
+    def _put(self, message, resync):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            _drain(self.queue)
+            self.queue.put_nowait(resync)
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+def _drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except (queue.Empty, asyncio.QueueEmpty):
+            return
+
+
+class _Poller:
+    """Опрос одного товара, пока есть подписчики"""
+
+    def __init__(self, hub, key):
+        self.hub = hub
+        self.key = key
+        self.subscribers = set()
+        self.product = None
+        self.missing = False
+        self.version = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f'stream-poller-{key[0]}', daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot_message(self):
+        """Текущее состояние для нового подписчика: snapshot, not_found или None до первого опроса"""
+        nm_id, dest = self.key
+        if self.missing:
+            return format_event('not_found', {'nmId': nm_id, 'dest': dest}, self.version)
+        if self.product is None:
+            return None
+        return format_event('snapshot', {'nmId': nm_id, 'dest': dest, 'product': self.product}, self.version)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._poll()
+            self._stop.wait(self.hub.interval)
+
+    def _poll(self):
+        nm_id, dest = self.key
+        try:
+            product = self.hub.fetch(nm_id, dest)
+        except Exception as e:
+            # Сообщаем подписчикам только о смене ошибки, а не на каждом опросе
+            error = {'error': str(e), 'type': type(e).__name__}
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None:
+                error['retry_after'] = retry_after
+            if self.error is None or self.error['type'] != error['type']:
+                log.warning('stream.poll_error', 'Ошибка опроса товара', nm_id=nm_id, dest=dest, error=str(e))
+                self._publish(format_event('error', {'nmId': nm_id, **error}))
+            self.error = error
+            return
+        finally:
+            self.hub.polls += 1
+
+        self.error = None
+        if product is None:
+            if not self.missing:
+                self.product = None
+                self.missing = True
+                self.version += 1
+                self._publish(self.snapshot_message())
+            return
+
+        previous, self.product = self.product, product
+        self.missing = False
+        if previous is None:
+            self.version += 1
+            self._publish(self.snapshot_message())
+            return
+        changes = diff_product(previous, product)
+        if changes:
+            self.version += 1
+            self._publish(format_event('change', {'nmId': nm_id, 'dest': dest, **changes}, self.version))
+
+    def _publish(self, message):
+        resync = self.snapshot_message() or message
+        with self.hub._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(message, resync)
+
+
+class _ThreadStream:
+    """События подписки для потокового ответа Flask; close() отписывает один раз"""
+
+    def __init__(self, hub, key, subscriber):
+        self.hub = hub
+        self.key = key
+        self.subscriber = subscriber
+        self._closed = False
+
+    def __iter__(self):
+        yield 'retry: 5000\n\n'
+        while not self._closed:
+            yield self.subscriber.get(self.hub.heartbeat) or HEARTBEAT
+
+    def close(self):
+        # Сервер вызывает close() и для ответа, который так и не начали читать
+        with self.hub._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.hub._thread_streams -= 1
+        self.hub.unsubscribe(self.key, self.subscriber)
+
+
+class ProductStreamHub:
+    def __init__(self, fetch, interval=15.0, heartbeat=15.0, max_products=200,
+                 max_subscribers=1000, queue_size=20, max_thread_streams=None):
+        """
+        fetch(nmId, dest) -> проекция товара (dict) или None, если товар не
+        найден; исключение - ошибка опроса (подписчики получают событие error).
+        max_thread_streams - предел подписок через stream() (каждая занимает
+        поток), None - без предела
+        """
+        self.fetch = fetch
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.max_products = max_products
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.max_thread_streams = max_thread_streams
+        self._lock = threading.Lock()
+        self._pollers = {}
+        self._subscribers = 0
+        self._thread_streams = 0
+        self.rejected = 0
+        self.polls = 0
+        # Пропущенные события ушедших подписчиков (у текущих - subscriber.dropped)
+        self._dropped = 0
+
+    def subscribe(self, key, subscriber):
+        """Подписка на товар key = (nmId, dest); StreamLimitError при превышении лимитов"""
+        with self._lock:
+            poller = self._pollers.get(key)
+            if self._subscribers >= self.max_subscribers or (poller is None and len(self._pollers) >= self.max_products):
+                self.rejected += 1
+                raise StreamLimitError('Слишком много открытых подписок на изменения товаров')
+            created = poller is None
+            if created:
+                poller = self._pollers[key] = _Poller(self, key)
+            poller.subscribers.add(subscriber)
+            self._subscribers += 1
+            # Снимок ставится в очередь под блокировкой: событие _publish после
+            # него уже учитывает этого подписчика и не окажется в очереди раньше
+            snapshot = poller.snapshot_message()
+            if not created and snapshot is not None:
+                subscriber.put(snapshot, snapshot)
+        if created:
+            poller.start()
+        return subscriber
+
+    def unsubscribe(self, key, subscriber):
+        """Отписка; последний подписчик останавливает опрос товара"""
+        with self._lock:
+            poller = self._pollers.get(key)
+            if poller is None or subscriber not in poller.subscribers:
+                return
+            poller.subscribers.discard(subscriber)
+            self._subscribers -= 1
+            self._dropped += subscriber.dropped
+            if not poller.subscribers:
+                del self._pollers[key]
+                poller.stop()
+
+    def stream(self, key):
+        """
+        События для потокового ответа Flask (итерируемый объект с close());
+        StreamLimitError, если заняты все max_thread_streams
+        """
+        with self._lock:
+            if self.max_thread_streams is not None and self._thread_streams >= self.max_thread_streams:
+                self.rejected += 1
+                raise StreamLimitError('Все потоки для подписок на изменения товаров заняты')
+            self._thread_streams += 1
+        try:
+            subscriber = self.subscribe(key, Subscriber(self.queue_size))
+        except StreamLimitError:
+            with self._lock:
+                self._thread_streams -= 1
+            raise
+        return _ThreadStream(self, key, subscriber)
+
+    def astream(self, key):
+        """Асинхронный генератор событий для StreamingResponse (ASGI)"""
+        subscriber = self.subscribe(key, AsyncSubscriber(self.queue_size))
+
+        async def events():
+            try:
+                yield 'retry: 5000\n\n'
+                while True:
+                    yield await subscriber.get(self.heartbeat) or HEARTBEAT
+            finally:
+                self.unsubscribe(key, subscriber)
+
+        return events()
+
+    def stop(self):
+        with self._lock:
+            pollers = list(self._pollers.values())
+            self._pollers.clear()
+            self._subscribers = 0
+        for poller in pollers:
+            poller.stop()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'products': len(self._pollers),
+                'subscribers': self._subscribers,
+                'max_products': self.max_products,
+                'max_subscribers': self.max_subscribers,
+                'thread_streams': self._thread_streams,
+                'max_thread_streams': self.max_thread_streams,
+                'interval': self.interval,
+                'rejected': self.rejected,
+                'polls': self.polls,
+                'dropped': self._dropped + sum(
+                    subscriber.dropped for poller in self._pollers.values() for subscriber in poller.subscribers
+                ),
+            }
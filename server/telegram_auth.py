@@ -0,0 +1,108 @@
+"""
+Проверка initData Telegram Mini App.
+
+Секретный ключ HMAC ("WebAppData" + токен бота) вычисляется один раз на токен,
+initData разбирается как query string с URL-декодированием, auth_date
+проверяется на свежесть. Дополнительно можно включить защиту от повторов:
+каждый hash принимается только один раз за окно свежести. По умолчанию она
+выключена - Telegram отдает одну и ту же initData при каждом открытии
+Mini App в рамках сессии.
+"""
+import functools
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import parse_qsl
+
+from cache import TTLCache
+
+
+class InitDataError(Exception):
+    """initData не прошла проверку"""
+
+
+@functools.lru_cache(maxsize=8)
+def secret_key(bot_token):
+    """Секретный ключ для проверки подписи initData"""
+    return hmac.new(key=b"WebAppData", msg=bot_token.encode(), digestmod=hashlib.sha256).digest()
+
+
+class InitData:
+    """Проверенные поля initData"""
+
+    __slots__ = ('fields', 'auth_date', 'user')
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.auth_date = int(fields['auth_date']) if fields.get('auth_date', '').isdigit() else None
+        self.user = json.loads(fields['user']) if fields.get('user') else None
+
+    @property
+    def user_id(self):
+        return self.user.get('id') if isinstance(self.user, dict) else None
+
+
+class InitDataVerifier:
+    def __init__(self, bot_token, max_age=86400, replay_protection=False,
+                 replay_cache_size=100000, clock=time.time):
+        self.bot_token = bot_token
+        self.max_age = max_age
+        self.clock = clock
+        self.replay_cache = TTLCache(
+            ttl=max_age or 86400,
+            max_entries=replay_cache_size,
+            sizeof=lambda value: 0
+        ) if replay_protection else None
+
+    @property
+    def enabled(self):
+        return bool(self.bot_token)
+
+    def verify(self, init_data, check_replay=True):
+        """
+        Проверяет подпись, свежесть и (если включено) повтор initData.
+        check_replay=False - для initData, которую клиент присылает с каждым
+        запросом. Возвращает InitData или выбрасывает InitDataError.
+        """
+        if not init_data:
+            raise InitDataError('Empty initData')
+
+        try:
+            pairs = parse_qsl(init_data, keep_blank_values=True, strict_parsing=True)
+        except ValueError:
+            raise InitDataError('Malformed initData')
+
+        fields = dict(pairs)
+        received_hash = fields.pop('hash', None)
+        if not received_hash:
+            raise InitDataError('Missing hash')
+
+        data_check_string = '\n'.join(f"{key}={value}" for key, value in sorted(fields.items()))
+        computed_hash = hmac.new(
+            key=secret_key(self.bot_token),
+            msg=data_check_string.encode(),
+            digestmod=hashlib.sha256
+        ).hexdigest()
+        if not hmac.compare_digest(computed_hash, received_hash):
+            raise InitDataError('Invalid signature')
+
+        try:
+            result = InitData(fields)
+        except ValueError:
+            raise InitDataError('Malformed user field')
+
+        if self.max_age:
+            if result.auth_date is None:
+                raise InitDataError('Missing auth_date')
+            age = self.clock() - result.auth_date
+            # Небольшой запас на расхождение часов
+            if age > self.max_age or age < -60:
+                raise InitDataError('initData expired')
+
+        if check_replay and self.replay_cache is not None:
+            if self.replay_cache.get(received_hash) is not None:
+                raise InitDataError('initData already used')
+            self.replay_cache.set(received_hash, True)
+
+        return result
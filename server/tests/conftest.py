@@ -0,0 +1,188 @@
+"""
+Общие настройки тестов бэкенда.
+
+Модули server/ импортируются напрямую (как при запуске app.py). Внешние API
+заменены заглушкой на локальном порту: stub.delay - задержка ответа,
+stub.delays - задержка по пути запроса, stub.status - HTTP-статус,
+stub.headers - дополнительные заголовки ответа, stub.gzip - сжатое тело,
+stub.calls - полученные пути, stub.request_headers - заголовки последнего запроса.
+Окружение для app.py задается до его импорта: базы SQLite и кеши - во
+временном каталоге, без лимита запросов и фоновых опросов.
+"""
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import pytest
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def wb_card(nm_id, price=80000, quantity=3):
+    """Карточка cards/v4 с одним размером на одном складе"""
+    return {
+        'id': nm_id,
+        'name': f'Товар {nm_id}',
+        'brand': 'Бренд',
+        'pics': 2,
+        'totalQuantity': quantity,
+        'sizes': [{
+            'name': 'M',
+            'origName': '44',
+            'price': {'basic': price + 20000, 'product': price},
+            'stocks': [{'wh': 507, 'qty': quantity, 'time1': 1, 'time2': 20}],
+        }],
+    }
+
+
+def sign_init_data(bot_token, user_id, auth_date=None, **fields):
+    """initData, подписанная как у Telegram (алгоритм из документации Mini Apps)"""
+    fields = {
+        'auth_date': str(int(time.time()) if auth_date is None else auth_date),
+        'query_id': 'AAE',
+        'user': json.dumps({'id': user_id, 'first_name': 'Тест'}, ensure_ascii=False),
+        **fields,
+    }
+    data_check_string = '\n'.join(f'{key}={value}' for key, value in sorted(fields.items()))
+    secret = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+    fields['hash'] = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+class Stub:
+    def __init__(self):
+        self.delay = 0.0
+        self.delays = {}
+        self.status = 200
+        self.headers = {}
+        self.gzip = False
+        self.calls = []
+        self.request_headers = {}
+
+    def reset(self):
+        self.delay = 0.0
+        self.delays = {}
+        self.status = 200
+        self.headers = {}
+        self.gzip = False
+        self.calls.clear()
+        self.request_headers = {}
+
+
+stub = Stub()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        stub.calls.append(self.path)
+        stub.request_headers = dict(self.headers)
+        time.sleep(stub.delays.get(url.path, stub.delay))
+        if stub.status != 200:
+            body = {'error': 'stub'}
+        elif url.path == '/cards/v4/detail':
+            body = {'products': [wb_card(int(nm_id)) for nm_id in query['nm'][0].split(';') if nm_id != '404']}
+        elif url.path == '/api/nmInfo':
+            body = {'value': {'nmId': int(query['nmId'][0])}}
+        else:
+            body = {'ok': True}
+        # У 304 тела нет
+        data = json.dumps(body).encode() if stub.status != 304 else b''
+        self.send_response(stub.status)
+        self.send_header('Content-Type', 'application/json')
+        if stub.gzip and data:
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in stub.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except OSError:
+            pass  # Клиент не дождался ответа (таймаут)
+
+
+def run_asgi(*calls):
+    """Запросы к ASGI-приложению в одном event loop: calls - корутины-функции от httpx-клиента"""
+    import asgi
+    import httpx
+
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return await asyncio.gather(*(call(client) for call in calls))
+        finally:
+            # Клиенты httpx привязаны к своему event loop
+            await asgi.aupstream.aclose()
+
+    return asyncio.run(main())
+
+
+def closed_port_url():
+    """Адрес, на котором никто не слушает (отказ подключения)"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f'http://127.0.0.1:{port}'
+
+
+_server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+_server.daemon_threads = True
+threading.Thread(target=_server.serve_forever, daemon=True).start()
+STUB_URL = f'http://127.0.0.1:{_server.server_port}'
+_tmp = tempfile.mkdtemp(prefix='telegram-app-tests-')
+
+os.environ.update({
+    'WB_API_URL': STUB_URL,
+    'WB_STATIC_URL': STUB_URL,
+    'LOCAL_API_URL': closed_port_url(),
+    'LOCAL_API_TIMEOUT': '2',
+    'USER_STORE_DB': os.path.join(_tmp, 'users.db'),
+    'WATCHLIST_DB': os.path.join(_tmp, 'watchlist.db'),
+    'WATCHLIST_ENABLED': '0',
+    'WAREHOUSES_CACHE': '',
+    'IMAGE_CACHE_DIR': os.path.join(_tmp, 'images'),
+    'WB_RATE_LIMIT': '0',
+    'UPSTREAM_BACKOFF': '0.3',
+    'LOG_LEVEL': 'CRITICAL',
+})
+
+
+@pytest.fixture
+def wb_stub():
+    stub.reset()
+    yield stub
+    stub.reset()
+
+
+@pytest.fixture
+def backend():
+    """app.py с чистыми breaker'ами и кешем карточек"""
+    import app
+    from breaker import CircuitBreaker
+    from upstream import BREAKER_DEFAULTS
+    for host in app.upstream.hosts.values():
+        if host.breaker is not None:
+            host.breaker = CircuitBreaker(host.name, **BREAKER_DEFAULTS)
+    app.product_cache.clear()
+    return app
@@ -0,0 +1,30 @@
+import sqlite3
+
+from access_cache import AccessCache
+
+
+def make_cache(path):
+    return AccessCache(positive_ttl=300, positive_max=10, negative_ttl=60, negative_max=10, shared_path=str(path))
+
+
+def last_used(path, user_id):
+    with sqlite3.connect(str(path)) as conn:
+        return conn.execute('SELECT last_used FROM access_cache WHERE user_id = ?', (str(user_id),)).fetchone()[0]
+
+
+def test_shared_reads_do_not_write_on_every_hit(tmp_path):
+    path = tmp_path / 'access.db'
+    make_cache(path).set(1, True, {'name': 'A'})
+    written = last_used(path, 1)
+    for _ in range(3):
+        # Новый процесс: в памяти пусто, запись берется из общего файла
+        assert make_cache(path).get(1) == {'access': True, 'user': {'name': 'A'}}
+    assert last_used(path, 1) == written
+
+
+def test_invalidate_survives_shared_store_errors(tmp_path):
+    cache = make_cache(tmp_path / 'access.db')
+    cache.set(1, True, {'name': 'A'})
+    cache.shared._connect().execute('DROP TABLE access_cache')
+    cache.invalidate(1)
+    assert cache.positive.get(1) is None
@@ -0,0 +1,58 @@
+import asyncio
+
+import asgi
+from conftest import run_asgi
+
+
+def asgi_get(path, headers=None):
+    async def call(client):
+        return await client.get(path, headers=headers)
+
+    return run_asgi(call)[0]
+
+
+def test_native_route_serves_product_with_request_context(backend, wb_stub):
+    response = asgi_get('/api/wb/product?nmId=81', {'X-Request-ID': 'test-request-1', 'X-Request-Timeout': '5'})
+    assert response.status_code == 200
+    assert response.json()['product']['id'] == 81
+    assert response.headers['X-Request-ID'] == 'test-request-1'
+    assert 'budget;dur=5000' in response.headers['Server-Timing']
+
+    # Повтор с ETag - 304 из кеша, без запроса к WB
+    wb_stub.calls.clear()
+    response = asgi_get('/api/wb/product?nmId=81', {'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    assert wb_stub.calls == []
+
+
+def test_native_route_validates_parameters(backend):
+    response = asgi_get('/api/wb/product?nmId=abc')
+    assert response.status_code == 400
+    assert response.json() == {'error': 'nmId must be a positive integer'}
+
+
+def test_other_routes_fall_back_to_flask(backend):
+    response = asgi_get('/', {'X-Request-ID': 'test-request-2'})
+    assert response.status_code == 200
+    assert response.json()['message'] == 'WB Telegram Mini App Backend'
+    # X-Request-ID передается во Flask заголовком и возвращается им же
+    assert response.headers['X-Request-ID'] == 'test-request-2'
+
+    assert asgi_get('/api/admin/watchlist').status_code == 403
+
+
+def test_startup_starts_background_tasks(backend, monkeypatch):
+    started = []
+
+    class Task:
+        def __init__(self, name):
+            self.name = name
+
+        def ensure_started(self):
+            started.append(self.name)
+
+    monkeypatch.setattr(backend, 'WATCHLIST_ENABLED', True)
+    for name in ('warehouse_index', 'watchlist', 'shared_metrics'):
+        monkeypatch.setattr(backend, name, Task(name))
+    asyncio.run(asgi.app.router.startup())
+    assert started == ['warehouse_index', 'watchlist', 'shared_metrics']
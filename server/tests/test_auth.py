@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import sign_init_data
+from telegram_auth import InitDataVerifier
+
+
+BOT_TOKEN = '123456:TEST'
+ADMIN_ID = 5429222882
+
+
+@pytest.fixture
+def signed_backend(backend, monkeypatch):
+    """app.py с TELEGRAM_BOT_TOKEN: подпись initData проверяется"""
+    monkeypatch.setattr(backend, 'init_data_verifier', InitDataVerifier(BOT_TOKEN))
+    backend.access_cache.clear()
+    backend.init_data_users.clear()
+    return backend
+
+
+def check_access(backend, **body):
+    return backend.app.test_client().post('/api/check-access', json=body)
+
+
+def test_string_user_id_matches_signed_init_data(signed_backend):
+    response = check_access(signed_backend, user_id=str(ADMIN_ID), initData=sign_init_data(BOT_TOKEN, ADMIN_ID))
+    assert response.status_code == 200
+    assert response.json['access'] is True
+
+
+def test_init_data_required_when_token_is_set(signed_backend):
+    response = check_access(signed_backend, user_id=ADMIN_ID)
+    assert response.status_code == 403
+    assert response.json['error'] == 'initData required'
+
+
+def test_init_data_of_another_user_is_rejected(signed_backend):
+    response = check_access(signed_backend, user_id=ADMIN_ID, initData=sign_init_data(BOT_TOKEN, 42))
+    assert response.status_code == 403
+
+
+def test_non_numeric_user_id_is_bad_request(signed_backend):
+    assert check_access(signed_backend, user_id='admin').status_code == 400
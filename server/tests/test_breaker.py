@@ -0,0 +1,106 @@
+import pytest
+
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_breaker(clock, **kwargs):
+    settings = {'window': 10, 'min_calls': 4, 'error_rate': 0.5, 'open_timeout': 30, 'half_open_probes': 2}
+    return CircuitBreaker('api', clock=clock, **{**settings, **kwargs})
+
+
+def call(breaker, duration=0.1, error=None):
+    breaker.before_call()
+    breaker.after_call(duration, error)
+
+
+def open_breaker(breaker):
+    for _ in range(4):
+        call(breaker, error='boom')
+    assert breaker.state == OPEN
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        call(breaker, error='boom')
+    assert breaker.state == CLOSED
+
+
+def test_opens_on_error_rate_and_rejects_with_retry_after(clock):
+    breaker = make_breaker(clock)
+    call(breaker)
+    call(breaker)
+    call(breaker, error='boom')
+    assert breaker.state == CLOSED
+    call(breaker, error='boom')
+    assert breaker.state == OPEN
+
+    clock.now += 10
+    with pytest.raises(CircuitOpenError) as info:
+        breaker.before_call()
+    assert info.value.retry_after == 20
+    assert breaker.snapshot()['rejected'] == 1
+
+
+def test_opens_on_slow_calls(clock):
+    breaker = make_breaker(clock, slow_call_duration=1.0, slow_call_rate=0.75)
+    for _ in range(3):
+        call(breaker, duration=2.0)
+    call(breaker, duration=0.1)
+    assert breaker.state == OPEN
+
+
+def test_half_open_probes_close_the_breaker(clock):
+    breaker = make_breaker(clock)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+
+    breaker.before_call()
+    breaker.before_call()
+    # Пробы уже идут - остальные запросы отклоняются
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.after_call(0.1)
+    breaker.after_call(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()['window_calls'] == 0
+
+
+def test_failed_probe_reopens(clock):
+    breaker = make_breaker(clock)
+    open_breaker(breaker)
+    clock.now += 30
+    call(breaker, error='still down')
+    assert breaker.state == OPEN
+    assert breaker.snapshot()['opened_count'] == 2
+
+
+def test_neutral_outcome_frees_probe_slot_without_counting(clock):
+    breaker = make_breaker(clock)
+    open_breaker(breaker)
+    clock.now += 30
+    breaker.before_call()
+    breaker.before_call()
+    breaker.after_call(0.1, neutral=True)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+
+    closed = make_breaker(clock)
+    for _ in range(10):
+        closed.before_call()
+        closed.after_call(10.0, 'timeout', neutral=True)
+    assert closed.snapshot()['window_calls'] == 0
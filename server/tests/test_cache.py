@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = TTLCache(ttl=10, max_entries=10, clock=clock)
+    cache.set('a', 1)
+    clock.now += 9.9
+    assert cache.get('a') == 1
+    clock.now += 0.2
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(ttl=10, max_entries=2, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_max_bytes_limits_total_size(clock):
+    cache = TTLCache(ttl=10, max_entries=100, max_bytes=10, sizeof=len, clock=clock)
+    cache.set('a', 'xxxxxx')
+    cache.set('b', 'yyyyyy')
+    assert cache.get('a') is None
+    assert cache.stats()['bytes'] == 6
+    # Значение больше всего кеша не кладется
+    cache.set('c', 'z' * 11)
+    assert cache.get('c') is None
+
+
+def test_stale_entry_is_served_and_refreshed_once(clock):
+    cache = TTLCache(ttl=10, stale_ttl=60, max_entries=10, clock=clock)
+    cache.set('a', 'old')
+    clock.now += 30
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return 'new'
+
+    assert cache.get_or_load('a', loader) == 'old'
+    assert cache.get_or_load('a', loader) == 'old'
+    release.set()
+    cache.shutdown(wait=True)
+    assert calls == [1]
+    assert cache.get('a') == 'new'
+    assert cache.stats()['stale_hits'] == 2
+
+
+def test_refresh_error_keeps_stale_entry(clock):
+    cache = TTLCache(ttl=10, stale_ttl=60, max_entries=10, clock=clock)
+    cache.set('a', 'old')
+    clock.now += 30
+
+    def loader():
+        raise RuntimeError('upstream down')
+
+    assert cache.get_or_load('a', loader) == 'old'
+    cache.shutdown(wait=True)
+    assert cache.get('a', allow_stale=True) == 'old'
+    assert cache.stats()['refresh_errors'] == 1
+
+
+def test_miss_loads_synchronously_and_propagates_errors(clock):
+    cache = TTLCache(ttl=10, stale_ttl=60, max_entries=10, clock=clock)
+    assert cache.get_or_load('a', lambda: 'value') == 'value'
+    assert cache.get('a') == 'value'
+
+    def loader():
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load('b', loader)
+    clock.now += 100
+    assert cache.get('a', allow_stale=True) is None
@@ -0,0 +1,96 @@
+import gzip
+
+import pytest
+from flask import Flask, Response, jsonify
+from werkzeug.http import parse_accept_header
+
+import compression
+from compression import Compressor
+
+
+BIG = {'items': ['товар'] * 200}
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    Compressor(min_size=256).init_app(app)
+
+    @app.route('/big')
+    def big():
+        return jsonify(BIG)
+
+    @app.route('/small')
+    def small():
+        return jsonify({'ok': True})
+
+    @app.route('/encoded')
+    def encoded():
+        return Response(gzip.compress(b'{"ok":true}' * 100), mimetype='application/json',
+                        headers={'Content-Encoding': 'gzip'})
+
+    @app.route('/stream')
+    def stream():
+        return Response((b'x' * 1000 for _ in range(3)), mimetype='text/plain')
+
+    @app.route('/image')
+    def image():
+        return Response(b'\x89PNG' * 1000, mimetype='image/png')
+
+    @app.route('/not-modified')
+    def not_modified():
+        return Response(status=304)
+
+    return app.test_client()
+
+
+def plain_body(client, path):
+    return client.get(path, headers={'Accept-Encoding': 'identity'}).get_data()
+
+
+def test_large_json_is_gzipped_for_accepting_clients(client):
+    response = client.get('/big', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == plain_body(client, '/big')
+
+
+def test_no_compression_without_accept_encoding_or_below_min_size(client):
+    response = client.get('/big', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    # Ответ зависит от Accept-Encoding, даже если не сжат
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_already_encoded_response_is_not_compressed_again(client):
+    response = client.get('/encoded', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()) == b'{"ok":true}' * 100
+
+
+@pytest.mark.parametrize('path', ['/stream', '/image', '/not-modified'])
+def test_streamed_binary_and_bodiless_responses_are_not_compressed(client, path):
+    response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_negotiation_prefers_brotli_and_respects_q_values():
+    compressor = Compressor()
+    compressor.encodings = ['br', 'gzip']
+
+    def choose(header):
+        return compressor.choose_encoding(parse_accept_header(header))
+
+    assert choose('gzip, deflate, br') == 'br'
+    assert choose('br;q=0.5, gzip') == 'gzip'
+    assert choose('br;q=0, gzip;q=0') is None
+    assert choose('*') == 'br'
+    assert choose('deflate') is None
+
+
+@pytest.mark.skipif(compression.brotli is None, reason='brotli не установлен')
+def test_brotli_round_trip(client):
+    response = client.get('/big', headers={'Accept-Encoding': 'br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert compression.brotli.decompress(response.get_data()) == plain_body(client, '/big')
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+import requests
+
+from breaker import CircuitOpenError
+from conftest import STUB_URL, closed_port_url
+from deadline import Deadline, DeadlineExceeded, deadline_var
+from upstream import UpstreamClient
+
+
+@pytest.fixture
+def request_deadline():
+    """Срок текущего запроса к сервису: request_deadline(0.1)"""
+    tokens = []
+
+    def set_deadline(budget):
+        tokens.append(deadline_var.set(Deadline(budget) if budget is not None else None))
+
+    yield set_deadline
+    for token in reversed(tokens):
+        deadline_var.reset(token)
+
+
+def make_client(url=STUB_URL, timeout=2.0, **breaker):
+    client = UpstreamClient()
+    client.register('api', url, timeout=timeout, backoff=0.3, breaker={'window': 5, 'min_calls': 3, **breaker})
+    return client
+
+
+def test_timeout_is_capped_by_remaining_budget():
+    deadline = Deadline(0.5)
+    assert deadline.timeout('api', 10) <= 0.5
+    assert deadline.timeout('api', 0.1) == 0.1
+    connect, read = deadline.timeout('api', (5, 10))
+    assert connect <= 0.5 and read <= 0.5
+
+
+def test_exhausted_budget_skips_upstream_call(wb_stub, request_deadline):
+    client = make_client()
+    request_deadline(0.01)
+    time.sleep(0.02)
+    with pytest.raises(DeadlineExceeded):
+        client.get('api', '/cards/v4/detail?nm=1')
+    assert wb_stub.calls == []
+
+
+def test_deadline_exceeded_is_not_a_breaker_error():
+    assert not issubclass(DeadlineExceeded, CircuitOpenError)
+
+
+def test_budget_timeouts_do_not_open_breaker(wb_stub, request_deadline):
+    # Клиент с коротким X-Request-Timeout не должен размыкать breaker для всех
+    wb_stub.delay = 0.3
+    client = make_client()
+    for _ in range(5):
+        request_deadline(0.1)
+        with pytest.raises(DeadlineExceeded):
+            client.get('api', '/cards/v4/detail?nm=1')
+    request_deadline(None)
+    snapshot = client.breaker_state('api')
+    assert snapshot['state'] == 'closed'
+    assert snapshot['window_calls'] == 0
+
+    wb_stub.delay = 0
+    assert client.get('api', '/cards/v4/detail?nm=1').status_code == 200
+
+
+def test_host_timeouts_still_open_breaker(wb_stub):
+    wb_stub.delay = 0.3
+    client = make_client(timeout=0.1)
+    client.hosts['api'].session.adapters['http://'].max_retries.total = 0
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.RequestException):
+            client.get('api', '/cards/v4/detail?nm=1')
+    assert client.breaker_state('api')['state'] == 'open'
+
+
+def test_retry_cut_by_deadline_raises_requests_exception(request_deadline):
+    # Отказ подключения, когда на повтор не хватает срока: исключение requests,
+    # а не сырое исключение urllib3
+    client = make_client(url=closed_port_url())
+    request_deadline(0.5)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get('api', '/api/nmInfo?nmId=1')
+
+
+def test_retry_after_beyond_deadline_returns_last_response(wb_stub, request_deadline):
+    # Retry-After длиннее срока запроса: ответ сразу, без сна на весь Retry-After
+    wb_stub.status = 503
+    wb_stub.headers = {'Retry-After': '4'}
+    client = make_client()
+    request_deadline(1)
+    started = time.monotonic()
+    assert client.get('api', '/cards/v4/detail?nm=1').status_code == 503
+    assert time.monotonic() - started < 0.5
+    assert len(wb_stub.calls) == 1
+
+
+def test_local_api_down_with_deadline_is_connection_failed(backend):
+    client = backend.app.test_client()
+    response = client.get('/api/local/raw/nmInfo?nmId=1&format=merged', headers={'X-Request-Timeout': '0.5'})
+    assert response.status_code == 503
+    assert response.json['_metadata']['status'] == 'connection_failed'
+
+
+def test_budget_timeout_maps_to_504(backend, wb_stub):
+    wb_stub.delay = 0.5
+    client = backend.app.test_client()
+    response = client.get('/api/wb/product?nmId=11', headers={'X-Request-Timeout': '0.2'})
+    assert response.status_code == 504
+    assert 'budget;dur=200' in response.headers['Server-Timing']
+    assert backend.upstream.breaker_state('wb')['window_calls'] == 0
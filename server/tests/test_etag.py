@@ -0,0 +1,65 @@
+import pytest
+
+from conftest import run_asgi
+
+
+def get(kind, backend, path, headers=None):
+    if kind == 'flask':
+        return backend.app.test_client().get(path, headers=headers)
+
+    async def call(client):
+        return await client.get(path, headers=headers)
+
+    return run_asgi(call)[0]
+
+
+def body(response):
+    return response.get_data() if hasattr(response, 'get_data') else response.content
+
+
+@pytest.mark.parametrize('kind', ['flask', 'asgi'])
+@pytest.mark.parametrize('path', ['/api/product/91', '/api/wb/product?nmId=91'])
+def test_matching_if_none_match_gives_304(backend, wb_stub, kind, path):
+    response = get(kind, backend, path)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('W/"')
+    assert 'max-age=' in response.headers['Cache-Control']
+
+    for if_none_match in (etag, etag[2:], f'W/"other", {etag}', '*'):
+        response = get(kind, backend, path, {'If-None-Match': if_none_match})
+        assert response.status_code == 304, if_none_match
+        assert body(response) == b''
+        assert response.headers['ETag'] == etag
+
+    response = get(kind, backend, path, {'If-None-Match': 'W/"other"'})
+    assert response.status_code == 200
+
+
+def test_etag_does_not_depend_on_compression(backend, wb_stub, monkeypatch):
+    monkeypatch.setattr(backend.compressor, 'min_size', 0)
+    client = backend.app.test_client()
+    plain = client.get('/api/wb/product?nmId=92', headers={'Accept-Encoding': 'identity'})
+    compressed = client.get('/api/wb/product?nmId=92', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers.get('Content-Encoding') == 'gzip'
+    assert compressed.headers['ETag'] == plain.headers['ETag']
+
+
+@pytest.mark.parametrize('kind', ['flask', 'asgi'])
+def test_error_responses_have_no_etag(backend, wb_stub, kind):
+    response = get(kind, backend, '/api/product/404', {'If-None-Match': '*'})
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
+
+    wb_stub.status = 500
+    response = get(kind, backend, '/api/product/93', {'If-None-Match': '*'})
+    assert response.status_code == 502
+    assert 'ETag' not in response.headers
+
+
+def test_etag_matches_uses_weak_comparison(backend):
+    assert backend.etag_matches('W/"abc"', 'abc')
+    assert backend.etag_matches('"abc"', 'abc')
+    assert not backend.etag_matches('"abcd"', 'abc')
+    assert not backend.etag_matches('', 'abc')
+    assert not backend.etag_matches(None, 'abc')
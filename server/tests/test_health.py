@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from deadline import Deadline, deadline_var
+from health import HealthProber
+
+
+def test_snapshot_reports_window_and_last_error():
+    prober = HealthProber(window=3)
+    results = iter([(True, {'n': 1}), (True, {'n': 2}), RuntimeError('down'), (True, {'n': 4})])
+
+    def check():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    prober.register('api', check)
+    assert prober.snapshot('api') == {'status': 'unknown', 'samples': 0}
+    for _ in range(3):
+        prober.probe('api')
+    snapshot = prober.snapshot('api')
+    assert snapshot['status'] == 'unavailable'
+    assert snapshot['error'] == 'down' and snapshot['error_type'] == 'RuntimeError'
+    assert snapshot['success_rate'] == pytest.approx(0.667)
+
+    snapshot = prober.probe('api')
+    # Окно из трех последних проверок, детали - последней
+    assert snapshot['status'] == 'available'
+    assert snapshot['samples'] == 3
+    assert snapshot['details'] == {'n': 4}
+    assert 'error' not in snapshot
+
+
+def test_probe_runs_without_caller_deadline():
+    prober = HealthProber()
+    seen = []
+    prober.register('api', lambda: (seen.append(deadline_var.get()) or True, {}))
+    token = deadline_var.set(Deadline(0.01))
+    try:
+        prober.probe('api')
+    finally:
+        deadline_var.reset(token)
+    assert seen == [None]
+
+
+def test_concurrent_probes_share_one_check():
+    prober = HealthProber()
+    release = threading.Event()
+    calls = []
+
+    def check():
+        calls.append(1)
+        release.wait(2)
+        return True, {}
+
+    prober.register('api', check)
+    first = threading.Thread(target=prober.probe, args=('api',))
+    first.start()
+    time.sleep(0.05)
+    results = []
+    second = threading.Thread(target=lambda: results.append(prober.probe('api')))
+    second.start()
+    time.sleep(0.05)
+    release.set()
+    first.join()
+    second.join()
+    assert calls == [1]
+    assert results[0]['status'] == 'available'
+
+
+@pytest.fixture
+def prober(backend, monkeypatch):
+    """Свой пробник с проверками app.py; фоновый поток не запускается"""
+    prober = HealthProber(interval=3600)
+    prober.register('local', backend.probe_local_api)
+    prober.register('wb', backend.probe_wb_api)
+    monkeypatch.setattr(prober, 'ensure_started', lambda: None)
+    monkeypatch.setattr(backend, 'health_prober', prober)
+    return prober
+
+
+def test_unknown_status_before_first_probe_is_healthy(backend, prober):
+    response = backend.app.test_client().get('/api/local/health')
+    assert response.status_code == 200
+    assert response.json['local_api_status'] == 'unknown'
+
+
+def test_unreachable_local_api_is_unavailable(backend, prober):
+    # Локальный API в тестах - закрытый порт
+    response = backend.app.test_client().get('/api/local/health?probe=now')
+    assert response.status_code == 503
+    assert response.json['local_api_status'] == 'unavailable'
+    assert 'solution' in response.json
+
+
+def test_open_breaker_is_reported_as_circuit_open(backend, prober, wb_stub):
+    breaker = backend.upstream.hosts['local'].breaker
+    for _ in range(breaker.min_calls):
+        breaker.before_call()
+        breaker.after_call(0.1, 'boom')
+    client = backend.app.test_client()
+
+    response = client.get('/api/local/health?probe=now')
+    assert response.status_code == 503
+    assert response.json['local_api_status'] == 'circuit_open'
+    assert response.json['breaker']['state'] == 'open'
+
+    # Сам сервис жив: /api/health отвечает 200 и показывает состояние внешних API
+    response = client.get('/api/health?probe=now')
+    assert response.status_code == 200
+    upstreams = response.json['upstreams']
+    assert upstreams['local']['status'] == 'unavailable'
+    assert upstreams['local']['breaker'] == 'open'
+    assert upstreams['wb']['status'] == 'available'
+    assert upstreams['wb']['breaker'] == 'closed'
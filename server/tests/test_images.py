@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+from images import BASKET_BOUNDS, DiskLRUCache, basket_number, content_type, image_url, wb_size_for_width
+
+
+@pytest.mark.parametrize('nm_id, basket', [
+    (0, 1),
+    (14399999, 1),
+    (14400000, 2),
+    (28799999, 2),
+    (456599999, 25),
+    (456600000, 26),
+    (900000000, 26),
+])
+def test_basket_number_follows_bounds(nm_id, basket):
+    assert basket_number(nm_id) == basket
+
+
+def test_basket_number_with_custom_bounds():
+    assert basket_number(250000, bounds=(1, 2)) == 2
+    assert basket_number(500000, bounds=(1, 2)) == 3
+    assert basket_number(500000, bounds=()) == 1
+
+
+def test_image_url():
+    assert image_url(12345678, 1) == (
+        'https://basket-01.wbbasket.ru/vol123/part12345/12345678/images/big/1.webp'
+    )
+    assert image_url(176543210, 3, size='tm') == (
+        'https://basket-12.wbbasket.ru/vol1765/part176543/176543210/images/tm/3.webp'
+    )
+    assert len(BASKET_BOUNDS) + 1 == basket_number(10 ** 10)
+
+
+@pytest.mark.parametrize('width, size', [(50, 'tm'), (96, 'tm'), (97, 'c246x328'), (516, 'c516x688'), (2000, 'big')])
+def test_wb_size_for_width(width, size):
+    assert wb_size_for_width(width) == size
+
+
+def test_content_type_by_signature(tmp_path):
+    samples = {
+        'image/webp': b'RIFF\x00\x00\x00\x00WEBPVP8 ',
+        'image/jpeg': b'\xff\xd8\xff\xe0' + b'\x00' * 8,
+        'image/png': b'\x89PNG\r\n\x1a\n\x00\x00\x00\x00',
+        'application/octet-stream': b'<html>',
+    }
+    for expected, data in samples.items():
+        path = tmp_path / 'file'
+        path.write_bytes(data)
+        assert content_type(str(path)) == expected
+
+
+def set_mtime(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_disk_cache_evicts_least_recently_read(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=25)
+    a = cache.put_bytes('a', b'x' * 10)
+    cache.put_bytes('b', b'x' * 10)
+    assert cache.get('a') == a
+    cache.put_bytes('c', b'x' * 10)
+
+    # 'a' прочитан после записи 'b' - удаляется 'b'
+    assert cache.get('b') is None
+    assert cache.get('a') == a
+    assert cache.get('c') is not None
+    stats = cache.stats()
+    assert stats['files'] == 2
+    assert stats['bytes'] == 20
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3
+    assert stats['misses'] == 1
+
+
+def test_disk_cache_keeps_single_oversized_file(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=5)
+    path = cache.put_bytes('big', b'x' * 10)
+    assert os.path.exists(path)
+    assert cache.stats()['bytes'] == 10
+    cache.put_bytes('next', b'x' * 10)
+    assert not os.path.exists(path)
+    assert cache.stats()['files'] == 1
+
+
+def test_disk_cache_size_accounting(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=1000)
+    path = cache.put_bytes('a', b'x' * 10)
+    cache.put_bytes('a', b'x' * 4)
+    assert cache.stats()['bytes'] == 4
+    cache.put_bytes('b', b'x' * 6)
+    assert cache.stats()['bytes'] == 10
+
+    # Файл удален другим процессом - учитывается при следующем чтении
+    os.remove(path)
+    assert cache.lookup('a') is None
+    assert cache.stats() == {
+        'files': 1, 'bytes': 6, 'max_bytes': 1000, 'hits': 0, 'misses': 0, 'evictions': 0,
+    }
+
+
+def test_disk_cache_failed_write_leaves_nothing(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=1000)
+
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('диск заполнен')
+
+    with pytest.raises(OSError):
+        cache.put('a', write)
+    assert cache.get('a') is None
+    assert cache.stats()['bytes'] == 0
+    assert not any(name.endswith('.tmp') for _, _, names in os.walk(tmp_path) for name in names)
+
+
+def test_disk_cache_restores_lru_order_from_disk(tmp_path):
+    first = DiskLRUCache(str(tmp_path), max_bytes=25)
+    a = first.put_bytes('a', b'x' * 10)
+    b = first.put_bytes('b', b'x' * 10)
+    set_mtime(a, 2000)
+    set_mtime(b, 1000)
+
+    second = DiskLRUCache(str(tmp_path), max_bytes=25)
+    assert second.stats()['bytes'] == 20
+    second.put_bytes('c', b'x' * 10)
+    assert not os.path.exists(b)
+    assert os.path.exists(a)
+
+
+def test_disk_cache_rescan_counts_files_of_other_processes(tmp_path):
+    first = DiskLRUCache(str(tmp_path), max_bytes=25, rescan_interval=0)
+    other = DiskLRUCache(str(tmp_path), max_bytes=25, rescan_interval=0)
+    a = other.put_bytes('a', b'x' * 10)
+    set_mtime(a, 1000)
+    first.put_bytes('b', b'x' * 10)
+    first.put_bytes('c', b'x' * 10)
+    # Файл другого процесса самый старый - удаляется первым
+    assert not os.path.exists(a)
+    assert first.stats()['bytes'] == 20
@@ -0,0 +1,59 @@
+import json
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+from flask import Flask
+
+from json_provider import FastJSONProvider, orjson
+
+
+BACKENDS = ['json', pytest.param('orjson', marks=pytest.mark.skipif(orjson is None, reason='orjson не установлен'))]
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_output_matches_standard_provider(app, backend):
+    payload = {
+        'name': 'Товар',
+        'price': Decimal('1.50'),
+        'updated': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        'day': date(2024, 1, 2),
+        'id': uuid.UUID(int=1),
+        'warehouses': {507: 3, 117: 0},
+    }
+    encoded = FastJSONProvider(app, backend=backend).encode(payload)
+    # Компактно, UTF-8 без экранирования, ключи отсортированы, перевод строки в конце
+    assert encoded == (json.dumps(
+        {**payload, 'price': '1.50', 'updated': 'Tue, 02 Jan 2024 03:04:05 GMT',
+         'day': 'Tue, 02 Jan 2024 00:00:00 GMT', 'id': str(payload['id']), 'warehouses': {'117': 0, '507': 3}},
+        ensure_ascii=False, separators=(',', ':'), sort_keys=True
+    ) + '\n').encode()
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_values_beyond_orjson_fall_back_to_json(app, backend):
+    assert FastJSONProvider(app, backend=backend).encode({'big': 2 ** 70}) == b'{"big":1180591620717411303424}\n'
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_response_and_loads(app, backend):
+    app.json = FastJSONProvider(app, backend=backend)
+    with app.app_context():
+        response = app.json.response({'b': 1, 'a': [1, 2]})
+        assert response.mimetype == 'application/json'
+        assert response.get_data() == b'{"a":[1,2],"b":1}\n'
+        assert app.json.loads(b'{"a":"\xd0\xa2"}') == {'a': 'Т'}
+        with pytest.raises(ValueError):
+            app.json.loads('{')
+
+
+def test_backend_selection(app):
+    assert FastJSONProvider(app, backend='json').backend == 'json'
+    expected = 'orjson' if orjson is not None else 'json'
+    assert FastJSONProvider(app).backend == expected
@@ -0,0 +1,19 @@
+import logging
+import random
+
+from log import DEFAULT_SAMPLE, ContextFilter, parse_mapping, request_level
+
+
+def passed(log_filter, level, event, count=1000):
+    return sum(
+        log_filter.filter(logging.makeLogRecord({'levelno': level, 'event': event}))
+        for _ in range(count)
+    )
+
+
+def test_request_event_is_sampled_by_default():
+    random.seed(1)
+    log_filter = ContextFilter(parse_mapping(DEFAULT_SAMPLE, float))
+    assert 50 < passed(log_filter, request_level(200), 'request') < 150
+    # Ошибки сервера не прореживаются
+    assert passed(log_filter, request_level(502), 'request') == 1000
@@ -0,0 +1,31 @@
+import json
+import os
+import time
+
+from metrics import Registry, SharedMetrics
+
+
+def other_worker_snapshot(directory, pid, value, age=0):
+    path = os.path.join(directory, f'{pid}.json')
+    with open(path, 'w') as file:
+        json.dump([['jobs_total', 'counter', 'Задачи', [['', {'worker': str(pid)}, value]]]], file)
+    os.utime(path, (time.time() - age, time.time() - age))
+
+
+def test_metrics_of_all_workers_in_one_scrape(tmp_path):
+    registry = Registry()
+    registry.counter('jobs_total', 'Задачи').inc(3)
+    shared = SharedMetrics(registry, str(tmp_path), interval=5)
+    other_worker_snapshot(str(tmp_path), 1, 7)
+    other_worker_snapshot(str(tmp_path), 2, 100, age=60)
+
+    text = shared.render()
+    assert text.count('# TYPE jobs_total counter') == 1
+    assert f'jobs_total{{worker="{os.getpid()}"}} 3' in text
+    assert 'jobs_total{worker="1"} 7' in text
+    # Снимок воркера, который давно не обновлялся, не отдается
+    assert 'worker="2"' not in text
+
+    shared._pid = os.getpid()
+    shared.stop()
+    assert not os.path.exists(os.path.join(str(tmp_path), f'{os.getpid()}.json'))
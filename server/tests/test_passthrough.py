@@ -0,0 +1,84 @@
+import gzip
+import json
+
+import pytest
+
+from conftest import STUB_URL, run_asgi
+
+
+@pytest.fixture
+def local_backend(backend, wb_stub, monkeypatch):
+    """Локальный API - заглушка"""
+    monkeypatch.setattr(backend, 'LOCAL_API_URL', STUB_URL)
+    return backend
+
+
+def test_body_and_validators_are_passed_through(local_backend, wb_stub):
+    wb_stub.headers = {'ETag': '"v1"', 'Cache-Control': 'max-age=30', 'X-Internal': 'secret'}
+    response = local_backend.app.test_client().get('/api/local/raw/nmInfo?nmId=5', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert json.loads(response.get_data()) == {'value': {'nmId': 5}}
+    assert response.headers['ETag'] == '"v1"'
+    assert response.headers['Cache-Control'] == 'max-age=30'
+    assert 'X-Internal' not in response.headers
+    assert response.headers['X-Source'] == 'local_api'
+    assert response.headers['X-Nm-Id-Requested'] == '5'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+
+def test_compressed_body_is_kept_for_clients_that_accept_it(local_backend, wb_stub):
+    wb_stub.gzip = True
+    wb_stub.headers = {'ETag': '"v1"'}
+    client = local_backend.app.test_client()
+
+    response = client.get('/api/local/raw/nmInfo?nmId=6', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.get_data())) == {'value': {'nmId': 6}}
+    assert response.headers['ETag'] == '"v1"'
+
+    # Клиент без gzip получает распакованное тело; строгий ETag ослабляется
+    response = client.get('/api/local/raw/nmInfo?nmId=6', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert json.loads(response.get_data()) == {'value': {'nmId': 6}}
+    assert response.headers['ETag'] == 'W/"v1"'
+
+
+def test_conditional_request_is_forwarded_and_304_passed_back(local_backend, wb_stub):
+    wb_stub.status = 304
+    wb_stub.headers = {'ETag': '"v1"'}
+    response = local_backend.app.test_client().get(
+        '/api/local/raw/nmInfo?nmId=7', headers={'If-None-Match': '"v1"'}
+    )
+    assert wb_stub.request_headers['If-None-Match'] == '"v1"'
+    assert response.status_code == 304
+    assert response.headers['ETag'] == '"v1"'
+    assert response.get_data() == b''
+
+
+def test_upstream_error_status_is_reported_as_502(local_backend, wb_stub):
+    wb_stub.status = 500
+    response = local_backend.app.test_client().get('/api/local/raw/nmInfo?nmId=8')
+    assert response.status_code == 502
+    assert response.json['status_code'] == 500
+
+
+def test_merged_format_adds_metadata(local_backend):
+    response = local_backend.app.test_client().get('/api/local/raw/nmInfo?nmId=9&format=merged')
+    assert response.status_code == 200
+    assert response.json['value'] == {'nmId': 9}
+    assert response.json['_metadata']['nm_id_requested'] == '9'
+    assert response.headers['ETag'].startswith('W/')
+
+
+def test_asgi_passthrough_keeps_status_and_headers(local_backend, wb_stub):
+    wb_stub.headers = {'ETag': '"v2"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+
+    async def call(client):
+        return await client.get('/api/local/raw/nmInfo?nmId=10')
+
+    response, = run_asgi(call)
+    assert response.status_code == 200
+    assert response.json() == {'value': {'nmId': 10}}
+    assert response.headers['ETag'] == '"v2"'
+    assert response.headers['Last-Modified'] == 'Mon, 01 Jan 2024 00:00:00 GMT'
+    assert response.headers['X-Source'] == 'local_api'
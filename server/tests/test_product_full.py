@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+
+import asgi
+from conftest import STUB_URL, run_asgi
+
+
+@pytest.fixture
+def full_backend(backend, wb_stub, monkeypatch):
+    """Оба источника /full - заглушка; локальный API по умолчанию недоступен"""
+    monkeypatch.setattr(backend, 'LOCAL_API_URL', STUB_URL)
+    return backend
+
+
+def test_asgi_source_timeout_does_not_cancel_shared_load(full_backend, wb_stub):
+    # Запрос к WB с коротким сроком от /full ведет загрузку; запрос карточки с
+    # длинным сроком ждет ее же и должен получить ответ, а не CancelledError
+    wb_stub.delays['/cards/v4/detail'] = 0.5
+
+    async def full(client):
+        return await client.get('/api/product/41/full', headers={'X-Request-Timeout': '0.2'})
+
+    async def product(client):
+        await asyncio.sleep(0.05)
+        return await client.get('/api/wb/product?nmId=41', headers={'X-Request-Timeout': '5'})
+
+    full_response, product_response = run_asgi(full, product)
+    assert full_response.status_code == 200
+    assert full_response.json()['_metadata']['sources']['wb']['status'] in ('timeout', 'deadline_exceeded')
+    assert product_response.status_code == 200
+    assert product_response.json()['product']['id'] == 41
+
+
+def get_full(kind, path, headers=None):
+    """GET /full во Flask-приложении или в ASGI-приложении: (статус, JSON)"""
+    if kind == 'flask':
+        response = asgi.backend.app.test_client().get(path, headers=headers)
+        return response.status_code, response.json
+
+    async def call(client):
+        return await client.get(path, headers=headers)
+
+    response, = run_asgi(call)
+    return response.status_code, response.json()
+
+
+@pytest.mark.parametrize('kind', ['flask', 'asgi'])
+def test_full_combines_both_sources(full_backend, kind):
+    status, payload = get_full(kind, '/api/product/71/full')
+    assert status == 200
+    assert payload['local'] == {'value': {'nmId': 71}}
+    assert payload['wb']['id'] == 71
+    assert payload['_metadata']['status'] == 'success'
+    assert set(payload['_metadata']['sources']) == {'local', 'wb'}
+
+
+@pytest.mark.parametrize('kind', ['flask', 'asgi'])
+def test_slow_source_is_cut_by_its_deadline(full_backend, wb_stub, monkeypatch, kind):
+    monkeypatch.setitem(full_backend.FULL_SOURCE_DEADLINES, 'local', 0.3)
+    wb_stub.delays['/api/nmInfo'] = 1.0
+    started = time.monotonic()
+    status, payload = get_full(kind, '/api/product/72/full')
+    assert time.monotonic() - started < 0.9
+    assert status == 200
+    assert payload['local'] is None
+    assert payload['wb']['id'] == 72
+    sources = payload['_metadata']['sources']
+    assert payload['_metadata']['status'] == 'partial'
+    assert sources['local']['status'] in ('timeout', 'deadline_exceeded')
+    assert sources['wb']['status'] == 'success'
+
+
+@pytest.mark.parametrize('kind', ['flask', 'asgi'])
+def test_all_sources_timed_out_is_504(full_backend, wb_stub, kind):
+    wb_stub.delay = 1.0
+    status, payload = get_full(kind, '/api/product/73/full', {'X-Request-Timeout': '0.3'})
+    assert status == 504
+    assert payload['_metadata']['status'] == 'failed'
+    assert {source['status'] for source in payload['_metadata']['sources'].values()} <= {'timeout', 'deadline_exceeded'}
+
+
+def test_unavailable_local_api_gives_partial_result(backend, wb_stub):
+    # Локальный API по умолчанию на закрытом порту
+    response = backend.app.test_client().get('/api/product/74/full')
+    assert response.status_code == 200
+    assert response.json['wb']['id'] == 74
+    assert response.json['_metadata']['sources']['local']['status'] == 'error'
@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+
+from breaker import CircuitOpenError
+from cache import TTLCache
+from conftest import STUB_URL, wb_card
+from deadline import DeadlineExceeded
+from products import ProductService, WBApiError, chunk_error
+from ratelimit import RateLimited
+from singleflight import SingleFlight
+from upstream import UpstreamClient
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_products(clock, **kwargs):
+    """ProductService на заглушке WB с отдельным кешем, без повторов запросов"""
+    client = UpstreamClient()
+    client.register('wb', STUB_URL, timeout=2, retries=0, breaker=False)
+    return ProductService(
+        client,
+        TTLCache(ttl=10, stale_ttl=60, max_entries=100, clock=clock),
+        TTLCache(ttl=70, max_entries=100, clock=clock),
+        SingleFlight(),
+        ThreadPoolExecutor(max_workers=2),
+        default_dest=-1,
+        **kwargs
+    )
+
+
+def requested_chunks(calls):
+    return [parse_qs(urlsplit(path).query)['nm'][0] for path in calls]
+
+
+def test_cards_are_loaded_in_chunks_of_batch_size(wb_stub, clock):
+    products = make_products(clock, batch_size=2)
+    cards = products.cards([1, 2, 3, 4, 5])
+    assert sorted(requested_chunks(wb_stub.calls)) == ['1;2', '3;4', '5']
+    assert {nm_id: card['id'] for nm_id, card in cards.items()} == {1: 1, 2: 2, 3: 3, 4: 4, 5: 5}
+
+
+def test_cached_cards_are_not_requested_again(wb_stub, clock):
+    products = make_products(clock, batch_size=10)
+    products.cache.set((2, -1), wb_card(2, price=1))
+    cards = products.cards([1, 2, 404])
+    assert requested_chunks(wb_stub.calls) == ['1;404']
+    assert cards[2]['sizes'][0]['price']['product'] == 1
+    assert cards[404] is None
+    # Загруженные карточки и отсутствие товара тоже кешируются
+    wb_stub.calls.clear()
+    products.cards([1, 404])
+    assert wb_stub.calls == []
+
+
+def test_failed_chunk_falls_back_to_stale_cards(wb_stub, clock):
+    products = make_products(clock, batch_size=10)
+    products.cache.set((1, -1), wb_card(1))
+    clock.now += 30
+    wb_stub.status = 500
+    cards = products.cards([1, 2])
+    assert cards[1]['id'] == 1
+    assert isinstance(cards[2], WBApiError)
+    assert cards[2].details == {'status_code': 500}
+
+
+@pytest.mark.parametrize('error, status', [
+    (RateLimited('wb', 3, 'wait'), 429),
+    (CircuitOpenError('wb', 30), 503),
+    (DeadlineExceeded('wb', 1), 504),
+    (requests.exceptions.ReadTimeout('read timed out'), 504),
+    (requests.exceptions.ConnectionError('refused'), 503),
+])
+def test_chunk_error_maps_failures_to_statuses(error, status):
+    mapped = chunk_error(error)
+    assert isinstance(mapped, WBApiError)
+    assert mapped.status == status
+    if hasattr(error, 'retry_after'):
+        assert mapped.details['retry_after'] == error.retry_after
+
+
+def test_batch_endpoint_reports_errors_per_nm_id(backend, wb_stub):
+    client = backend.app.test_client()
+    response = client.get('/api/wb/products?nmIds=51,404,abc,51')
+    assert response.status_code == 200
+    payload = response.json
+    assert [product['id'] for product in payload['products']] == [51]
+    assert payload['errors'] == [
+        {'nmId': 'abc', 'error': 'invalid_id'},
+        {'nmId': 404, 'error': 'not_found', 'status': 404},
+    ]
+    assert payload['_metadata']['status'] == 'partial'
+    assert payload['_metadata']['requested'] == 4
+
+    response = client.post('/api/wb/products', json={'nmIds': [52, 53]})
+    assert response.json['_metadata'] == {
+        'source': 'wildberries_api', 'status': 'success', 'requested': 2, 'found': 2
+    }
+    assert client.post('/api/wb/products', json={'nmIds': 'x'}).status_code == 400
+
+
+def test_batch_endpoint_maps_upstream_failure_per_nm_id(backend, wb_stub):
+    wb_stub.status = 404
+    payload = backend.app.test_client().get('/api/wb/products?nmIds=61,62').json
+    assert payload['products'] == []
+    assert [(error['nmId'], error['status']) for error in payload['errors']] == [(61, 502), (62, 502)]
+
+
+def test_projections_share_one_cache_entry(wb_stub, clock):
+    products = make_products(clock)
+    products.projection('id')(lambda card: card['id'])
+    products.projection('name')(lambda card: card['name'])
+    assert products.view('id', 1) == 1
+    assert products.view('name', 1) == 'Товар 1'
+    assert products.view('id', 1, dest=123) == 1
+    # Одна загрузка на (nmId, dest), какими бы проекциями его ни читали
+    assert len(wb_stub.calls) == 2
+    assert len(products.cache) == 2
+    assert products.view('id', 404) is None
+
+
+def test_resolve_dest_checks_allowed_regions(clock):
+    products = make_products(clock, allowed_dests=[-1, 123])
+    assert products.resolve_dest(None) == -1
+    assert products.resolve_dest('') == -1
+    assert products.resolve_dest('123') == 123
+    assert products.resolve_dest('5') is None
+    assert products.resolve_dest('abc') is None
+    assert make_products(clock).resolve_dest('5') == 5
+
+
+def test_known_validator_makes_the_request_conditional(wb_stub, clock):
+    products = make_products(clock)
+    wb_stub.headers = {'ETag': '"v1"'}
+    card = products.card(1)
+    assert wb_stub.request_headers.get('If-None-Match') is None
+
+    wb_stub.status = 304
+    assert products.refresh(1) is card
+    assert wb_stub.request_headers['If-None-Match'] == '"v1"'
+
+
+def test_304_without_cached_card_is_an_error(wb_stub, clock):
+    products = make_products(clock)
+    wb_stub.headers = {'ETag': '"v1"'}
+    products.card(1)
+    products.cache.clear()
+    # Валидатор без карточки в кеше не используется
+    assert products.conditional_headers((1, -1)) is None
+
+    class NotModified:
+        status_code = 304
+
+    with pytest.raises(WBApiError):
+        products.card_from_conditional_response(NotModified(), (1, -1))
+
+
+def test_response_without_validators_forgets_the_old_one(wb_stub, clock):
+    products = make_products(clock)
+    wb_stub.headers = {'ETag': '"v1"'}
+    products.card(1)
+    wb_stub.headers = {}
+    products.refresh(1)
+    assert products.validators.get((1, -1)) is None
+    products.refresh(1)
+    assert 'If-None-Match' not in wb_stub.request_headers
+
+
+def test_refresh_bypasses_fresh_cache(wb_stub, clock):
+    products = make_products(clock)
+    products.cache.set((1, -1), wb_card(1, price=1))
+    card = products.refresh(1)
+    assert len(wb_stub.calls) == 1
+    assert card['sizes'][0]['price']['product'] == 80000
+    assert products.cache.get((1, -1)) == card
+
+
+def test_refresh_cards_does_not_touch_the_cache(wb_stub, clock):
+    products = make_products(clock)
+    cached = wb_card(1, price=1)
+    products.cache.set((1, -1), cached)
+    cards = products.refresh_cards([1, 2])
+    assert requested_chunks(wb_stub.calls) == ['1;2']
+    assert cards[2]['id'] == 2
+    assert products.cache.get((1, -1)) is cached
+    assert products.cache.get((2, -1)) is None
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+
+import pytest
+
+from breaker import CircuitOpenError
+from conftest import STUB_URL
+from ratelimit import MemoryBucketStore, RateLimited, RateLimiter, SQLiteBucketStore, _take
+from upstream import AsyncUpstreamClient, UpstreamClient
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_take_refills_at_rate_up_to_burst():
+    # 0.5 токена + 2 с * 1 токен/с = 2.5, берем один
+    assert _take(0.5, 2.0, rate=1, burst=10, floor=0) == (1.5, 0.0)
+    # Пополнение не выше burst
+    assert _take(4.0, 100.0, rate=1, burst=5, floor=0) == (4.0, 0.0)
+    # Часы ушли назад - токены не отнимаются
+    assert _take(3.0, -5.0, rate=1, burst=5, floor=0) == (2.0, 0.0)
+
+
+def test_take_reports_wait_until_next_token():
+    tokens, wait = _take(0.25, 0.0, rate=2, burst=5, floor=0)
+    assert tokens == 0.25
+    assert wait == pytest.approx(0.375)
+
+
+def test_reserve_is_left_for_priority_requests():
+    # floor=2 (резерв): обычный запрос ждет, приоритетный (floor=0) проходит
+    assert _take(2.5, 0.0, rate=1, burst=5, floor=2) == (2.5, 0.5)
+    assert _take(2.5, 0.0, rate=1, burst=5, floor=0) == (1.5, 0.0)
+
+
+@pytest.mark.parametrize('make_store', [
+    lambda clock, tmp_path: MemoryBucketStore(clock=clock),
+    lambda clock, tmp_path: SQLiteBucketStore(str(tmp_path / 'ratelimit.db'), clock=clock),
+])
+def test_store_drains_burst_then_refills(make_store, tmp_path):
+    clock = Clock()
+    store = make_store(clock, tmp_path)
+    for _ in range(3):
+        assert store.take('api', 1, 3, 0)[0] == 0
+    wait, _ = store.take('api', 1, 3, 0)
+    assert wait == pytest.approx(1.0)
+    clock.now += 1
+    assert store.take('api', 1, 3, 0)[0] == 0
+    assert store.peek('api', 1, 3) == pytest.approx(0.0)
+
+
+def test_full_queue_is_rejected_without_waiting():
+    limiter = RateLimiter('api', rate=1, burst=2, max_wait=5, max_waiting=0, reserve=0)
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(RateLimited) as info:
+        limiter.acquire()
+    assert info.value.reason == 'queue_full'
+    assert limiter.snapshot()['rejected']['queue_full'] == 1
+
+
+def test_rate_limited_is_not_a_breaker_error():
+    assert not issubclass(RateLimited, CircuitOpenError)
+
+
+def test_async_acquire_reads_shared_store_off_event_loop(tmp_path):
+    limiter = RateLimiter('api', rate=100, burst=5, shared_path=str(tmp_path / 'ratelimit.db'))
+    threads = []
+    take = limiter.store.take
+
+    def recording_take(*args):
+        threads.append(threading.get_ident())
+        return take(*args)
+
+    limiter.store.take = recording_take
+
+    async def main():
+        await limiter.aacquire()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert threads and loop_thread not in threads
+
+
+def test_rate_limited_maps_to_429(backend, wb_stub):
+    host = backend.upstream.hosts['wb']
+    host.limiter = RateLimiter('wb', rate=0.01, burst=1, max_wait=0, reserve=0)
+    try:
+        client = backend.app.test_client()
+        assert client.get('/api/wb/product?nmId=21').status_code == 200
+        response = client.get('/api/wb/product?nmId=22')
+    finally:
+        host.limiter = None
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert backend.upstream.breaker_state('wb')['state'] == 'closed'
+
+
+def test_upstream_429_is_not_retried(wb_stub):
+    # Повтор 429 в обход лимитера только усугубил бы превышение лимита WB
+    wb_stub.status = 429
+    wb_stub.headers = {'Retry-After': '1'}
+    client = UpstreamClient()
+    client.register('api', STUB_URL, timeout=2, backoff=0.01)
+    assert client.get('api', '/cards/v4/detail?nm=1').status_code == 429
+    assert len(wb_stub.calls) == 1
+
+    async def main():
+        aclient = AsyncUpstreamClient(client)
+        try:
+            return await aclient.get('api', '/cards/v4/detail?nm=1')
+        finally:
+            await aclient.aclose()
+
+    assert asyncio.run(main()).status_code == 429
+    assert len(wb_stub.calls) == 2
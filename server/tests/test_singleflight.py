@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded, deadline_var
+from singleflight import SingleFlight
+
+
+@pytest.fixture
+def request_deadline():
+    tokens = []
+
+    def set_deadline(budget):
+        tokens.append(deadline_var.set(Deadline(budget)))
+
+    yield set_deadline
+    for token in reversed(tokens):
+        deadline_var.reset(token)
+
+
+def test_singleflight_waiter_respects_own_deadline(request_deadline):
+    flights = SingleFlight()
+    release = threading.Event()
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do('key', lambda: release.wait(2) and 'value')))
+    leader.start()
+    time.sleep(0.05)
+
+    request_deadline(0.1)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        flights.do('key', lambda: 'own')
+    assert time.monotonic() - started < 0.5
+
+    release.set()
+    leader.join()
+    assert results == ['value']
+
+
+def test_singleflight_does_not_share_leader_deadline(request_deadline):
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def short_leader():
+        started.set()
+        time.sleep(0.1)
+        raise DeadlineExceeded('api', 0.05)
+
+    errors = []
+
+    def run_leader():
+        try:
+            flights.do('key', short_leader)
+        except DeadlineExceeded as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=run_leader)
+    leader.start()
+    started.wait()
+    request_deadline(5)
+    assert flights.do('key', lambda: 'value') == 'value'
+    leader.join()
+    assert len(errors) == 1
+
+
+def test_async_waiter_respects_own_deadline():
+    flights = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.5)
+        return 'value'
+
+    async def waiter():
+        deadline_var.set(Deadline(0.1))
+        with pytest.raises(DeadlineExceeded):
+            await flights.ado('key', slow)
+
+    async def main():
+        leader = asyncio.ensure_future(flights.ado('key', slow))
+        await asyncio.sleep(0)
+        await asyncio.ensure_future(waiter())
+        assert await leader == 'value'
+
+    asyncio.run(main())
+
+
+def run_concurrently(flights, fn, count):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flights.do('key', fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'value'
+
+    results, errors = run_concurrently(flights, load, 5)
+    assert calls == [1]
+    assert results == ['value'] * 5 and not errors
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_leader_error_is_shared_with_waiters():
+    flights = SingleFlight()
+
+    def load():
+        time.sleep(0.1)
+        raise ValueError('upstream')
+
+    results, errors = run_concurrently(flights, load, 3)
+    assert not results
+    assert len(errors) == 3 and all(isinstance(e, ValueError) for e in errors)
+
+
+def test_waiters_over_limit_are_rejected():
+    flights = SingleFlight(max_waiters=1)
+    results, errors = run_concurrently(flights, lambda: time.sleep(0.2) or 'value', 3)
+    assert results == ['value'] * 2
+    assert [type(e).__name__ for e in errors] == ['SingleFlightOverflow']
+
+
+def test_async_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'value'
+
+    async def main():
+        return await asyncio.gather(*(flights.ado('key', load) for _ in range(5)))
+
+    assert asyncio.run(main()) == ['value'] * 5
+    assert calls == [1]
+
+
+def test_cancelled_async_leader_does_not_cancel_waiters():
+    flights = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return 'value'
+
+    async def main():
+        leader = asyncio.ensure_future(flights.ado('key', load))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flights.ado('key', load))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await waiter == 'value'
+        assert leader.cancelled()
+
+    asyncio.run(main())
+    assert calls == [1]
+    assert flights.stats()['in_flight'] == 0
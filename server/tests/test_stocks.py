@@ -0,0 +1,114 @@
+import json
+
+from stocks import WarehouseIndex, aggregate_sizes, parse_warehouses
+
+
+def size(name, product, stocks, basic=None):
+    return {
+        'name': name,
+        'origName': name,
+        'price': {'basic': basic or product, 'product': product},
+        'stocks': [
+            {'wh': wh, 'qty': qty, 'time1': time1, 'time2': time2}
+            for wh, qty, time1, time2 in stocks
+        ],
+    }
+
+
+def index_with(names):
+    index = WarehouseIndex(lambda: [{'id': key, 'name': name} for key, name in names.items()])
+    index.refresh()
+    return index
+
+
+def test_aggregate_sizes_sums_across_sizes_and_warehouses():
+    sizes = [
+        size('S', 150000, [(1, 3, 10, 5), (2, 1, 20, 20)], basic=200000),
+        size('M', 90000, [(1, 2, 4, 4)], basic=120000),
+        size('L', 0, []),
+    ]
+    summary = aggregate_sizes(sizes, index_with({1: 'Коледино', 2: 'Казань'}))
+
+    assert summary['quantity'] == 6
+    assert summary['basicPrice'] == 1200
+    assert summary['productPrice'] == 900
+    # Размер без цены не участвует в диапазоне цен
+    assert summary['price'] == {'min': 900, 'max': 1500}
+    assert summary['delivery'] == {'min': 8, 'max': 40}
+    assert [row['quantity'] for row in summary['sizes']] == [4, 2, 0]
+    assert [row['warehouses'] for row in summary['sizes']] == [2, 1, 0]
+
+    first, second = summary['warehouses']
+    assert first == {
+        'warehouse_id': 1, 'name': 'Коледино', 'quantity': 5, 'sizes': 2, 'time1': 4, 'time2': 4,
+    }
+    assert second['warehouse_id'] == 2
+    assert second['name'] == 'Казань'
+    assert second['quantity'] == 1
+
+
+def test_aggregate_sizes_without_sizes_or_index():
+    summary = aggregate_sizes(None)
+    assert summary['warehouses'] == []
+    assert summary['quantity'] == 0
+    assert summary['productPrice'] == 0
+    assert summary['price'] == {'min': None, 'max': None}
+    assert summary['delivery'] == {'min': None, 'max': None}
+
+    summary = aggregate_sizes([size('S', 100, [(7, 1, None, None)])])
+    assert summary['warehouses'][0]['name'] is None
+    assert summary['delivery'] == {'min': None, 'max': None}
+
+
+def test_parse_warehouses_skips_broken_items():
+    data = {'data': [
+        {'id': '1', 'name': 'Коледино'},
+        {'origid': 2, 'warehouse': 'Казань'},
+        {'id': 'x', 'name': 'Битый'},
+        {'id': 3},
+        'мусор',
+    ]}
+    assert parse_warehouses(data) == {1: 'Коледино', 2: 'Казань'}
+
+
+def test_failed_refresh_keeps_previous_names():
+    responses = [[{'id': 1, 'name': 'Коледино'}], RuntimeError('WB недоступен'), []]
+
+    def fetch():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    index = WarehouseIndex(fetch)
+    assert index.refresh() is True
+    assert index.refresh() is False
+    assert index.refresh() is False
+    assert index.names == {1: 'Коледино'}
+    assert index.stats()['refreshes'] == 1
+    assert index.stats()['errors'] == 2
+
+
+def test_index_is_restored_from_cache_file(tmp_path):
+    path = tmp_path / 'warehouses.json'
+    index = WarehouseIndex(lambda: [{'id': 1, 'name': 'Коледино'}], cache_path=str(path))
+    assert index.names == {}
+    index.refresh()
+    assert json.loads(path.read_text(encoding='utf-8')) == {'1': 'Коледино'}
+
+    def unavailable():
+        raise RuntimeError('WB недоступен')
+
+    restored = WarehouseIndex(unavailable, cache_path=str(path))
+    assert restored.names == {1: 'Коледино'}
+    assert restored.loaded_at is not None
+    assert restored.refresh() is False
+    assert restored.names == {1: 'Коледино'}
+
+
+def test_broken_cache_file_is_ignored(tmp_path):
+    path = tmp_path / 'warehouses.json'
+    path.write_text('{не json', encoding='utf-8')
+    index = WarehouseIndex(lambda: [], cache_path=str(path))
+    assert index.names == {}
+    assert index.loaded_at is None
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+
+from streams import ProductStreamHub, StreamLimitError, Subscriber, diff_product
+
+
+def make_hub(**kwargs):
+    return ProductStreamHub(lambda nm_id, dest: {'id': nm_id, 'productPrice': 100}, interval=60, heartbeat=0.01, **kwargs)
+
+
+def test_thread_streams_are_capped_per_process():
+    hub = make_hub(max_thread_streams=2)
+    first = hub.stream((1, -1))
+    hub.stream((2, -1))
+    with pytest.raises(StreamLimitError):
+        hub.stream((3, -1))
+    assert hub.stats()['thread_streams'] == 2
+
+    # Ответ закрыт до первого чтения - поток и подписка освобождаются
+    first.close()
+    first.close()
+    assert hub.stats()['thread_streams'] == 1
+    hub.stream((3, -1))
+    hub.stop()
+
+
+def test_async_streams_do_not_use_thread_slots():
+    async def main():
+        hub = make_hub(max_thread_streams=1)
+        hub.astream((1, -1))
+        hub.astream((2, -1))
+        hub.stream((3, -1))
+        assert hub.stats()['subscribers'] == 3
+        assert hub.stats()['thread_streams'] == 1
+        hub.stop()
+
+    asyncio.run(main())
+
+
+def test_snapshot_is_queued_before_later_events():
+    hub = make_hub()
+    hub.stream((1, -1))
+    poller = hub._pollers[(1, -1)]
+    for _ in range(100):
+        if poller.product is not None:
+            break
+        time.sleep(0.01)
+
+    locked = []
+
+    class RecordingSubscriber(Subscriber):
+        def put(self, message, resync):
+            # Под блокировкой хаба _publish не может вклиниться между снимком и очередью
+            locked.append(hub._lock.locked())
+            super().put(message, resync)
+
+    subscriber = hub.subscribe((1, -1), RecordingSubscriber(10))
+    assert locked == [True]
+    assert subscriber.get(0).startswith('id: 1\nevent: snapshot')
+    hub.stop()
+
+
+def test_diff_product_reports_changed_fields_and_warehouses():
+    old = {'productPrice': 100, 'warehouses': [{'warehouse_id': 1, 'quantity': 5}]}
+    new = {'productPrice': 90, 'warehouses': [{'warehouse_id': 2, 'quantity': 1}]}
+    changes = diff_product(old, new)
+    assert changes['fields'] == {'productPrice': 90}
+    assert changes['previous'] == {'productPrice': 100}
+    assert changes['warehouses'] == {'1': None, '2': 1}
+    assert diff_product(old, dict(old)) is None
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from conftest import sign_init_data
+from telegram_auth import InitDataError, InitDataVerifier
+
+
+BOT_TOKEN = '123456:TEST'
+
+
+def test_valid_init_data_is_parsed():
+    verified = InitDataVerifier(BOT_TOKEN).verify(sign_init_data(BOT_TOKEN, 42))
+    assert verified.user_id == 42
+    assert verified.user['first_name'] == 'Тест'
+
+
+@pytest.mark.parametrize('init_data, message', [
+    ('', 'Empty initData'),
+    ('auth_date=1&user=%7B%7D', 'Missing hash'),
+    (sign_init_data('999:OTHER', 42), 'Invalid signature'),
+    (sign_init_data(BOT_TOKEN, 42).replace('query_id=AAE', 'query_id=AAF'), 'Invalid signature'),
+])
+def test_invalid_init_data_is_rejected(init_data, message):
+    with pytest.raises(InitDataError, match=message):
+        InitDataVerifier(BOT_TOKEN).verify(init_data)
+
+
+def test_expired_init_data_is_rejected():
+    verifier = InitDataVerifier(BOT_TOKEN, max_age=3600)
+    with pytest.raises(InitDataError, match='expired'):
+        verifier.verify(sign_init_data(BOT_TOKEN, 42, auth_date=int(time.time()) - 7200))
+    # Без ограничения возраста старая initData принимается
+    assert InitDataVerifier(BOT_TOKEN, max_age=0).verify(sign_init_data(BOT_TOKEN, 42, auth_date=1)).user_id == 42
+
+
+def test_replay_protection_accepts_init_data_once():
+    verifier = InitDataVerifier(BOT_TOKEN, replay_protection=True)
+    init_data = sign_init_data(BOT_TOKEN, 42)
+    verifier.verify(init_data)
+    # Заголовок с каждым запросом API проверяется без учета повторов
+    verifier.verify(init_data, check_replay=False)
+    with pytest.raises(InitDataError, match='already used'):
+        verifier.verify(init_data)
@@ -0,0 +1,13 @@
+from conftest import STUB_URL
+from upstream import UpstreamClient
+
+
+def test_full_urls_to_several_hosts_keep_their_connections(wb_stub):
+    # Фото WB идут на разные корзины полным адресом - пул на каждый хост
+    other_host_url = STUB_URL.replace('127.0.0.1', 'localhost')
+    client = UpstreamClient()
+    client.register('images', STUB_URL, timeout=2, pool_connections=2)
+    for _ in range(3):
+        for base_url in (STUB_URL, other_host_url):
+            assert client.get('images', f'{base_url}/vol0/photo.webp').status_code == 200
+    assert client.stats()['images']['connections_opened'] == 2
@@ -0,0 +1,97 @@
+import threading
+
+from user_store import UserStore
+
+
+def make_store(path, **kwargs):
+    return UserStore(str(path), sync_interval=0, **kwargs)
+
+
+def test_upsert_and_get(tmp_path):
+    store = make_store(tmp_path / 'users.db')
+    store.upsert(42, 'alice', 'Алиса', role='admin')
+    assert store.get(42)['role'] == 'admin'
+    # id из initData и из JSON приходит и строкой
+    assert store.get('42')['username'] == 'alice'
+    assert store.get('x') is None and store.get(None) is None and store.get(7) is None
+    store.upsert(42, 'alice', 'Алиса')
+    assert store.get(42)['role'] == 'user'
+    assert len(store) == 1
+
+
+def test_seed_fills_only_empty_database(tmp_path):
+    store = make_store(tmp_path / 'users.db')
+    store.seed({1: {'username': 'a', 'name': 'A', 'role': 'admin'}})
+    store.seed({2: {'username': 'b', 'name': 'B'}})
+    assert store.get(1)['role'] == 'admin'
+    assert store.get(2) is None
+
+
+def test_list_filters_and_pages(tmp_path):
+    store = make_store(tmp_path / 'users.db')
+    for user_id, username in [(3, 'carol'), (1, 'alice'), (2, 'bob')]:
+        store.upsert(user_id, username, username.title(), role='admin' if user_id == 2 else 'user')
+
+    users, total = store.list(limit=2)
+    assert total == 3
+    assert [user_id for user_id, _ in users] == [1, 2]
+    users, total = store.list(offset=2, limit=2)
+    assert [user_id for user_id, _ in users] == [3]
+
+    assert [user_id for user_id, _ in store.list(role='admin')[0]] == [2]
+    assert [user_id for user_id, _ in store.list(query='car')[0]] == [3]
+    assert store.list(query='3')[1] == 1
+
+
+def test_sync_picks_up_changes_of_other_processes(tmp_path):
+    changed = []
+    store = make_store(tmp_path / 'users.db', on_change=changed.append)
+    other = make_store(tmp_path / 'users.db')
+    store.upsert(1, 'a', 'A')
+    other.upsert(2, 'b', 'B', role='admin')
+    other.upsert(1, 'a', 'A', role='admin')
+
+    assert store.get(2) is None
+    assert store.sync() == {1, 2}
+    assert store.get(1)['role'] == 'admin' and store.get(2)['role'] == 'admin'
+    assert changed == [{1, 2}]
+    assert store.version == 3
+    assert store.sync() == set()
+    # Чужая запись между своими: версия догоняется только через журнал
+    assert other.version == 0
+    assert other.sync() == {1, 2} and other.version == 3
+
+
+def test_sync_respects_interval(tmp_path):
+    store = UserStore(str(tmp_path / 'users.db'), sync_interval=60)
+    make_store(tmp_path / 'users.db').upsert(1, 'a', 'A')
+    assert not store.sync_due
+    assert store.sync() == set()
+    assert store.sync(force=True) == {1}
+
+
+def test_concurrent_writers_share_the_database(tmp_path):
+    path = tmp_path / 'users.db'
+    make_store(path)
+    errors = []
+
+    def writer(first):
+        # Свой UserStore - как отдельный воркер gunicorn
+        store = make_store(path)
+        try:
+            for user_id in range(first, first + 25):
+                store.upsert(user_id, f'user{user_id}', None)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(i * 100,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    store = make_store(path)
+    assert len(store) == 100
+    assert store.version == 100
+    assert store._connect().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
@@ -0,0 +1,114 @@
+import watchlist
+
+
+def test_admin_watchlist_requires_admin_init_data(backend):
+    client = backend.app.test_client()
+    assert client.get('/api/admin/watchlist').status_code == 403
+    response = client.post('/api/admin/watchlist', json={'nmIds': [1]}, headers={'X-Telegram-Init-Data': 'user=1&hash=x'})
+    assert response.status_code == 403
+    assert backend.watchlist.store.list()[1] == 0
+
+
+def test_poll_does_not_fill_product_cache(backend, wb_stub):
+    backend.watchlist.poll([31, 32, 33], backend.products.default_dest)
+    assert len(backend.product_cache) == 0
+    assert backend.watchlist.polled == 3
+
+
+class FakeProducts:
+    """ProductService для планировщика: карточки задаются тестом, проекция - сама карточка"""
+
+    def __init__(self):
+        self.cards = {}
+
+    def refresh_cards(self, nm_ids, dest):
+        return {nm_id: self.cards.get(nm_id) for nm_id in nm_ids}
+
+    def project(self, name, card):
+        return card
+
+
+def product(price, **warehouses):
+    return {
+        'basicPrice': price * 2,
+        'productPrice': price,
+        'warehouses': [{'warehouse_id': int(w[1:]), 'quantity': q} for w, q in warehouses.items()],
+    }
+
+
+def test_poll_records_only_changes(tmp_path, monkeypatch):
+    now = [1_700_000_000]
+    monkeypatch.setattr(watchlist.time, 'time', lambda: now[0])
+    store = watchlist.WatchlistStore(str(tmp_path / 'watchlist.db'))
+    products = FakeProducts()
+    scheduler = watchlist.WatchlistScheduler(store, products)
+    key = (1, -1)
+
+    def poll(scheduler=scheduler):
+        now[0] += 600
+        scheduler.poll([1], -1)
+
+    products.cards[1] = product(100, w507=5, w117=2)
+    poll()
+    poll()
+    assert store.counts()['price_points'] == 1
+    assert store.counts()['stock_points'] == 2
+
+    # Цена прежняя, один склад изменился, другой опустел
+    products.cards[1] = product(100, w507=4)
+    poll()
+    assert store.counts()['price_points'] == 1
+    assert store.counts()['stock_points'] == 4
+    assert store.last_state(key)[1] == {507: 4, 117: 0}
+
+    # Новый планировщик (перезапуск) продолжает с последнего состояния из базы
+    poll(watchlist.WatchlistScheduler(store, products))
+    assert store.counts()['stock_points'] == 4
+    products.cards[1] = product(90, w507=4)
+    poll()
+    assert store.counts()['price_points'] == 2
+
+
+def test_readded_key_starts_from_stored_state(tmp_path, monkeypatch):
+    now = [1_700_000_000]
+    monkeypatch.setattr(watchlist.time, 'time', lambda: now[0])
+    store = watchlist.WatchlistStore(str(tmp_path / 'watchlist.db'))
+    products = FakeProducts()
+    products.cards[1] = product(100, w507=5)
+    scheduler = watchlist.WatchlistScheduler(store, products)
+
+    def cycle():
+        now[0] += 600
+        scheduler._queue.clear()
+        scheduler._plan(now[0])
+        scheduler.poll([1], -1)
+
+    store.add([(1, -1)])
+    cycle()
+    assert store.counts()['price_points'] == 1
+    # Другой процесс убирает товар вместе с историей и добавляет снова
+    other = watchlist.WatchlistStore(str(tmp_path / 'watchlist.db'))
+    other.remove([(1, -1)], keep_history=False)
+    now[0] += 1
+    other.add([(1, -1)])
+    cycle()
+    assert store.counts()['price_points'] == 1
+    assert store.counts()['stock_points'] == 1
+
+
+def test_downsample_keeps_extremes_per_bucket():
+    rows = [(ts, 100 + (ts % 7) * 10, 500) for ts in range(0, 100)]
+    series, step = watchlist.downsample((-5, 90, 500), rows, 0, 100, 10, ('productPrice', 'basicPrice'))
+    assert step == 10
+    # Значение на начало периода и по точке на интервал
+    assert series[0] == {'t': 0, 'productPrice': 90, 'basicPrice': 500}
+    assert len(series) == 11
+    bucket = series[1]
+    assert bucket['t'] == 9
+    assert bucket['productPriceMin'] == 100 and bucket['productPriceMax'] == 160
+
+
+def test_downsample_returns_short_series_as_is():
+    series, step = watchlist.downsample(None, [(1, 5), (2, 6)], 0, 10, 10, ('quantity',))
+    assert step is None
+    assert series == [{'t': 1, 'quantity': 5}, {'t': 2, 'quantity': 6}]
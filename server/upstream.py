@@ -0,0 +1,439 @@
+"""
+Общий HTTP-клиент для всех запросов к внешним API (Wildberries, локальный API).
+
+Для каждого хоста держится свой requests.Session с пулом keep-alive соединений,
+своими таймаутами и повторами с экспоненциальной задержкой для идемпотентных GET.
+Статистика пула (открыто/переиспользовано соединений, ожидания) доступна через
+UpstreamClient.stats().
+
+Каждый хост защищен своим circuit breaker (breaker.py): когда API падает или
+отвечает слишком медленно, запросы к нему сразу завершаются CircuitOpenError,
+не занимая поток на время таймаута. Хосту можно задать RateLimiter
+(ratelimit.py) - запросы сверх лимита ждут токен или завершаются RateLimited.
+
+Таймауты, ожидание токена и повторы ограничены сроком текущего запроса к
+сервису (deadline.py): запрос к API без остатка бюджета не выполняется, а
+таймаут, сокращенный сроком, завершается DeadlineExceeded и не считается
+отказом API в breaker.
+
+AsyncUpstreamClient - неблокирующий вариант на httpx для ASGI-режима, с теми же
+настройками хостов и общими счетчиками.
+"""
+import asyncio
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ResponseError, TimeoutError as Urllib3Timeout
+from urllib3.util.retry import Retry
+
+import deadline
+from breaker import CircuitBreaker
+
+try:
+    import httpx
+except ImportError:  # Нужен только для ASGI-режима
+    httpx = None
+
+
+DEFAULT_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 20))
+DEFAULT_POOL_BLOCK = os.environ.get('UPSTREAM_POOL_BLOCK', '0') == '1'
+DEFAULT_POOL_TIMEOUT = float(os.environ.get('UPSTREAM_POOL_TIMEOUT', 5))
+DEFAULT_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', 2))
+DEFAULT_BACKOFF = float(os.environ.get('UPSTREAM_BACKOFF', 0.3))
+ASYNC_POOL_SIZE = int(os.environ.get('UPSTREAM_ASYNC_POOL_SIZE', 200))
+
+# Настройки circuit breaker по умолчанию (для каждого хоста можно переопределить)
+BREAKER_DEFAULTS = {
+    'window': int(os.environ.get('BREAKER_WINDOW', 20)),
+    'min_calls': int(os.environ.get('BREAKER_MIN_CALLS', 10)),
+    'error_rate': float(os.environ.get('BREAKER_ERROR_RATE', 0.5)),
+    'slow_call_duration': float(os.environ.get('BREAKER_SLOW_CALL', 5)),
+    'slow_call_rate': float(os.environ.get('BREAKER_SLOW_RATE', 0.8)),
+    'open_timeout': float(os.environ.get('BREAKER_OPEN_TIMEOUT', 30)),
+    'half_open_probes': int(os.environ.get('BREAKER_HALF_OPEN_PROBES', 3)),
+}
+
+# 429 не повторяется автоматически: каждый запрос к WB проходит через лимитер
+# и breaker хоста, а повтор внутри Retry обошел бы их
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def is_upstream_failure(response):
+    """Ответ, который считается отказом API для circuit breaker"""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def is_timeout(error):
+    """Таймаут запроса: requests/httpx или таймаут urllib3 после исчерпанных повторов"""
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    if httpx is not None and isinstance(error, httpx.TimeoutException):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    # NewConnectionError наследует ConnectTimeoutError, но это отказ подключения
+    return isinstance(reason, Urllib3Timeout) and not isinstance(reason, NewConnectionError)
+
+
+class PoolStats:
+    """Счетчики пула соединений одного хоста"""
+
+    def __init__(self, pool_timeout):
+        self.pool_timeout = pool_timeout
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+        self.checkouts = 0
+        self.in_use = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.retries = 0
+
+    def incr(self, field, value=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + value)
+
+    def checkout(self, waited, wait_time):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            if waited:
+                self.waits += 1
+                self.wait_time += wait_time
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'connections_opened': self.opened,
+                'connections_reused': max(self.checkouts - self.opened, 0),
+                'connections_in_use': self.in_use,
+                'pool_waits': self.waits,
+                'pool_wait_ms': round(self.wait_time * 1000, 1),
+                'retries': self.retries,
+            }
+
+
+class _CountingPoolMixin:
+    """Подсчитывает новые/переиспользованные соединения и ожидания свободного"""
+
+    stats = None
+
+    def _new_conn(self):
+        self.stats.incr('opened')
+        return super()._new_conn()
+
+    def _get_conn(self, timeout=None):
+        if timeout is None:
+            timeout = self.stats.pool_timeout
+        # Пустая очередь - все соединения заняты, придется ждать или открывать лишнее
+        waited = self.pool is not None and self.pool.empty()
+        started = time.monotonic()
+        conn = super()._get_conn(timeout=timeout)
+        self.stats.checkout(waited, time.monotonic() - started)
+        return conn
+
+    def _put_conn(self, conn):
+        self.stats.incr('in_use', -1)
+        super()._put_conn(conn)
+
+
+class _CountingRetry(Retry):
+    stats = None
+    # Retry сам повторяет ответы с Retry-After из этого списка, даже вне status_forcelist
+    RETRY_AFTER_STATUS_CODES = frozenset({503})
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        self.stats.incr('retries')
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        # Пауза перед повтором: Retry-After ответа (так его выдержит Retry.sleep) или backoff
+        delay = retry.get_backoff_time()
+        if response is not None and retry.respect_retry_after_header:
+            delay = retry.get_retry_after(response) or delay
+        # Пауза и следующая попытка не укладываются в срок запроса - повторов больше нет,
+        # как у исчерпанного Retry: requests превратит ошибку в ConnectionError/Timeout,
+        # а для статуса urllib3 вернет последний ответ
+        if not deadline.allows(delay):
+            raise MaxRetryError(_pool, url, error or ResponseError('deadline'))
+        return retry
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter, создающий пулы соединений со счетчиками"""
+
+    def __init__(self, stats, **kwargs):
+        self._pool_classes = {
+            'http': type('HTTPConnectionPool', (_CountingPoolMixin, HTTPConnectionPool), {'stats': stats}),
+            'https': type('HTTPSConnectionPool', (_CountingPoolMixin, HTTPSConnectionPool), {'stats': stats}),
+        }
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class UpstreamHost:
+    """Настройки и сессия одного внешнего API"""
+
+    def __init__(self, name, base_url, timeout, verify=True, headers=None,
+                 pool_size=DEFAULT_POOL_SIZE, pool_block=DEFAULT_POOL_BLOCK,
+                 pool_timeout=DEFAULT_POOL_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, breaker=None, limiter=None, pool_connections=1):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.verify = verify
+        self.headers = dict(headers or {})
+        self.pool_size = pool_size
+        # Сколько разных хостов держат пулы keep-alive: больше 1, если запросы
+        # идут полными адресами на несколько хостов (корзины фото WB)
+        self.pool_connections = pool_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = PoolStats(pool_timeout)
+        # Наблюдатели запросов (метрики): upstream_started(name), upstream_finished(name, ...)
+        self.observers = []
+        # breaker=False отключает circuit breaker, dict - переопределяет настройки
+        self.breaker = None if breaker is False else CircuitBreaker(
+            name, **{**BREAKER_DEFAULTS, **(breaker or {})}
+        )
+        self.limiter = limiter
+
+        retry_class = type('Retry', (_CountingRetry,), {'stats': self.stats})
+        retry = retry_class(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        adapter = _PooledAdapter(
+            self.stats,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_size,
+            pool_block=pool_block,
+            max_retries=retry,
+        )
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        if headers:
+            self.session.headers.update(headers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def url(self, path):
+        if path.startswith(('http://', 'https://')):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def before_call(self):
+        """
+        Токен лимита и разрешение breaker на запрос; RateLimited или
+        CircuitOpenError, если запрос выполнять нельзя
+        """
+        if self.limiter is not None:
+            started = time.monotonic()
+            self.limiter.acquire()
+            self._record_wait(started)
+        self._admit()
+
+    async def abefore_call(self):
+        """before_call для event loop: ожидание токена не блокирует поток"""
+        if self.limiter is not None:
+            started = time.monotonic()
+            await self.limiter.aacquire()
+            self._record_wait(started)
+        self._admit()
+
+    def _record_wait(self, started):
+        waited = time.monotonic() - started
+        if waited >= 0.001:
+            deadline.record_stage(f'{self.name}_wait', waited)
+
+    def _admit(self):
+        if self.breaker is not None:
+            self.breaker.before_call()
+        for observer in self.observers:
+            observer.upstream_started(self.name)
+
+    def after_call(self, started, response=None, error=None, neutral=False):
+        """neutral - исход не говорит о здоровье API (отмена, срок клиента)"""
+        duration = time.monotonic() - started
+        for observer in self.observers:
+            observer.upstream_finished(self.name, duration, response, error)
+        if self.breaker is None:
+            return
+        if error is None and response is not None and is_upstream_failure(response):
+            error = f'HTTP {response.status_code}'
+        self.breaker.after_call(duration, error, neutral=neutral)
+
+
+class UpstreamClient:
+    """Реестр внешних API с общими пулами соединений"""
+
+    def __init__(self):
+        self.hosts = {}
+        self.observers = []
+
+    def register(self, name, base_url, timeout, **kwargs):
+        host = UpstreamHost(name, base_url, timeout, **kwargs)
+        host.observers = self.observers
+        self.hosts[name] = host
+        return host
+
+    def add_observer(self, observer):
+        """Наблюдатель всех запросов к внешним API (например, метрики)"""
+        self.observers.append(observer)
+
+    def get(self, name, path, **kwargs):
+        """
+        GET-запрос к зарегистрированному API. path может быть относительным
+        (к base_url хоста) или полным URL. Исключения - как у requests;
+        CircuitOpenError - если breaker хоста разомкнут (запрос не выполнялся),
+        RateLimited - если не дождался токена лимита запросов,
+        DeadlineExceeded - если не хватило срока запроса к сервису.
+        """
+        host = self.hosts[name]
+        timeout = kwargs.get('timeout', host.timeout)
+        # Без остатка бюджета запроса не берем ни токен лимита, ни слот breaker
+        deadline.budget_timeout(name, timeout)
+        host.before_call()
+        try:
+            kwargs['timeout'] = deadline.budget_timeout(name, timeout)
+        except deadline.DeadlineExceeded:
+            host.after_call(time.monotonic(), neutral=True)
+            raise
+        capped = kwargs['timeout'] != timeout
+        host.stats.incr('requests')
+        started = time.monotonic()
+        try:
+            response = host.session.get(host.url(path), **kwargs)
+        except Exception as e:
+            # Таймаут сокращен сроком клиента и срок вышел - API тут ни при чем
+            if capped and is_timeout(e) and deadline.expired():
+                host.after_call(started, error=e, neutral=True)
+                raise deadline.exceeded(name) from e
+            host.after_call(started, error=e)
+            raise
+        host.after_call(started, response)
+        return response
+
+    def stats(self):
+        return {
+            name: {
+                'base_url': host.base_url,
+                'pool_size': host.pool_size,
+                'pool_connections': host.pool_connections,
+                'timeout': host.timeout,
+                **host.stats.snapshot(),
+                'breaker': self.breaker_state(name),
+                'rate_limit': host.limiter.snapshot() if host.limiter is not None else None,
+            }
+            for name, host in self.hosts.items()
+        }
+
+    def breaker_state(self, name):
+        breaker = self.hosts[name].breaker
+        return breaker.snapshot() if breaker is not None else None
+
+    def close(self):
+        for host in self.hosts.values():
+            host.session.close()
+
+
+class AsyncUpstreamClient:
+    """
+    Неблокирующий клиент на httpx с настройками хостов из UpstreamClient.
+    Клиенты httpx создаются лениво внутри работающего event loop.
+    """
+
+    def __init__(self, client, pool_size=ASYNC_POOL_SIZE):
+        if httpx is None:
+            raise RuntimeError('Для ASGI-режима нужен пакет httpx')
+        self.client = client
+        self.pool_size = pool_size
+        self._sessions = {}
+
+    def _session(self, host):
+        session = self._sessions.get(host.name)
+        if session is None:
+            session = httpx.AsyncClient(
+                timeout=host.timeout,
+                verify=host.verify,
+                headers=host.headers,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size
+                ),
+            )
+            self._sessions[host.name] = session
+        return session
+
+    async def get(self, name, path, stream=False, **kwargs):
+        """
+        GET с повторами при сетевых ошибках и статусах RETRY_STATUSES.
+        Исключения - как у httpx; CircuitOpenError - если breaker хоста
+        разомкнут, DeadlineExceeded - если не хватило срока запроса к сервису.
+        Breaker общий с синхронным клиентом.
+        stream=True - тело не читается заранее, ответ нужно закрыть (aclose).
+        """
+        host = self.client.hosts[name]
+        session = self._session(host)
+        deadline.budget_timeout(name, kwargs.get('timeout', host.timeout))
+        await host.abefore_call()
+        host.stats.incr('requests')
+        started = time.monotonic()
+        try:
+            response = await self._get(host, session, host.url(path), stream, **kwargs)
+        except deadline.DeadlineExceeded:
+            host.after_call(started, neutral=True)
+            raise
+        except Exception as e:
+            # Каждая попытка ограничена остатком срока: таймаут при истекшем сроке - его исход
+            if is_timeout(e) and deadline.expired():
+                host.after_call(started, error=e, neutral=True)
+                raise deadline.exceeded(name) from e
+            host.after_call(started, error=e)
+            raise
+        except BaseException:
+            # Отмена (клиент ушел, истек срок) - не отказ API, но слот пробы освобождаем
+            host.after_call(started, neutral=True)
+            raise
+        host.after_call(started, response)
+        return response
+
+    async def _get(self, host, session, url, stream, **kwargs):
+        timeout = kwargs.pop('timeout', host.timeout)
+        for attempt in range(host.retries + 1):
+            # Каждая попытка - в пределах остатка срока запроса
+            kwargs['timeout'] = deadline.budget_timeout(host.name, timeout)
+            try:
+                if stream:
+                    response = await session.send(session.build_request('GET', url, **kwargs), stream=True)
+                else:
+                    response = await session.get(url, **kwargs)
+            except httpx.TransportError:
+                if attempt >= host.retries or not deadline.allows(host.backoff * (2 ** attempt)):
+                    raise
+            else:
+                if (response.status_code not in RETRY_STATUSES or attempt >= host.retries
+                        or not deadline.allows(host.backoff * (2 ** attempt))):
+                    return response
+                if stream:
+                    await response.aclose()
+            host.stats.incr('retries')
+            await asyncio.sleep(host.backoff * (2 ** attempt))
+
+    async def aclose(self):
+        for session in self._sessions.values():
+            await session.aclose()
+        self._sessions.clear()
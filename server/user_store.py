@@ -0,0 +1,180 @@
+"""
+Белый список пользователей в SQLite с индексом в памяти.
+
+Проверка доступа читает только словарь в памяти (O(1)). Каждое изменение
+пишется вместе со строкой в журнал changes; номер последней строки - версия
+списка. Воркеры дешево сверяют версию (MAX по первичному ключу журнала) и
+подгружают только измененных пользователей, сообщая их id через on_change -
+чтобы сбросить для них кеш доступа.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+class UserStore:
+    def __init__(self, path, on_change=None, sync_interval=1.0):
+        self.path = path
+        self.on_change = on_change
+        self.sync_interval = sync_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._index = {}
+        self._version = 0
+        self._synced_at = 0.0
+
+        conn = self._connect()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                name TEXT,
+                role TEXT NOT NULL DEFAULT 'user',
+                added_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS users_role ON users (role);
+            CREATE TABLE IF NOT EXISTS changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                changed_at REAL NOT NULL
+            );
+        ''')
+        self._load()
+
+    def _connect(self):
+        # Соединение на поток; после fork открываем заново
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _info(row):
+        info = {'username': row['username'], 'name': row['name'], 'role': row['role']}
+        if row['added_at']:
+            info['added_at'] = row['added_at']
+        return info
+
+    def _load(self):
+        conn = self._connect()
+        with self._lock:
+            self._index = {row['user_id']: self._info(row) for row in conn.execute('SELECT * FROM users')}
+            self._version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM changes').fetchone()[0]
+            self._synced_at = time.monotonic()
+
+    def seed(self, users):
+        """Заполняет пустую базу начальным списком"""
+        conn = self._connect()
+        if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]:
+            return
+        for user_id, info in users.items():
+            self.upsert(user_id, info.get('username'), info.get('name'), info.get('role', 'user'), info.get('added_at'))
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def sync_due(self):
+        """Пора подтянуть изменения: sync() пойдет в SQLite"""
+        return time.monotonic() - self._synced_at >= self.sync_interval
+
+    def sync(self, force=False):
+        """
+        Подтягивает изменения других процессов (не чаще раза в sync_interval).
+        Возвращает множество id измененных пользователей.
+        """
+        now = time.monotonic()
+        if not force and now - self._synced_at < self.sync_interval:
+            return set()
+        self._synced_at = now
+
+        conn = self._connect()
+        latest = conn.execute('SELECT COALESCE(MAX(version), 0) FROM changes').fetchone()[0]
+        if latest <= self._version:
+            return set()
+
+        rows = conn.execute(
+            'SELECT version, user_id FROM changes WHERE version > ? ORDER BY version', (self._version,)
+        ).fetchall()
+        if not rows:
+            return set()
+
+        changed = {row['user_id'] for row in rows}
+        placeholders = ','.join('?' * len(changed))
+        found = {
+            row['user_id']: self._info(row)
+            for row in conn.execute(f'SELECT * FROM users WHERE user_id IN ({placeholders})', tuple(changed))
+        }
+        with self._lock:
+            for user_id in changed:
+                if user_id in found:
+                    self._index[user_id] = found[user_id]
+                else:
+                    self._index.pop(user_id, None)
+            self._version = max(self._version, rows[-1]['version'])
+
+        if self.on_change:
+            self.on_change(changed)
+        return changed
+
+    def get(self, user_id):
+        try:
+            return self._index.get(int(user_id))
+        except (TypeError, ValueError):
+            return None
+
+    def upsert(self, user_id, username, name, role='user', added_at=None):
+        user_id = int(user_id)
+        added_at = added_at or datetime.now().isoformat()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO users (user_id, username, name, role, added_at) VALUES (?, ?, ?, ?, ?)',
+                (user_id, username, name, role, added_at)
+            )
+            version = conn.execute(
+                'INSERT INTO changes (user_id, changed_at) VALUES (?, ?)', (user_id, time.time())
+            ).lastrowid
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        info = {'username': username, 'name': name, 'role': role, 'added_at': added_at}
+        with self._lock:
+            self._index[user_id] = info
+            # Изменения других процессов до нашего подтянет sync() по журналу
+            if version == self._version + 1:
+                self._version = version
+        return info
+
+    def list(self, offset=0, limit=100, role=None, query=None):
+        """Страница пользователей по возрастанию id и общее число подходящих"""
+        where = []
+        params = []
+        if role:
+            where.append('role = ?')
+            params.append(role)
+        if query:
+            where.append('(username LIKE ? OR name LIKE ? OR CAST(user_id AS TEXT) LIKE ?)')
+            params.extend([f'%{query}%'] * 3)
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ''
+
+        conn = self._connect()
+        total = conn.execute(f'SELECT COUNT(*) FROM users {where_sql}', params).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT * FROM users {where_sql} ORDER BY user_id LIMIT ? OFFSET ?', params + [limit, offset]
+        ).fetchall()
+        return [(row['user_id'], self._info(row)) for row in rows], total
+
+    def __len__(self):
+        return len(self._index)
@@ -0,0 +1,468 @@
+"""
+Отслеживание цен и остатков товаров WB (watchlist) с историей в SQLite.
+
+Планировщик обходит отслеживаемые товары пачками (один запрос к WB на пачку)
+и равномерно распределяет пачки по интервалу, чтобы не создавать всплесков
+запросов. В историю пишутся только изменения: цены basicPrice и productPrice
+проекции 'wb' и количество на каждом складе. Скидка не хранится - она
+вычисляется из цен при чтении. Таблицы WITHOUT ROWID с первичным ключом
+(nmId, dest, ..., ts): запись дописывает в конец индекса, чтение диапазона -
+один проход по индексу; точка занимает около 20 байт.
+
+Несколько процессов (воркеры gunicorn) делят одну базу; опрашивает только
+владелец аренды в таблице leases, остальные ждут ее освобождения.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import requests
+
+from breaker import CircuitOpenError
+from log import get_logger
+from products import WBApiError
+from ratelimit import RateLimited
+
+
+log = get_logger(__name__)
+
+
+def discount_percent(basic, product):
+    return round((1 - product / basic) * 100, 1) if basic and basic > 0 else 0
+
+
+class WatchlistStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS watchlist (
+                nm_id INTEGER NOT NULL,
+                dest INTEGER NOT NULL,
+                added_at INTEGER NOT NULL,
+                PRIMARY KEY (nm_id, dest)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS price_points (
+                nm_id INTEGER NOT NULL,
+                dest INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                basic INTEGER NOT NULL,
+                product INTEGER NOT NULL,
+                PRIMARY KEY (nm_id, dest, ts)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS stock_points (
+                nm_id INTEGER NOT NULL,
+                dest INTEGER NOT NULL,
+                warehouse_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                PRIMARY KEY (nm_id, dest, warehouse_id, ts)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        ''')
+
+    def _connect(self):
+        # Соединение на поток; после fork открываем заново
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, fn):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    # Список отслеживаемых
+
+    def add(self, keys, limit=None):
+        """Добавляет (nmId, dest); возвращает число новых. ValueError, если превышен limit"""
+        now = int(time.time())
+
+        def add(conn):
+            before = conn.execute('SELECT COUNT(*) FROM watchlist').fetchone()[0]
+            conn.executemany('INSERT OR IGNORE INTO watchlist (nm_id, dest, added_at) VALUES (?, ?, ?)',
+                             [(nm_id, dest, now) for nm_id, dest in keys])
+            after = conn.execute('SELECT COUNT(*) FROM watchlist').fetchone()[0]
+            if limit is not None and after > limit:
+                raise ValueError(f'Нельзя отслеживать больше {limit} товаров')
+            return after - before
+
+        return self._write(add)
+
+    def remove(self, keys, keep_history=True):
+        """Убирает (nmId, dest) из списка; keep_history=False удаляет и историю"""
+        def remove(conn):
+            removed = 0
+            for key in keys:
+                removed += conn.execute('DELETE FROM watchlist WHERE nm_id = ? AND dest = ?', key).rowcount
+                if not keep_history:
+                    conn.execute('DELETE FROM price_points WHERE nm_id = ? AND dest = ?', key)
+                    conn.execute('DELETE FROM stock_points WHERE nm_id = ? AND dest = ?', key)
+            return removed
+
+        return self._write(remove)
+
+    def watched(self):
+        """[(nmId, dest, added_at)] по регионам и возрастанию nmId"""
+        return self._connect().execute('SELECT nm_id, dest, added_at FROM watchlist ORDER BY dest, nm_id').fetchall()
+
+    def list(self, offset=0, limit=100):
+        conn = self._connect()
+        total = conn.execute('SELECT COUNT(*) FROM watchlist').fetchone()[0]
+        rows = conn.execute(
+            'SELECT nm_id, dest, added_at FROM watchlist ORDER BY nm_id, dest LIMIT ? OFFSET ?', (limit, offset)
+        ).fetchall()
+        return [{'nmId': nm_id, 'dest': dest, 'added_at': added_at} for nm_id, dest, added_at in rows], total
+
+    # История
+
+    def last_state(self, key):
+        """Последние записанные (basic, product) и {склад: количество} товара"""
+        conn = self._connect()
+        price = conn.execute(
+            'SELECT basic, product FROM price_points WHERE nm_id = ? AND dest = ? ORDER BY ts DESC LIMIT 1', key
+        ).fetchone()
+        # Голый столбец при единственном MAX() берется из строки с максимумом (SQLite)
+        stocks = conn.execute(
+            'SELECT warehouse_id, quantity, MAX(ts) FROM stock_points WHERE nm_id = ? AND dest = ? GROUP BY warehouse_id',
+            key
+        ).fetchall()
+        return (tuple(price) if price else None), {warehouse: quantity for warehouse, quantity, _ in stocks}
+
+    def append(self, prices, stocks):
+        """
+        Дописывает точки истории одной транзакцией: prices - [(nmId, dest, ts,
+        basic, product)], stocks - [(nmId, dest, склад, ts, количество)]
+        """
+        def append(conn):
+            conn.executemany('INSERT OR REPLACE INTO price_points VALUES (?, ?, ?, ?, ?)', prices)
+            conn.executemany('INSERT OR REPLACE INTO stock_points VALUES (?, ?, ?, ?, ?)', stocks)
+
+        if prices or stocks:
+            self._write(append)
+
+    def prune(self, before):
+        """Удаляет точки старше before, оставляя последнюю точку каждого ряда (состояние на начало)"""
+        def prune(conn):
+            removed = conn.execute('''
+                DELETE FROM price_points WHERE ts < ? AND ts < (
+                    SELECT MAX(ts) FROM price_points p
+                    WHERE p.nm_id = price_points.nm_id AND p.dest = price_points.dest AND p.ts < ?
+                )
+            ''', (before, before)).rowcount
+            removed += conn.execute('''
+                DELETE FROM stock_points WHERE ts < ? AND ts < (
+                    SELECT MAX(ts) FROM stock_points s
+                    WHERE s.nm_id = stock_points.nm_id AND s.dest = stock_points.dest
+                      AND s.warehouse_id = stock_points.warehouse_id AND s.ts < ?
+                )
+            ''', (before, before)).rowcount
+            return removed
+
+        return self._write(prune)
+
+    def price_series(self, key, start, end):
+        """Точки цены в [start, end] и последняя точка до start (значение на начало периода)"""
+        conn = self._connect()
+        nm_id, dest = key
+        before = conn.execute(
+            'SELECT ts, product, basic FROM price_points WHERE nm_id = ? AND dest = ? AND ts < ? ORDER BY ts DESC LIMIT 1',
+            (nm_id, dest, start)
+        ).fetchone()
+        rows = conn.execute(
+            'SELECT ts, product, basic FROM price_points WHERE nm_id = ? AND dest = ? AND ts BETWEEN ? AND ? ORDER BY ts',
+            (nm_id, dest, start, end)
+        ).fetchall()
+        return before, rows
+
+    def stock_series(self, key, start, end):
+        """{склад: (точка до start или None, точки в [start, end])}"""
+        conn = self._connect()
+        nm_id, dest = key
+        series = {}
+        for warehouse, ts, quantity, _ in conn.execute(
+            'SELECT warehouse_id, ts, quantity, MAX(ts) FROM stock_points '
+            'WHERE nm_id = ? AND dest = ? AND ts < ? GROUP BY warehouse_id',
+            (nm_id, dest, start)
+        ):
+            series[warehouse] = ((ts, quantity), [])
+        for warehouse, ts, quantity in conn.execute(
+            'SELECT warehouse_id, ts, quantity FROM stock_points '
+            'WHERE nm_id = ? AND dest = ? AND ts BETWEEN ? AND ? ORDER BY warehouse_id, ts',
+            (nm_id, dest, start, end)
+        ):
+            series.setdefault(warehouse, (None, []))[1].append((ts, quantity))
+        return series
+
+    def counts(self):
+        conn = self._connect()
+        return {
+            'watched': conn.execute('SELECT COUNT(*) FROM watchlist').fetchone()[0],
+            'price_points': conn.execute('SELECT COUNT(*) FROM price_points').fetchone()[0],
+            'stock_points': conn.execute('SELECT COUNT(*) FROM stock_points').fetchone()[0],
+        }
+
+    # Аренда планировщика
+
+    def acquire_lease(self, name, owner, ttl):
+        """Продлевает или захватывает аренду; True - owner ее владелец на ttl секунд"""
+        now = time.time()
+
+        def acquire(conn):
+            row = conn.execute('SELECT owner, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            conn.execute('INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)',
+                         (name, owner, now + ttl))
+            return True
+
+        return self._write(acquire)
+
+    def release_lease(self, name, owner):
+        self._write(lambda conn: conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner)))
+
+
+def downsample(before, rows, start, end, points, value_fields):
+    """
+    Ступенчатый ряд в не более чем points точек: первая точка - значение на
+    start, далее по одной точке на интервал: последнее значение, а также min и
+    max первого поля за интервал. Без прореживания (точек меньше points) -
+    точки как есть
+    """
+    series = []
+    if before is not None:
+        series.append({'t': start, **dict(zip(value_fields, before[1:]))})
+    if len(rows) <= points:
+        series.extend({'t': row[0], **dict(zip(value_fields, row[1:]))} for row in rows)
+        return series, None
+
+    step = max(-(-(end - start) // points), 1)
+    main = value_fields[0]
+    bucket = None
+    for row in rows:
+        index = (row[0] - start) // step
+        value = row[1]
+        if bucket is None or index != bucket['index']:
+            if bucket is not None:
+                series.append(bucket['point'])
+            bucket = {'index': index, 'point': {}, 'min': value, 'max': value}
+        bucket['min'] = min(bucket['min'], value)
+        bucket['max'] = max(bucket['max'], value)
+        bucket['point'] = {
+            't': row[0], **dict(zip(value_fields, row[1:])),
+            f'{main}Min': bucket['min'], f'{main}Max': bucket['max'],
+        }
+    series.append(bucket['point'])
+    return series, step
+
+
+class WatchlistScheduler:
+    LEASE = 'watchlist-poller'
+
+    def __init__(self, store, products, interval=600.0, batch_size=100, lease_ttl=60.0,
+                 retention=365 * 86400):
+        """
+        products - ProductService: пачки загружаются его refresh_cards (лимит
+        запросов и circuit breaker WB) мимо общего кеша карточек
+        """
+        self.store = store
+        self.products = products
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease_ttl = lease_ttl
+        self.retention = retention
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._state = {}
+        self._added = {}
+        self._queue = deque()
+        self._cycle_started = None
+        self._pruned_at = 0
+        self._leader = False
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.polled = 0
+        self.errors = 0
+        self.points = 0
+        self.cycles = 0
+
+    def ensure_started(self):
+        """Запускает фоновый поток, если его нет в этом процессе"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self.owner = f'{socket.gethostname()}:{pid}'
+            self._state = {}
+            self._queue = deque()
+            self._leader = False
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='watchlist', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._leader:
+            self._leader = False
+            try:
+                self.store.release_lease(self.LEASE, self.owner)
+            except sqlite3.Error:
+                pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                wait = self._tick()
+            except Exception:
+                log.exception('watchlist.error', 'Ошибка планировщика watchlist')
+                wait = self.lease_ttl / 3
+            self._stop.wait(wait)
+
+    def _tick(self):
+        """Один шаг: продлить аренду, опросить пачку, если подошло ее время; возвращает паузу"""
+        if not self.store.acquire_lease(self.LEASE, self.owner, self.lease_ttl):
+            if self._leader:
+                log.info('watchlist.lease_lost', 'Опрос watchlist перешел другому процессу')
+            self._leader = False
+            return self.lease_ttl / 3
+        if not self._leader:
+            # Пока опрашивал другой процесс, история могла измениться
+            log.info('watchlist.leader', 'Процесс опрашивает watchlist', owner=self.owner)
+            self._leader = True
+            self._state = {}
+            self._queue = deque()
+
+        now = time.time()
+        if not self._queue:
+            self._plan(now)
+        due, dest, chunk = self._queue[0]
+        if due > now:
+            return min(due - now, self.lease_ttl / 3)
+        self._queue.popleft()
+        if chunk:
+            self.poll(chunk, dest)
+        return 0
+
+    def _plan(self, now):
+        """Пачки следующего цикла с равномерными сроками в пределах интервала"""
+        start = now if self._cycle_started is None else max(now, self._cycle_started + self.interval)
+        self._cycle_started = start
+        self.cycles += 1
+        if self.retention and now - self._pruned_at >= 86400:
+            self._pruned_at = now
+            removed = self.store.prune(int(now - self.retention))
+            if removed:
+                log.info('watchlist.prune', 'Удалена старая история', points=removed)
+
+        by_dest = {}
+        added = {}
+        for nm_id, dest, added_at in self.store.watched():
+            by_dest.setdefault(dest, []).append(nm_id)
+            added[(nm_id, dest)] = added_at
+        # Товар, убранный из списка (возможно, с историей и в другом процессе) или
+        # добавленный заново, начинает с состояния из базы, а не из памяти
+        self._state = {key: state for key, state in self._state.items()
+                       if key in added and self._added.get(key) == added[key]}
+        self._added = added
+        chunks = [
+            (dest, nm_ids[i:i + self.batch_size])
+            for dest, nm_ids in by_dest.items()
+            for i in range(0, len(nm_ids), self.batch_size)
+        ]
+        if not chunks:
+            # Пустой список - проверим снова через интервал
+            self._queue.append((start + self.interval, None, None))
+            return
+        slot = self.interval / len(chunks)
+        self._queue.extend((start + i * slot, dest, chunk) for i, (dest, chunk) in enumerate(chunks))
+
+    def poll(self, nm_ids, dest):
+        """Загружает пачку товаров и дописывает изменения в историю"""
+        try:
+            cards = self.products.refresh_cards(nm_ids, dest)
+        except (WBApiError, CircuitOpenError, RateLimited, requests.exceptions.RequestException) as e:
+            self.errors += 1
+            log.warning('watchlist.poll_error', 'Ошибка опроса пачки watchlist', size=len(nm_ids), dest=dest, error=str(e))
+            return
+        self.polled += len(nm_ids)
+        ts = int(time.time())
+        prices = []
+        stocks = []
+        for nm_id, card in cards.items():
+            product = self.products.project('wb', card)
+            if product is None:
+                continue
+            self._changes((nm_id, dest), product, ts, prices, stocks)
+        self.store.append(prices, stocks)
+        self.points += len(prices) + len(stocks)
+
+    def _changes(self, key, product, ts, prices, stocks):
+        """Точки для изменившейся цены и складов; пропавший склад - количество 0"""
+        if key not in self._state:
+            self._state[key] = self.store.last_state(key)
+        price, quantities = self._state[key]
+
+        current = (product['basicPrice'], product['productPrice'])
+        if current != price:
+            prices.append((*key, ts, *current))
+
+        current_quantities = {}
+        for stock in product.get('warehouses') or []:
+            if stock.get('warehouse_id') is not None:
+                warehouse = int(stock['warehouse_id'])
+                current_quantities[warehouse] = current_quantities.get(warehouse, 0) + (stock.get('quantity') or 0)
+        for warehouse in quantities.keys() - current_quantities.keys():
+            if quantities[warehouse]:
+                current_quantities[warehouse] = 0
+        for warehouse, quantity in current_quantities.items():
+            if quantities.get(warehouse) != quantity:
+                stocks.append((*key, warehouse, ts, quantity))
+
+        self._state[key] = (current, {**quantities, **current_quantities})
+
+    def history(self, key, start, end, points=500):
+        """История товара за [start, end] (unix-время) не более чем в points точек на ряд"""
+        before, rows = self.store.price_series(key, start, end)
+        price, step = downsample(before, rows, start, end, points, ('productPrice', 'basicPrice'))
+        for point in price:
+            point['discount'] = discount_percent(point['basicPrice'], point['productPrice'])
+        warehouses = {}
+        for warehouse, (stock_before, stock_rows) in self.store.stock_series(key, start, end).items():
+            series, stock_step = downsample(stock_before, stock_rows, start, end, points, ('quantity',))
+            warehouses[str(warehouse)] = series
+            step = step or stock_step
+        return {'price': price, 'warehouses': warehouses, 'step': step}
+
+    def stats(self):
+        return {
+            'leader': self._leader,
+            'interval': self.interval,
+            'cycles': self.cycles,
+            'polled': self.polled,
+            'errors': self.errors,
+            'points': self.points,
+            'queued_batches': len(self._queue),
+        }
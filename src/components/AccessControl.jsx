@@ -45,6 +45,8 @@ function AccessControl({ children }) {
       const result = await response.json();
 
       if (result.access) {
+        // Роль нужна страницам: initData к запросам API прикладывают только администраторы
+        sessionStorage.setItem('userRole', result.user?.role || '');
         setStatus('granted');
         tg.expand();
       } else {
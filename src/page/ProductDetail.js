@@ -2,6 +2,17 @@ import { useState, useEffect } from "react";
 import { useParams, Link } from "react-router-dom";
 import styles from './styles/ProductDetail.module.css';
 
+// Подписанные данные Telegram - по ним бэкенд дает приоритет запросам администраторов.
+// Остальным заголовок не нужен: без него GET обходится без CORS preflight
+const apiHeaders = () => {
+  const initData = window.Telegram?.WebApp?.initData;
+  const isAdmin = sessionStorage.getItem('userRole') === 'admin';
+  return initData && isAdmin ? { 'X-Telegram-Init-Data': initData } : {};
+};
+
+// Период опроса товара, когда сервер не принял подписку на изменения (мс)
+const WB_POLL_INTERVAL = 30000;
+
 function ProductDetail() {
   const { id } = useParams();
   const [product, setProduct] = useState(null);
@@ -15,23 +26,21 @@ function ProductDetail() {
     async function fetchProduct() {
       try {
         setLoading(true);
+        setWbLoading(true);
         setError(null);
 
         if (!id || isNaN(id)) {
           throw new Error("Неверный ID товара");
         }
 
-        const response = await fetch(`https://my-telegram-app-production.up.railway.app/api/local/raw/nmInfo?nmId=${id}`);
-
-        if (!response.ok) {
-          const errorData = await response.json();
-          throw new Error(errorData.error || 'Ошибка сервера');
-        }
-
-        const apiData = await response.json();
-        console.log("Данные от локального API:", apiData);
+        // Локальные данные и данные WB одним запросом - бэкенд опрашивает их параллельно
+        const response = await fetch(`https://my-telegram-app-production.up.railway.app/api/product/${id}/full`, {
+          headers: apiHeaders(),
+        });
+        const data = await response.json();
+        console.log("Данные товара:", data);
 
-        const productData = apiData.value || apiData;
+        const productData = data.local ? (data.local.value || data.local) : null;
         
         // Если данные пустые или нет основных полей, считаем что товар не найден
         if (!productData || (!productData.nmId && !productData.price)) {
@@ -41,23 +50,103 @@ function ProductDetail() {
           setProduct(productData);
         }
 
+        setWbProduct(data.wb || null);
+
       } catch (err) {
-        console.error("Ошибка загрузки локальных данных:", err);
+        console.error("Ошибка загрузки данных товара:", err);
         setProduct(null); // Сбрасываем локальные данные
-        // Не устанавливаем ошибку, чтобы можно было показать WB данные
+        setWbProduct(null);
+        // Не устанавливаем ошибку, чтобы можно было повторить загрузку WB данных
       } finally {
         setLoading(false);
+        setWbLoading(false);
       }
     }
 
     fetchProduct();
   }, [id]);
 
-  // Функция для загрузки WB товара
+  // Изменения цены и остатков WB в реальном времени (Server-Sent Events)
+  useEffect(() => {
+    if (!id || isNaN(id) || !window.EventSource) {
+      return undefined;
+    }
+
+    const source = new EventSource(`https://my-telegram-app-production.up.railway.app/api/wb/product/${id}/stream`);
+
+    source.addEventListener("snapshot", (event) => {
+      setWbProduct(JSON.parse(event.data).product);
+    });
+
+    source.addEventListener("change", (event) => {
+      const changes = JSON.parse(event.data);
+      setWbProduct((current) => {
+        if (!current) {
+          return current;
+        }
+        // Остатки по складам: новое количество, null - склад пропал из карточки
+        const warehouses = (current.warehouses || [])
+          .map((warehouse) => {
+            const key = String(warehouse.warehouse_id);
+            return key in changes.warehouses
+              ? { ...warehouse, quantity: changes.warehouses[key] }
+              : warehouse;
+          })
+          .filter((warehouse) => warehouse.quantity !== null);
+        const known = new Set(warehouses.map((warehouse) => String(warehouse.warehouse_id)));
+        Object.entries(changes.warehouses).forEach(([key, quantity]) => {
+          if (quantity !== null && !known.has(key)) {
+            warehouses.push({ warehouse_id: Number(key), quantity });
+          }
+        });
+        return { ...current, ...changes.fields, warehouses };
+      });
+    });
+
+    source.addEventListener("not_found", () => {
+      setWbProduct(null);
+    });
+
+    // Сервер отказал в подписке (503 - заняты потоки) - опрашиваем товар сами
+    let pollTimer = null;
+    const poll = async () => {
+      try {
+        const response = await fetch(`https://my-telegram-app-production.up.railway.app/api/wb/product?nmId=${id}`, {
+          headers: apiHeaders(),
+        });
+        if (response.ok) {
+          setWbProduct((await response.json()).product);
+        }
+      } catch (err) {
+        console.warn("Ошибка обновления данных WB:", err);
+      }
+    };
+
+    // EventSource сам переподключается после обрыва; ошибки опроса WB приходят событием error.
+    // Ответ не text/event-stream (отказ сервера) закрывает источник без переподключения
+    source.addEventListener("error", (event) => {
+      if (event.data) {
+        console.warn("Ошибка обновления данных WB:", JSON.parse(event.data).error);
+      } else if (source.readyState === EventSource.CLOSED && pollTimer === null) {
+        pollTimer = setInterval(poll, WB_POLL_INTERVAL);
+      }
+    });
+
+    return () => {
+      source.close();
+      if (pollTimer !== null) {
+        clearInterval(pollTimer);
+      }
+    };
+  }, [id]);
+
+  // Функция для повторной загрузки WB товара
   const fetchWbProduct = async () => {
     try {
       setWbLoading(true);
-      const response = await fetch(`https://my-telegram-app-production.up.railway.app/api/wb/product?nmId=${id}`);
+      const response = await fetch(`https://my-telegram-app-production.up.railway.app/api/wb/product?nmId=${id}`, {
+        headers: apiHeaders(),
+      });
       
       if (!response.ok) {
         throw new Error('Ошибка загрузки данных с Wildberries');
@@ -73,11 +162,6 @@ function ProductDetail() {
     }
   };
 
-  // Загружаем WB товар при монтировании компонента
-  useEffect(() => {
-    fetchWbProduct();
-  }, [id]);
-
   const formatNumber = (num) => {
     if (num !== undefined && num !== null) {
       return num.toLocaleString();
@@ -281,6 +365,27 @@ function ProductDetail() {
                 {/* Карточка с основной информацией */}
                 <div className={styles.card}>
                   <h2 className={styles.sectionTitle}>Информация с Wildberries</h2>
+
+                  {/* Фото: миниатюры из кеша бэкенда, оригинал - по нажатию */}
+                  {wbProduct.images && wbProduct.images.length > 0 && (
+                    <div className={styles.wbGallery}>
+                      {wbProduct.images.map((image, index) => (
+                        <a
+                          key={image}
+                          href={`https://my-telegram-app-production.up.railway.app${image}`}
+                          target="_blank"
+                          rel="noreferrer"
+                        >
+                          <img
+                            className={styles.wbImage}
+                            src={`https://my-telegram-app-production.up.railway.app${image}?w=256`}
+                            alt={`${wbProduct.name} - фото ${index + 1}`}
+                            loading="lazy"
+                          />
+                        </a>
+                      ))}
+                    </div>
+                  )}
                   
                   <div className={styles.wbHeader}>
                     <div className={styles.wbBrandInfo}>
@@ -343,7 +448,7 @@ function ProductDetail() {
                           className={`${styles.warehouseItem} ${index % 2 === 0 ? styles.warehouseItemEven : styles.warehouseItemOdd}`}
                         >
                           <div className={styles.warehouseDetails}>
-                            <span>Склад ID: {warehouse.warehouse_id}</span>
+                            <span>{warehouse.name || `Склад ID: ${warehouse.warehouse_id}`}</span>
                             <span>Остаток: <strong>{warehouse.quantity}</strong></span>
                             {/* {warehouse.time1 && (
                               <span className={styles.deliveryTime}>